@@ -0,0 +1,216 @@
+import random
+import time
+from collections import deque
+
+from components import Deck
+from engine import CALL, CHECK, FOLD, RAISE
+from evaluator import CARD_KEYS, FLUSH, FULL_HOUSE, HIGHCARD, PAIR, STRAIGHT, THREE_OF_A_KIND, TWO_PAIRS, HandState, \
+    category, key_strength
+from game import VISIBLE_CARDS
+from instrumentation import percentile
+
+# Run-outs sampled between deadline checks
+BATCH_SIZE = 16
+
+# Draws from the range per run-out before the opponents left without a hand are given any two cards
+RANGE_TRIES = 50
+
+# Rough heads-up equity of a made hand on the flop or later, by category, for the estimate a decision starts from
+CATEGORY_EQUITY = {HIGHCARD: 0.3, PAIR: 0.55, TWO_PAIRS: 0.75, THREE_OF_A_KIND: 0.8, STRAIGHT: 0.85, FLUSH: 0.88,
+                   FULL_HOUSE: 0.95}
+
+# Decisions kept for the latency percentiles of EquityPolicy.stats()
+LATENCY_WINDOW = 1000
+
+
+# Instant equity estimate from the hand alone, used until enough run-outs have been sampled:
+#   - before the flop, a formula on the hole cards which puts AA near 0.85, AKs near 0.65 and 72o near 0.35 heads-up
+#   - after it, a guess by the category of the best hand made so far
+# Against several opponents the heads-up estimate is raised to the power of their number
+def estimate_equity(hand, opponents):
+    if len(hand) == 2:
+        high, low = sorted((card.rank for card in hand.cards), reverse=True)
+        if high == low:
+            equity = 0.5 + 0.03 * high
+        else:
+            equity = 0.3 + 0.012 * (high + low) + 0.03 * (hand.cards[0].suit == hand.cards[1].suit)
+    else:
+        equity = CATEGORY_EQUITY.get(category(hand.strength()), 0.97)
+
+    return equity ** opponents
+
+
+# Work in progress on one decision, returned by EquityPolicy.begin()
+# step() samples run-outs for a slice of time and answer() decides from the equity found so far, so a caller can think
+# in slices with its event loop running in between - the decision never takes longer than the policy's time budget
+# plus one batch of samples, however the slices are spread
+class Thought:
+    def __init__(self, policy, engine, seat):
+        game = engine.game
+        board = game.community[:VISIBLE_CARDS[game.stage]]
+        hand = HandState(game.players[seat].cards + board)
+
+        self.policy = policy
+        self.engine = engine
+        self.seat = seat
+        self.started = time.perf_counter()
+        self.deadline = self.started + policy.time_budget
+        self.opponents = sum(not folded for folded in engine.folded) - 1
+        self.estimate = estimate_equity(hand, self.opponents)
+        self.samples = 0
+        self.shares = 0.0
+
+        self.dead = hand.mask
+        self.remaining = [card for card in Deck() if not self.dead >> card & 1]
+        self.missing = 5 - len(board)
+        self.hole_key = hand.key - sum(CARD_KEYS[card] for card in board)
+        self.board_key = hand.key - self.hole_key
+        self.combos = None if policy.range is None else [(first, second) for first, second in policy.range
+                                                          if not self.dead >> first & 1 and not self.dead >> second & 1]
+
+    @property
+    def done(self):
+        return self.samples >= self.policy.samples or time.perf_counter() >= self.deadline
+
+    # Equity against the range, sampled once there are enough run-outs and estimated before that
+    @property
+    def equity(self):
+        return self.shares / self.samples if self.samples >= self.policy.min_samples else self.estimate
+
+    # Sample run-outs for up to seconds (or until the policy's deadline), returning whether the thought is done
+    def step(self, seconds=None):
+        stop = self.deadline if seconds is None else min(self.deadline, time.perf_counter() + seconds)
+        while self.samples < self.policy.samples and time.perf_counter() < stop:
+            self.sample(min(BATCH_SIZE, self.policy.samples - self.samples))
+
+        return self.done
+
+    # Deal the opponents' hands and the rest of the board, and add this seat's share of the pot
+    def sample(self, count):
+        rng = self.policy.rng
+        remaining = self.remaining
+        combos = self.combos
+        missing = self.missing
+        opponents = self.opponents
+        hole_key = self.hole_key
+
+        for _ in range(count):
+            if combos is None:
+                cards = rng.sample(remaining, missing + 2 * opponents)
+                hands = [CARD_KEYS[cards[index]] + CARD_KEYS[cards[index + 1]]
+                         for index in range(missing, len(cards), 2)]
+                cards = cards[:missing]
+            else:
+                used = 0
+                hands = list()
+                tries = 0
+                while len(hands) < opponents:
+                    # A range too narrow to give every opponent a hand of its own falls back to any two cards
+                    tries += 1
+                    if combos and tries <= RANGE_TRIES:
+                        first, second = combos[rng.randrange(len(combos))]
+                    else:
+                        first, second = rng.sample(remaining, 2)
+                    if not used >> first & 1 and not used >> second & 1:
+                        used |= 1 << first | 1 << second
+                        hands.append(CARD_KEYS[first] + CARD_KEYS[second])
+                cards = [card for card in rng.sample(remaining, missing + 2 * opponents) if not used >> card & 1]
+                cards = cards[:missing]
+
+            key = self.board_key
+            for card in cards:
+                key += CARD_KEYS[card]
+            mine = key_strength(key + hole_key)
+            best = mine
+            ties = 1
+            for other in hands:
+                strength = key_strength(key + other)
+                if strength > best:
+                    best = strength
+                    break
+                elif strength == best:
+                    ties += 1
+
+            if best == mine:
+                self.shares += 1 / ties
+
+        self.samples += count
+
+    # Decide from the equity so far, recording the decision's latency
+    def answer(self):
+        decision = self.policy.choose(self.engine, self.seat, self.equity)
+        self.policy.record(time.perf_counter() - self.started, self.samples,
+                           self.samples < self.policy.samples)
+
+        return decision
+
+
+# Policy which bets on its equity - estimated from the hand at once, then sampled against the opponents' range until
+# samples run-outs are done or time_budget seconds have passed, whichever comes first
+#   - range is a list of hole card pairs every opponent is assumed to hold one of, or None for any two cards
+#   - it raises when its equity is at least raise_share of the way from an even share of the pot to all of it, calls
+#     when the equity beats the pot odds by margin, and otherwise checks or folds
+# decide() thinks in one go; begin() returns a Thought to think in slices, which the GUI and the table server use to
+# keep their event loops running - either way the action goes through Engine.act() like any other seat's
+class EquityPolicy:
+    def __init__(self, rng=None, time_budget=0.05, samples=2000, min_samples=100, range=None, raise_share=0.35,
+                 margin=0.02):
+        self.rng = rng or random.Random()
+        self.time_budget = time_budget
+        self.samples = samples
+        self.min_samples = min_samples
+        self.range = range
+        self.raise_share = raise_share
+        self.margin = margin
+
+        self.decisions = 0
+        self.deadline_hits = 0
+        self.total_samples = 0
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+
+    def begin(self, engine, seat):
+        return Thought(self, engine, seat)
+
+    def decide(self, engine, seat):
+        thought = self.begin(engine, seat)
+        thought.step()
+
+        return thought.answer()
+
+    # Action for an equity: raise a share of the pot which grows with the edge, call with the odds, or check/fold
+    def choose(self, engine, seat, equity):
+        game = engine.game
+        owed = engine.owed(seat)
+        fair = 1 / (sum(not folded for folded in engine.folded))
+
+        if equity >= fair + self.raise_share * (1 - fair) and RAISE in engine.legal_actions(seat):
+            amount = max(game.min_bet, int(game.pot * (equity - fair) * 2) // game.min_bet * game.min_bet)
+            return (RAISE, min(amount, engine.max_raise(seat)))
+        elif owed:
+            return (CALL, 0) if equity >= owed / (game.pot + owed) + self.margin else (FOLD, 0)
+
+        return (CHECK, 0)
+
+    def record(self, latency, samples, deadline_hit):
+        self.decisions += 1
+        self.deadline_hits += deadline_hit
+        self.total_samples += samples
+        self.latencies.append(latency)
+
+    def stats(self):
+        return policy_stats([self])
+
+
+# Decisions made by a number of equity policies, how many were cut short by the time budget, run-outs sampled per
+# decision, and the latency percentiles of their last LATENCY_WINDOW decisions each, in milliseconds - measured from
+# begin() to answer(), so time spent between slices counts
+def policy_stats(policies):
+    decisions = sum(policy.decisions for policy in policies)
+    latencies = sorted(latency * 1e3 for policy in policies for latency in policy.latencies)
+    stats = {'decisions': decisions,
+             'deadline_hits': sum(policy.deadline_hits for policy in policies),
+             'samples_per_decision': sum(policy.total_samples for policy in policies) / decisions if decisions else 0.0}
+    if latencies:
+        stats.update(p50_ms=percentile(latencies, 50), p99_ms=percentile(latencies, 99), max_ms=latencies[-1])
+
+    return stats
@@ -1,12 +1,54 @@
+import base64
+import os
+import zipfile
 from tkinter import *
 from tkinter import messagebox
 from tkinter.simpledialog import askinteger
-from time import sleep
+
+from components import REPRS
+from ai import EquityPolicy
+from engine import CALL, CHECK, FOLD, RAISE, Engine
+from evaluator import HandState, hand_name, high_card
+from outs import find_outs
+
+# Every image the GUI shows: the 52 cards, the rear side of a card, the Joker and the empty tile
+IMAGE_NAMES = REPRS + ('b', 'j', 'empty')
+
+# Milliseconds between cards drawn one after another
+DRAW_DELAY = 100
+
+# Milliseconds the computer thinks at a time before letting the Tk event loop run
+THINK_SLICE = 10
+
+# Cards the player has seen in each stage, hole cards included
+SEEN_CARDS = {'opening': 0, 'next': 0, 'pre-flop': 2, 'flop': 5, 'turn': 6, 'river': 7}
+
+
+# Read the GIF data of every image from the images directory, or from a zip archive holding that directory
+def read_images(source='./images'):
+    if source.endswith('.zip'):
+        with zipfile.ZipFile(source) as archive:
+            return {name: archive.read(f'images/{name}.gif') for name in IMAGE_NAMES}
+
+    images = dict()
+    for name in IMAGE_NAMES:
+        with open(os.path.join(source, f'{name}.gif'), 'rb') as file:
+            images[name] = file.read()
+
+    return images
 
 
 # Framework for the GUI and related components
+# The GUI is a thin client over an Engine: the human player's buttons call Engine.act() for seat 0 and the computer's
+# decisions come from the engine's policy for seat 1, an ai.EquityPolicy by default
+# images is the images directory or a zip archive of it, by default './images' or else './images.zip' - every image is
+# decoded once at startup
 class App:
-    def __init__(self, game):
+    def __init__(self, game, engine=None, images=None):
+        engine = engine or Engine(game, [None, EquityPolicy()])
+        self.engine = engine
+        images = images or ('./images' if os.path.isdir('./images') else './images.zip')
+
         # Custom Tk subclass for creating card placeholders
         class CardFrame(Frame):
             def __init__(self, master=None, bg='green', bd='2', relief='solid', relx=1, rely=1, width=75, height=99,
@@ -23,13 +65,27 @@ class App:
                                  activebackground=activebackground, activeforeground=activeforeground, command=command)
                 self.place(relx=relx, rely=rely, relwidth=relwidth)
 
-        # Draw card images on the screen
-        def draw_card_on_screen(card, image, pause=True):
-            card.image = PhotoImage(file=f'./images/{image}.gif')
-            card.configure(image=card.image)
-            card.pack()
-            if pause: sleep(0.1)
-            self.root.update()
+        # Draw card images on the screen, leaving labels which already show the image untouched
+        def draw_card_on_screen(card, image):
+            image = str(image)
+            if shown.get(card) != image:
+                if card not in shown: card.pack()
+                card.configure(image=photos[image])
+                shown[card] = image
+
+        # Draw cards one after another, DRAW_DELAY apart, with the Tk event loop running in between
+        def draw_cards(cards):
+            for index, (card, image) in enumerate(cards):
+                if index == 0:
+                    draw_card_on_screen(card, image)
+                else:
+                    pending.append(self.root.after(DRAW_DELAY * index, draw_card_on_screen, card, image))
+
+        # Cancel the cards still waiting to be drawn, e.g. when the table is cleared
+        def cancel_drawing():
+            for after_id in pending:
+                self.root.after_cancel(after_id)
+            pending.clear()
 
         # Update the pot and player/AI banks after bets are made
         def update_banks():
@@ -41,9 +97,9 @@ class App:
         def configure_buttons(status='default'):
             if status == 'pre-bet':
                 self.deal_button.configure(state='disabled')
-                self.check_button.configure(state='normal')
-                self.raise_button.configure(state='normal')
-                self.fold_button.configure(state='normal')
+                self.check_button.configure(state='normal', text='Call' if engine.owed(0) else 'Check')
+                self.raise_button.configure(state='normal' if RAISE in engine.legal_actions(0) else 'disabled')
+                self.fold_button.configure(state='normal' if FOLD in engine.legal_actions(0) else 'disabled')
                 self.reveal_button.configure(state='disabled')
             elif status == 'river':
                 self.deal_button.configure(state='disabled')
@@ -64,212 +120,201 @@ class App:
                 self.fold_button.configure(state='disabled')
                 self.reveal_button.configure(state='disabled')
 
-            # Remove the ability to raise after a player empties their bank
-            if game.player.funds == 0 or game.computer.funds == 0: self.raise_button.configure(state='disabled')
+        # Enable the buttons which match the engine's state: the player's bet, the reveal, or the next deal
+        def configure_for_engine():
+            if engine.to_act == 0:
+                configure_buttons('pre-bet')
+            elif game.stage == 'end':
+                configure_buttons('river')
+            else:
+                configure_buttons()
 
-        # Deal the appropriate cards and update button configurations based on the current round
-        def deal():
-            self.player_status['text'] = 'Awaiting player bet...'
-            self.computer_status['text'] = str()
+        # Status text describing an action taken by the player or the computer
+        def describe(name, action, player):
+            if action == CHECK:
+                return f'{name} checked...'
+            elif action == FOLD:
+                return f'{name} folded...'
+            elif player.funds == 0:
+                return f'{name} went all-in...'
+            elif action == RAISE:
+                return f'{name} raised...'
+
+            return f'{name} matched...'
+
+        # Let the seats with a policy act, like Engine.advance(), then call then() - a policy which can think in slices
+        # (see ai.EquityPolicy.begin()) does so THINK_SLICE ms at a time with the buttons disabled, so the window keeps
+        # responding however long the decision takes
+        def advance(then):
+            seat = engine.to_act
+            if seat is None or engine.policies[seat] is None:
+                return then()
+
+            policy = engine.policies[seat]
+            if not hasattr(policy, 'begin'):
+                engine.act(*engine.decide())
+                return advance(then)
+
+            thought = policy.begin(engine, seat)
+            configure_buttons('end')
+            self.computer_status['text'] = 'Computer is thinking...'
+
+            def think():
+                if thought.step(THINK_SLICE / 1000):
+                    engine.act(*thought.answer())
+                    advance(then)
+                else:
+                    pending.append(self.root.after(1, think))
 
-            if game.stage == 'opening':
-                configure_buttons('pre-bet')
+            think()
 
-                for card in player_pocket:   draw_card_on_screen(card, game.player.cards[player_pocket.index(card)])
-                for card in computer_pocket: draw_card_on_screen(card, 'b')
+        # Let the computer respond to the player's action, then show what happened
+        def after_bet(start):
+            advance(lambda: show_actions(start))
 
-                game.player.funds -= game.min_bet
-                game.computer.funds -= game.min_bet
-                game.pot += game.min_bet * 2
+        # Show the actions taken since start, then enable the buttons for what comes next
+        def show_actions(start):
+            for stage, seat, action, amount in engine.actions[start:]:
+                if seat == 0:
+                    self.player_status['text'] = describe('Player', action, game.player)
+                else:
+                    self.computer_status['text'] = describe('Computer', action, game.computer)
 
-                game.stage = 'pre-flop'
-                update_banks()
+            update_banks()
 
-            elif game.stage == 'pre-flop':
-                configure_buttons('pre-bet')
-                for card in flops: draw_card_on_screen(card, game.community[flops.index(card)])
-                game.stage = 'flop'
+            if engine.result is not None:
+                end_round(f'{"Player" if engine.result.winners == [0] else "Computer"} wins the pot.')
+            else:
+                configure_for_engine()
 
-            elif game.stage == 'flop':
-                configure_buttons('pre-bet')
-                draw_card_on_screen(turn, game.community[3])
-                game.stage = 'turn'
+        # Finish a round which ended with a fold
+        def end_round(text):
+            if engine.result.winners == [0]:
+                self.player_status['text'] = text
+            else:
+                self.computer_status['text'] = text
 
-            elif game.stage == 'turn':
-                configure_buttons('pre-bet')
-                draw_card_on_screen(river, game.community[4])
-                game.stage = 'river'
-            elif game.stage == 'next':
-                for card in all_cards: draw_card_on_screen(card, 'empty', False)
-                game.stage = 'opening'
+            self.deal_button.configure(text='Next')
+            configure_buttons()
+
+        # Deal the appropriate cards and update button configurations based on the current round
+        def deal():
+            self.player_status['text'] = 'Awaiting player bet...'
+            self.computer_status['text'] = str()
+
+            if game.stage == 'next':
+                engine.deal()
+                cancel_drawing()
+                for card in all_cards: draw_card_on_screen(card, 'empty')
+                update_hand()
                 self.player_status['text'] = str()
                 self.computer_status['text'] = str()
                 self.deal_button.configure(text='Deal')
                 update_banks()
+                return
 
-        # Check the current hand and update button configuration for the next round
-        def check():
-            self.player_status['text'] = 'Player checked...'
-            self.computer_status['text'] = 'Computer checked...'
+            engine.deal()
+            start = len(engine.actions)
 
-            if game.stage == 'river':
-                configure_buttons('river')
-                game.stage = 'end'
+            if game.stage == 'pre-flop':
+                draw_cards(list(zip(player_pocket, game.player.cards)) + [(card, 'b') for card in computer_pocket])
+            elif game.stage == 'flop':
+                draw_cards(list(zip(flops, game.community)))
+            elif game.stage == 'turn':
+                draw_card_on_screen(turn, game.community[3])
             else:
-                configure_buttons()
+                draw_card_on_screen(river, game.community[4])
+            update_hand()
+            after_bet(start)
+
+        # Show the best hand the player's cards make with the community cards dealt so far, and its outs on the flop and
+        # turn - the hand state follows the deal, so each stage adds only its new cards to it
+        def update_hand():
+            visible = SEEN_CARDS.get(game.stage, len(hand))
+            cards = game.player.cards + game.community
+            if hand.cards != cards[:len(hand)]:
+                hand.rewind(0)
+            if len(hand) > visible:
+                hand.rewind(visible)
+            hand.add(*cards[len(hand):visible])
+
+            self.hand_label['text'] = f'You currently have: {hand_name(hand.strength())}' if visible else str()
+            self.outs_label['text'] = find_outs(cards[:2], cards[2:visible]).describe() if visible in (5, 6) else str()
+
+        # Check (or call a bet from the computer) and update button configuration for the next round
+        def check():
+            start = len(engine.actions)
+            engine.act(CALL if engine.owed(0) else CHECK)
+            after_bet(start)
 
         # Raise the current hand and update button configuration for the next round
         def raize():
             while True:
-                try:
-                    # Ask the player for a raise value
-                    amount = askinteger('Raise', 'How much would you like to raise?')
-
-                    # Validate raise value and implement if valid
-                    if game.player.funds >= amount > 0:
-                        if game.computer.funds >= amount:
-                            game.pot += amount * 2
-                            game.player.funds -= amount
-                            game.computer.funds -= amount
-
-                            if game.player.funds == 0:
-                                self.player_status['text'] = 'Player went all-in...'
-                                self.computer_status['text'] = 'Computer matched...'
-                            else:
-                                self.player_status['text'] = 'Player raised...'
-                                self.computer_status['text'] = 'Computer matched...'
-
-                        else:
-                            game.pot += game.computer.funds * 2
-                            game.player.funds -= game.computer.funds
-                            game.computer.funds = 0
-
-                            self.player_status['text'] = 'Player capped the pot...'
-                            self.computer_status['text'] = 'Computer went all-in...'
-
-                        update_banks()
-
-                        return False
-
-                    else:
-                        raize()  # If the raise value is invalid, repeat the raise prompt
-
-                except:
-                    # If the player cancels the raise prompt, default to a check
-                    self.player_status['text'] = 'Player checked...'
-                    self.computer_status['text'] = 'Computer checked...'
-
-                finally:
-                    # Update button configuration based on the current phase
-                    if game.stage == 'river':
-                        configure_buttons('river')
-                        game.stage = 'end'
-                    elif game.stage == 'end':
-                        self.reveal_button.configure(state='normal')
-                    else:
-                        configure_buttons()
-
-                    return False
+                # Ask the player for a raise value
+                amount = askinteger('Raise', 'How much would you like to raise?')
 
-        # Fold and forfeit the current hand
-        def fold():
-            game.computer.won = True
-            game.stage = 'next'
+                # If the player cancels the raise prompt, default to a check
+                if amount is None:
+                    return check()
 
-            game.update_banks()
-            game.new_round()
-
-            self.deal_button.configure(text='Next')
-            configure_buttons()
+                # Validate raise value and implement if valid - the engine caps it at what the computer can match
+                if game.player.funds - engine.owed(0) >= amount > 0:
+                    start = len(engine.actions)
+                    engine.act(RAISE, amount)
+                    return after_bet(start)
 
+        # Fold and forfeit the current hand
+        def fold():
+            engine.act(FOLD)
             self.player_status['text'] = 'Player folded...'
-            self.computer_status['text'] = 'Computer wins the pot.'
+            end_round('Computer wins the pot.')
 
         # Reveal the AI player's cards and determine the winner
         def reveal():
-            for card in computer_pocket: draw_card_on_screen(card, game.computer.cards[computer_pocket.index(card)])
+            draw_cards(list(zip(computer_pocket, game.computer.cards)))
 
             self.reveal_button.configure(state='disabled')
 
-            player_card_values = [int(str(game.player.cards[0])[:-1]), int(str(game.player.cards[1])[:-1])]
-            computer_card_values = [int(str(game.computer.cards[0])[:-1]), int(str(game.computer.cards[1])[:-1])]
-
-            player_kicker = 14 if 1 in player_card_values else max(player_card_values)
-            computer_kicker = 14 if 1 in computer_card_values else max(computer_card_values)
-
-            player_hand = game.check_hand(game.player.cards + game.community)
-            computer_hand = game.check_hand(game.computer.cards + game.community)
-
-            if player_hand[0] > computer_hand[0]:
-                self.player_status['text'] = f'{player_hand[1]} - Player wins the pot.'
-                self.computer_status['text'] = 'Computer lost...'
-                game.player.won = True
+            result = engine.showdown()
+            player_hand, computer_hand = result.hands
 
-            elif player_hand[0] == computer_hand[0] == 1:
-                if player_hand[2] > computer_hand[2]:
-                    self.player_status['text'] = f'{player_hand[2]} high - Player wins the pot.'
-                    self.computer_status['text'] = 'Computer lost...'
-                    game.player.won = True
-
-                elif player_hand[2] < computer_hand[2]:
-                    self.computer_status['text'] = f'{computer_hand[2]} high - Computer wins the pot.'
-                    self.player_status['text'] = 'Player lost...'
-                    game.computer.won = True
-
-                else:
-                    if player_kicker > computer_kicker:
-                        self.player_status['text'] = f'Double {player_hand[1]}, Player wins by kicker.'
-                        self.computer_status['text'] = 'Computer lost the kicker...'
-                        game.player.won = True
-
-                    elif player_kicker < computer_kicker:
-                        self.computer_status['text'] = f'Double {computer_hand[1]}, Computer wins by kicker.'
-                        self.player_status['text'] = 'Player lost the kicker...'
-                        game.computer.won = True
-
-                    else:
-                        self.player_status['text'] = f'{player_hand[1]} Draw - Split the pot.'
-                        self.computer_status['text'] = f'{computer_hand[1]} Draw - Split the pot.'
-                        game.draw = True
-
-            elif player_hand[0] == computer_hand[0]:
-                if player_kicker > computer_kicker:
+            if result.winners == [0]:
+                if player_hand[0] == computer_hand[0] == 1:
+                    self.player_status['text'] = f'{high_card(player_hand[2])} high - Player wins the pot.'
+                elif player_hand[0] == computer_hand[0]:
                     self.player_status['text'] = f'Double {player_hand[1]}, Player wins by kicker.'
-                    self.computer_status['text'] = 'Computer lost the kicker...'
-                    game.player.won = True
+                else:
+                    self.player_status['text'] = f'{player_hand[1]} - Player wins the pot.'
+                self.computer_status['text'] = 'Computer lost...'
 
-                elif player_kicker < computer_kicker:
+            elif result.winners == [1]:
+                if player_hand[0] == computer_hand[0] == 1:
+                    self.computer_status['text'] = f'{high_card(computer_hand[2])} high - Computer wins the pot.'
+                elif player_hand[0] == computer_hand[0]:
                     self.computer_status['text'] = f'Double {computer_hand[1]}, Computer wins by kicker.'
-                    self.player_status['text'] = 'Player lost the kicker...'
-                    game.computer.won = True
-
                 else:
-                    self.player_status['text'] = f'{player_hand[1]} Draw - Split the pot.'
-                    self.computer_status['text'] = f'{computer_hand[1]} Draw - Split the pot.'
-                    game.draw = True
-
-            else:
-                self.computer_status['text'] = f'{computer_hand[1]} - Computer wins the pot.'
+                    self.computer_status['text'] = f'{computer_hand[1]} - Computer wins the pot.'
                 self.player_status['text'] = 'Player lost...'
-                game.computer.won = True
 
-            game.update_banks()
+            else:
+                self.player_status['text'] = f'{player_hand[1]} Draw - Split the pot.'
+                self.computer_status['text'] = f'{computer_hand[1]} Draw - Split the pot.'
 
             if game.player.funds > 0 and game.computer.funds > 0:
                 self.deal_button.configure(text='Next')
-                game.new_round()
                 configure_buttons()
             else:
-                if game.player.won:
+                if result.winners == [0]:
                     messagebox.showinfo('Winner!', 'Computer busted!\nPlayer wins the game!')
-                elif game.computer.won:
+                elif result.winners == [1]:
                     messagebox.showinfo('Winner!', 'Player busted!\nComputer wins the game!')
 
         # Reset the board to its default state
         def reset():
             game.stage = 'opening'
 
-            for card in all_cards: draw_card_on_screen(card, 'empty', False)
+            cancel_drawing()
+            for card in all_cards: draw_card_on_screen(card, 'empty')
 
             configure_buttons()
 
@@ -277,12 +322,24 @@ class App:
             self.computer_status['text'] = str()
 
             game.new_game()
+            engine.reset()
             update_banks()
+            update_hand()
 
         # GUI component definitions
         self.root = Tk()
         self.root.geometry('800x600')
-        self.root.iconphoto(True, PhotoImage(file="./images/j.gif"))
+
+        # Decoded images by name, the image each card label shows and the ids of cards waiting to be drawn
+        photos = {name: PhotoImage(data=base64.b64encode(data).decode())
+                  for name, data in read_images(images).items()}
+        shown = dict()
+        pending = list()
+
+        # The player's cards seen so far, see update_hand()
+        hand = HandState()
+
+        self.root.iconphoto(True, photos['j'])
         self.root.title('Poker')
 
         # Frames
@@ -332,6 +389,11 @@ class App:
         self.computer_status = Label(self.background, font='Terminal', bg='green', justify='c')
 
         self.player_status.place(rely=0.625, relwidth=1)
+
+        self.hand_label = Label(self.background, font='Terminal', bg='green')
+        self.hand_label.place(relx=0.01, rely=0.95)
+        self.outs_label = Label(self.background, font='Terminal', bg='green', justify='c')
+        self.outs_label.place(rely=0.675, relwidth=1)
         self.computer_status.place(rely=0.325, relwidth=1)
 
         # Buttons
@@ -0,0 +1,72 @@
+import numpy as np
+
+from components import CARDS
+from evaluator import tables
+
+# Hands are evaluated this many at a time, which bounds the temporary arrays to a few tens of megabytes
+CHUNK_SIZE = 1 << 16
+
+# Numpy copies of the evaluator tables - the rank table becomes a sorted key array searched with searchsorted()
+FLUSHES, RANKS = tables()
+FLUSH_TABLE = np.array(FLUSHES, dtype=np.int64)
+RANK_KEYS = np.array(sorted(RANKS), dtype=np.int64)
+RANK_VALUES = np.array([RANKS[key] for key in sorted(RANKS)], dtype=np.int64)
+
+# Per-card parts of the evaluator's additive hand keys: the base-5 rank count, and the card's bit in its suit's rank mask
+CARD_RANK_KEYS = np.array([5 ** card.rank for card in CARDS], dtype=np.int64)
+CARD_SUIT_MASKS = np.array([[1 << card.rank if card.suit == suit else 0 for card in CARDS] for suit in range(1, 5)],
+                           dtype=np.int64)
+
+BIT_SHIFTS = np.arange(52, dtype=np.uint64)
+
+
+# Convert a list of hands, each a list of cards, into an (N, k) array of card indices
+def hands_array(hands):
+    return np.array([[int(card) for card in hand] for hand in hands], dtype=np.int8)
+
+
+# Convert an (N, k) array of card indices into an (N,) array of 52-bit masks
+def hands_to_masks(hands):
+    hands = np.asarray(hands, dtype=np.int64)
+    return np.bitwise_or.reduce(np.left_shift(np.uint64(1), hands.astype(np.uint64)), axis=1)
+
+
+# Strengths for one chunk of summed keys - the rank key and the four suits' rank masks
+def keys_strength(rank_keys, suit_masks):
+    flush = FLUSH_TABLE[suit_masks[0]]
+    for masks in suit_masks[1:]:
+        np.maximum(flush, FLUSH_TABLE[masks], out=flush)
+
+    ranks = RANK_VALUES[np.searchsorted(RANK_KEYS, rank_keys)]
+    return np.where(flush > 0, flush, ranks)
+
+
+# Strengths for one chunk of an (n, k) card index array
+def cards_strength(hands):
+    return keys_strength(CARD_RANK_KEYS[hands].sum(axis=1), [masks[hands].sum(axis=1) for masks in CARD_SUIT_MASKS])
+
+
+# Strengths for one chunk of a 1-D array of 52-bit masks
+def masks_strength(masks):
+    bits = (masks[:, None] >> BIT_SHIFTS & np.uint64(1)).astype(np.int64)
+    return keys_strength(bits @ CARD_RANK_KEYS, [bits @ suit_masks for suit_masks in CARD_SUIT_MASKS])
+
+
+# Evaluate many hands at once, either an (N, k) integer array of card indices holding 5 to 7 cards per row, or an (N,)
+# array of 52-bit hand masks
+# Hands are processed chunk_size rows at a time, so memory beyond the input and output arrays stays bounded
+# Returns an (N,) array of strengths, comparable with evaluator.evaluate(), and an (N,) array of hand categories
+def evaluate_batch(hands, chunk_size=CHUNK_SIZE):
+    hands = np.asarray(hands)
+    if hands.ndim == 1:
+        evaluate_chunk, dtype = masks_strength, np.uint64
+    elif hands.ndim == 2 and 5 <= hands.shape[1] <= 7:
+        evaluate_chunk, dtype = cards_strength, np.intp
+    else:
+        raise ValueError(f'expected an (N, 5..7) card array or an (N,) mask array, got shape {hands.shape}')
+
+    strengths = np.empty(len(hands), dtype=np.int64)
+    for start in range(0, len(hands), chunk_size):
+        strengths[start:start + chunk_size] = evaluate_chunk(hands[start:start + chunk_size].astype(dtype, copy=False))
+
+    return strengths, (strengths >> 20).astype(np.int8)
@@ -0,0 +1,254 @@
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from cache import LRUCache
+from components import CARDS
+from engine import Engine, RandomPolicy
+from evaluator import evaluate
+from game import Game
+from instrumentation import percentile
+
+# Number of distinct hands prepared for the evaluation benchmarks, reused in a cycle
+SAMPLE_HANDS = 4096
+
+
+# Size of the hand cache check_hand_cached runs with, as many entries as there are sample hands
+HAND_CACHE_SIZE = SAMPLE_HANDS
+
+
+# Each benchmark builds its inputs from a seed and returns a function which performs a given number of operations
+def bench_check_hand(seed, hand_cache=None):
+    game = Game(seed)
+    game.hand_cache = hand_cache
+    rng = random.Random(seed)
+    hands = [rng.sample(CARDS, 7) for _ in range(SAMPLE_HANDS)]
+
+    def run(number):
+        for index in range(number):
+            game.check_hand(hands[index % SAMPLE_HANDS])
+
+    return run
+
+
+# check_hand with a Game.hand_cache in front of the evaluator - after the warm-up every hand is a hit
+def bench_check_hand_cached(seed):
+    return bench_check_hand(seed, LRUCache(maxsize=HAND_CACHE_SIZE))
+
+
+# check_players of a full table over a cycle of sample deals, with and without a Game.hand_cache the hands all fit in -
+# check_players() is what simulate(), Engine.showdown() and the history writer evaluate hands with
+def bench_check_players(seed, hand_cache=None):
+    game = Game(seed, Game.max_seats)
+    game.hand_cache = hand_cache
+    deals = list()
+    for _ in range(SAMPLE_HANDS // Game.max_seats):
+        game.new_round()
+        deals.append(([player.cards[:] for player in game.players], game.community[:]))
+
+    def run(number):
+        for index in range(number):
+            hands, game.community = deals[index % len(deals)]
+            for player, cards in zip(game.players, hands):
+                player.cards = cards
+            game.check_players()
+
+    return run
+
+
+def bench_check_players_cached(seed):
+    return bench_check_players(seed, LRUCache(maxsize=HAND_CACHE_SIZE))
+
+
+def bench_evaluate(seed):
+    rng = random.Random(seed)
+    hands = [rng.sample(CARDS, 7) for _ in range(SAMPLE_HANDS)]
+
+    def run(number):
+        for index in range(number):
+            evaluate(hands[index % SAMPLE_HANDS])
+
+    return run
+
+
+def bench_batch(seed):
+    import numpy as np
+    from batch import evaluate_batch
+
+    hands = np.argsort(np.random.default_rng(seed).random((SAMPLE_HANDS * 16, 52)), axis=1)[:, :7].astype(np.int8)
+
+    def run(number):
+        for start in range(0, number, len(hands)):
+            evaluate_batch(hands[:min(len(hands), number - start)])
+
+    return run
+
+
+def bench_new_round(seed):
+    game = Game(seed)
+
+    def run(number):
+        for _ in range(number):
+            game.new_round()
+
+    return run
+
+
+def bench_simulate(seed):
+    game = Game(seed)
+
+    def run(number):
+        for _ in range(number):
+            game.simulate(verbose=False)
+
+    return run
+
+
+def bench_engine(seed):
+    engine = Engine(Game(seed), [RandomPolicy(random.Random(seed)), RandomPolicy(random.Random(seed + 1))])
+
+    def run(number):
+        engine.play(number)
+
+    return run
+
+
+# Benchmark name: (setup function, unit of work, operations per timed batch)
+BENCHMARKS = {'check_hand': (bench_check_hand, 'hands', 20000),
+              'check_hand_cached': (bench_check_hand_cached, 'hands', 20000),
+              'check_players': (bench_check_players, 'tables', 5000),
+              'check_players_cached': (bench_check_players_cached, 'tables', 5000),
+              'evaluate': (bench_evaluate, 'hands', 50000),
+              'batch': (bench_batch, 'hands', 500000),
+              'new_round': (bench_new_round, 'rounds', 50000),
+              'simulate': (bench_simulate, 'hands', 10000),
+              'engine': (bench_engine, 'hands', 5000)}
+
+
+# Peak resident memory of this process in kilobytes, or None where the resource module is unavailable
+def peak_memory():
+    if resource is None:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+# Worker: time repeat batches of number operations after a short warm-up, returning the batch times in seconds
+def run_benchmark(name, seed, number, repeat):
+    run = BENCHMARKS[name][0](seed)
+    run(max(number // 10, 1))
+
+    times = list()
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run(number)
+        times.append(time.perf_counter() - start)
+
+    return times, peak_memory()
+
+
+# Run one benchmark in a number of processes at once - throughput is the sum over all processes, and the percentiles
+# are of the time per operation across every timed batch
+def measure(name, cores, number, repeat, seed):
+    with ProcessPoolExecutor(cores) as pool:
+        futures = [pool.submit(run_benchmark, name, seed + worker, number, repeat) for worker in range(cores)]
+        outcomes = [future.result() for future in futures]
+
+    latencies = sorted(batch / number * 1e6 for times, _ in outcomes for batch in times)
+    peaks = [peak for _, peak in outcomes if peak is not None]
+
+    return {'benchmark': name,
+            'cores': cores,
+            'unit': BENCHMARKS[name][1],
+            'ops_per_sec': sum(number * repeat / sum(times) for times, _ in outcomes),
+            'p50_us': percentile(latencies, 50),
+            'p90_us': percentile(latencies, 90),
+            'p99_us': percentile(latencies, 99),
+            'peak_memory_kb': max(peaks) if peaks else None}
+
+
+# Compare results with a baseline, returning a message for each benchmark whose throughput dropped by more than the
+# tolerated fraction
+def compare(results, baseline, tolerance):
+    regressions = list()
+    for key, result in results.items():
+        previous = baseline.get('results', {}).get(key)
+        if previous and result['ops_per_sec'] < previous['ops_per_sec'] * (1 - tolerance):
+            regressions.append(f'{key}: {result["ops_per_sec"]:,.0f} {result["unit"]}/s, '
+                               f'baseline {previous["ops_per_sec"]:,.0f} '
+                               f'({result["ops_per_sec"] / previous["ops_per_sec"] - 1:+.1%})')
+
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measure evaluator, dealing and simulation throughput.')
+    parser.add_argument('benchmarks', nargs='*', default=None, help=f'any of {", ".join(BENCHMARKS)} (default: all)')
+    parser.add_argument('--cores', default=None, help='comma-separated process counts (default: 1,2,4,N)')
+    parser.add_argument('--number', type=int, default=None, help='operations per timed batch')
+    parser.add_argument('--repeat', type=int, default=5, help='timed batches per process')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    parser.add_argument('--baseline', help='compare against the results stored in this JSON file')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='allowed throughput drop against the baseline')
+    args = parser.parse_args(argv)
+
+    names = args.benchmarks or list(BENCHMARKS)
+    unknown = [name for name in names if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f'unknown benchmark {", ".join(unknown)}')
+
+    cpus = os.cpu_count() or 1
+    cores = [int(count) for count in args.cores.split(',')] if args.cores else \
+        sorted({count for count in (1, 2, 4) if count <= cpus} | {cpus})
+
+    results = dict()
+    for name in names:
+        if name == 'batch':
+            try:
+                import numpy
+            except ImportError:
+                print('batch: skipped, NumPy is not installed')
+                continue
+
+        for count in cores:
+            result = measure(name, count, args.number or BENCHMARKS[name][2], args.repeat, args.seed)
+            results[f'{name}@{count}'] = result
+            print(f'{name:>20} x{count:<3} {result["ops_per_sec"]:>14,.0f} {result["unit"]}/s   '
+                  f'p50 {result["p50_us"]:.2f}us  p90 {result["p90_us"]:.2f}us  p99 {result["p99_us"]:.2f}us   '
+                  f'peak {result["peak_memory_kb"] or 0:,} KB')
+
+    report = {'meta': {'python': platform.python_version(),
+                       'platform': platform.platform(),
+                       'cpu_count': cpus,
+                       'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S')},
+              'results': results}
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare(results, json.load(file), args.tolerance)
+        for regression in regressions:
+            print(f'REGRESSION {regression}')
+        if regressions:
+            return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,116 @@
+import os
+import pickle
+import sys
+import threading
+from collections import OrderedDict
+
+# Bytes an OrderedDict spends per entry besides the key and value themselves - its hash table slot and linked-list node
+ENTRY_OVERHEAD = 100
+
+
+# Approximate memory held by one entry, for caches bounded by maxbytes
+def entry_size(key, value):
+    return sys.getsizeof(key) + sys.getsizeof(value) + ENTRY_OVERHEAD
+
+
+# Bounded mapping which evicts the least recently used entry once it holds more than maxsize entries or, given maxbytes,
+# more than that many bytes as measured by sizeof(key, value) - either bound may be None
+# Keeps hit/miss/eviction counters, and can be saved to and reloaded from a pickle file between runs
+# Every operation holds a lock, so one cache can be shared between threads, and setting enabled to False turns it into a
+# cache which never hits nor stores anything, e.g. to benchmark code with and without it
+class LRUCache:
+    def __init__(self, maxsize=4096, path=None, maxbytes=None, sizeof=entry_size):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.sizeof = sizeof
+        self.path = path
+        self.enabled = True
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+        if path is not None and os.path.exists(path):
+            self.load(path)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    # Return the value stored for key, or default, counting the lookup as a hit or a miss
+    def get(self, key, default=None):
+        if not self.enabled:
+            return default
+
+        with self.lock:
+            try:
+                value = self.entries[key]
+            except KeyError:
+                self.misses += 1
+                return default
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        if not self.enabled:
+            return
+
+        with self.lock:
+            if self.maxbytes is not None:
+                if key in self.entries:
+                    self.nbytes -= self.sizeof(key, self.entries[key])
+                self.nbytes += self.sizeof(key, value)
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+
+            while self.maxsize is not None and len(self.entries) > self.maxsize or \
+                    self.maxbytes is not None and self.nbytes > self.maxbytes:
+                old_key, old_value = self.entries.popitem(last=False)
+                if self.maxbytes is not None:
+                    self.nbytes -= self.sizeof(old_key, old_value)
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.nbytes = 0
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions,
+                    'size': len(self.entries),
+                    'maxsize': self.maxsize,
+                    'bytes': self.nbytes if self.maxbytes is not None else None,
+                    'maxbytes': self.maxbytes,
+                    'hit_rate': self.hits / lookups if lookups else 0.0,
+                    'enabled': self.enabled}
+
+    # Write the entries to path (the cache's own path by default), replacing the file atomically
+    def save(self, path=None):
+        path = path or self.path
+        if path is None:
+            raise ValueError('no path to save the cache to')
+        with self.lock:
+            entries = list(self.entries.items())
+        with open(f'{path}.tmp', 'wb') as file:
+            pickle.dump(entries, file, pickle.HIGHEST_PROTOCOL)
+        os.replace(f'{path}.tmp', path)
+
+    # Add the entries saved in path, keeping the most recently used ones if there are more than the bounds allow
+    def load(self, path=None):
+        path = path or self.path
+        if path is None:
+            raise ValueError('no path to load the cache from')
+        with open(path, 'rb') as file:
+            for key, value in pickle.load(file):
+                self.put(key, value)
@@ -0,0 +1,500 @@
+import argparse
+import json
+import math
+import os
+import random
+import struct
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from components import CARDS
+from engine import CALL, CHECK, FOLD, RAISE
+from evaluator import STRAIGHT, STRAIGHT_FLUSH, STRAIGHTS, HandState, category, hand_key, key_strength
+from game import VISIBLE_CARDS, Game
+from preflop import CLASSES, hand_class
+
+STREETS = ('pre-flop', 'flop', 'turn', 'river')
+STREET_CARDS = (0, 3, 4, 5)
+
+# Action slots of an information set: fold, check or call, then one raise slot per raise size
+FOLD_SLOT = 0
+CALL_SLOT = 1
+
+# Betting histories are hashed a token at a time with 64-bit FNV-1a - each action adds its slot + 1 and each new street
+# adds STREET_TOKEN
+STREET_TOKEN = 0
+FNV_OFFSET = 0xCBF29CE484222325
+FNV_PRIME = 0x100000001B3
+HASH_MASK = (1 << 64) - 1
+
+# Postflop card buckets follow the 169 preflop classes: the made hand category (Royal Flush counts as a Straight Flush),
+# whether the hole cards improve on the board, and whether there is a flush or straight draw to come
+BUCKETS = CLASSES + STRAIGHT_FLUSH * 4
+STRAIGHT_WINDOWS = [straight for straight, top in STRAIGHTS]
+
+# File layouts: a header, the abstraction as JSON, then the arrays from the next 64-byte boundary
+#   - trainer state: regret and strategy sums as float32, each rows x actions
+#   - frozen policy: the average strategy as float16, rows x actions
+STATE_MAGIC = b'PKCF'
+POLICY_MAGIC = b'PKCP'
+VERSION = 1
+STATE_HEADER = struct.Struct('<4sHxxQQI')
+POLICY_HEADER = struct.Struct('<4sHxxI')
+
+STATE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tables', 'cfr-state.bin')
+POLICY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tables', 'cfr-policy.bin')
+
+
+def mix(history, token):
+    return (history ^ token) * FNV_PRIME & HASH_MASK
+
+
+def data_offset(header_size, abstraction_json):
+    return -(-(header_size + len(abstraction_json)) // 64) * 64
+
+
+# Heads-up game the solver plays, a coarser copy of the one Game and Engine implement:
+#   - both players start a hand with stack chips and post blind, like Engine.deal() posting Game.min_bet
+#   - a raise is one of raise_sizes times the pot after calling (at least the blind), at most max_raises per street
+#   - cards are bucketed by bucket(), and an information set is the hashed betting history, seat and bucket, folded
+#     into 2 ** bits rows - rows which collide share their regrets, which is what keeps the tables a fixed size
+class Abstraction:
+    def __init__(self, raise_sizes=(0.5, 1.0), max_raises=2, stack=1000, blind=Game.min_bet, bits=20):
+        self.raise_sizes = tuple(raise_sizes)
+        self.max_raises = max_raises
+        self.stack = stack
+        self.blind = blind
+        self.bits = bits
+        self.rows = 1 << bits
+        self.actions = 2 + len(self.raise_sizes)
+
+    def to_json(self):
+        return json.dumps({'raise_sizes': self.raise_sizes, 'max_raises': self.max_raises, 'stack': self.stack,
+                           'blind': self.blind, 'bits': self.bits}).encode()
+
+    @staticmethod
+    def from_json(data):
+        return Abstraction(**json.loads(data))
+
+    def __eq__(self, other):
+        return isinstance(other, Abstraction) and self.to_json() == other.to_json()
+
+    # Raise on top of the call for each raise size, capped at cap
+    def raise_amounts(self, pot, owed, cap=math.inf):
+        return [min(max(self.blind, int(size * (pot + owed))), cap) for size in self.raise_sizes]
+
+    # Legal (slot, raise amount) pairs of a decision - folding is left out when nothing is owed, and raise sizes which
+    # the cap makes equal are only offered once
+    def options(self, pot, owed, raises, cap):
+        options = [(FOLD_SLOT, 0), (CALL_SLOT, 0)] if owed else [(CALL_SLOT, 0)]
+        if raises < self.max_raises and cap > 0:
+            seen = set()
+            for slot, amount in enumerate(self.raise_amounts(pot, owed, cap), 2):
+                if amount not in seen:
+                    seen.add(amount)
+                    options.append((slot, amount))
+
+        return options
+
+    # Card bucket of a seat's hole cards with the visible board
+    def bucket(self, hole, board):
+        if not board:
+            return hand_class(hole)
+
+        hand = HandState(list(hole) + list(board))
+        made = min(category(hand.strength()), STRAIGHT_FLUSH)
+        improved = made > category(HandState(board).strength())
+        draw = len(board) < 5 and made < STRAIGHT and (max(hand.suits) == 4 or any(
+            bin(hand.ranks & window).count('1') == 4 for window in STRAIGHT_WINDOWS))
+
+        return CLASSES + ((made - 1) * 2 + improved) * 2 + draw
+
+    def index(self, history, seat, bucket):
+        key = mix(mix(history, 0x100 + seat), 0x200 + bucket)
+        return (key ^ key >> 32) & (self.rows - 1)
+
+
+# Regret matching over the legal slots of a row - positive regrets normalised, or uniform when none are positive
+def regret_matching(row, options):
+    positives = [max(row[slot], 0.0) for slot, _ in options]
+    total = sum(positives)
+    if total > 0:
+        return [positive / total for positive in positives]
+
+    return [1 / len(options)] * len(options)
+
+
+# One batch of external-sampling MCCFR iterations over a snapshot of the regrets
+# Every iteration deals from its own RNG stream, seeded by the iteration number, and traverses once for each seat: the
+# traverser tries all of its options and accumulates their regrets, the opponent samples one option from its current
+# strategy and accumulates that strategy, weighted by the iteration number (CFR+ linear averaging)
+class Walker:
+    def __init__(self, abstraction, regrets):
+        self.abstraction = abstraction
+        self.regrets = regrets
+        self.regret_deltas = dict()
+        self.strategy_deltas = dict()
+        self.rng = None
+        self.weight = 0
+
+    def run(self, iterations, seed):
+        abstraction = self.abstraction
+        blind = min(abstraction.blind, abstraction.stack)
+        for iteration in iterations:
+            self.rng = random.Random(f'{seed}:{iteration}')
+            self.weight = iteration
+            cards = self.rng.sample(CARDS, 9)
+            holes = (cards[0:2], cards[2:4])
+            board = cards[4:]
+            buckets = [[abstraction.bucket(hole, board[:count]) for count in STREET_CARDS] for hole in holes]
+            strengths = [key_strength(hand_key(hole + board)) for hole in holes]
+
+            for traverser in (0, 1):
+                self.walk((buckets, strengths), traverser, 0, [blind, blind], [blind, blind], 0, [0, 1], FNV_OFFSET)
+
+        return self.regret_deltas, self.strategy_deltas
+
+    # Value to the traverser of a decision by pending[0]
+    def walk(self, deal, traverser, street, contributed, street_bets, raises, pending, history):
+        abstraction = self.abstraction
+        seat = pending[0]
+        other = 1 - seat
+        top = max(street_bets)
+        owed = top - street_bets[seat]
+        funds = abstraction.stack - contributed[seat]
+        cap = max(min(funds - owed, abstraction.stack - contributed[other] + street_bets[other] - top), 0)
+        options = abstraction.options(contributed[0] + contributed[1], owed, raises, cap)
+        index = abstraction.index(history, seat, deal[0][seat][street])
+        strategy = regret_matching(self.regrets[index].tolist(), options)
+
+        def play(option):
+            slot, amount = option
+            if slot == FOLD_SLOT:
+                return contributed[seat] if traverser != seat else -contributed[seat]
+
+            pay = min(owed, funds) if slot == CALL_SLOT else owed + amount
+            after_contributed = list(contributed)
+            after_contributed[seat] += pay
+            after_bets = list(street_bets)
+            after_bets[seat] += pay
+            if slot == CALL_SLOT:
+                after = pending[1:]
+            else:
+                after = [other] if abstraction.stack > contributed[other] else []
+
+            if after:
+                return self.walk(deal, traverser, street, after_contributed, after_bets, raises + (slot != CALL_SLOT),
+                                 after, mix(history, slot + 1))
+
+            return self.next_street(deal, traverser, street, after_contributed, mix(history, slot + 1))
+
+        if seat == traverser:
+            values = [play(option) for option in options]
+            value = sum(probability * option_value for probability, option_value in zip(strategy, values))
+            deltas = self.regret_deltas.get(index)
+            if deltas is None:
+                deltas = self.regret_deltas[index] = [0.0] * abstraction.actions
+            for (slot, _), option_value in zip(options, values):
+                deltas[slot] += option_value - value
+
+            return value
+
+        deltas = self.strategy_deltas.get(index)
+        if deltas is None:
+            deltas = self.strategy_deltas[index] = [0.0] * abstraction.actions
+        for (slot, _), probability in zip(options, strategy):
+            deltas[slot] += self.weight * probability
+
+        return play(self.rng.choices(options, strategy)[0])
+
+    # Close a street: show down after the river, otherwise open the next street's betting, or run it out when a seat is
+    # all-in
+    def next_street(self, deal, traverser, street, contributed, history):
+        stack = self.abstraction.stack
+        if street == 3:
+            strengths = deal[1]
+            stake = min(contributed)
+            if strengths[traverser] == strengths[1 - traverser]:
+                return 0
+            return stake if strengths[traverser] > strengths[1 - traverser] else -stake
+
+        history = mix(history, STREET_TOKEN)
+        pending = [seat for seat in (0, 1) if contributed[seat] < stack]
+        if len(pending) < 2:
+            return self.next_street(deal, traverser, street + 1, contributed, history)
+
+        return self.walk(deal, traverser, street + 1, contributed, [0, 0], 0, pending, history)
+
+
+# Worker state: the regret table, attached from the trainer's shared memory
+WORKER_MEMORY = None
+WORKER_REGRETS = None
+
+
+def attach(name, shape):
+    global WORKER_MEMORY, WORKER_REGRETS
+    WORKER_MEMORY = shared_memory.SharedMemory(name)
+    WORKER_REGRETS = np.ndarray(shape, np.float32, buffer=WORKER_MEMORY.buf)
+
+
+def walk_batch(abstraction_json, iterations, seed):
+    return Walker(Abstraction.from_json(abstraction_json), WORKER_REGRETS).run(iterations, seed)
+
+
+# CFR+ trainer whose regret and strategy sums are rows x actions float32 arrays
+# The regrets live in shared memory, so worker processes read them without copies: each batch of iterations is split
+# between the workers, which walk it against the regrets as they were at the start of the batch and send back their
+# changes, and the trainer adds them up and floors the regrets at zero
+# State is saved to path every checkpoint_every iterations by writing a new file and renaming it over the old one, and
+# a trainer opened on an existing file resumes from it - iterations are seeded by their number, so a resumed run deals
+# the same cards it would have without the interruption
+class Trainer:
+    def __init__(self, path=STATE_PATH, abstraction=None, seed=0):
+        self.path = path
+        self.iteration = 0
+        self.seed = seed
+
+        if os.path.exists(path):
+            with open(path, 'rb') as file:
+                magic, version, self.iteration, self.seed, length = STATE_HEADER.unpack(file.read(STATE_HEADER.size))
+                if magic != STATE_MAGIC or version != VERSION:
+                    raise ValueError(f'{path} is not a version {VERSION} CFR trainer state')
+                saved = Abstraction.from_json(file.read(length))
+            if abstraction is not None and abstraction != saved:
+                raise ValueError(f'{path} was trained with a different abstraction')
+            abstraction = saved
+
+        self.abstraction = abstraction or Abstraction()
+        shape = (self.abstraction.rows, self.abstraction.actions)
+        self.memory = shared_memory.SharedMemory(create=True, size=4 * shape[0] * shape[1])
+        self.regrets = np.ndarray(shape, np.float32, buffer=self.memory.buf)
+        self.strategy = np.zeros(shape, np.float32)
+
+        if self.iteration:
+            offset = data_offset(STATE_HEADER.size, self.abstraction.to_json())
+            saved = np.memmap(path, np.float32, 'r', offset, (2,) + shape)
+            self.regrets[:] = saved[0]
+            self.strategy[:] = saved[1]
+            del saved
+        else:
+            self.regrets[:] = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # Add up the changes the workers sent back for one batch, then floor the regrets of the rows they touched
+    def apply(self, results):
+        touched = list()
+        for regret_deltas, strategy_deltas in results:
+            if regret_deltas:
+                rows = np.fromiter(regret_deltas, np.int64, len(regret_deltas))
+                np.add.at(self.regrets, rows, np.array(list(regret_deltas.values()), np.float32))
+                touched.append(rows)
+            if strategy_deltas:
+                rows = np.fromiter(strategy_deltas, np.int64, len(strategy_deltas))
+                np.add.at(self.strategy, rows, np.array(list(strategy_deltas.values()), np.float32))
+
+        if touched:
+            rows = np.unique(np.concatenate(touched))
+            self.regrets[rows] = np.maximum(self.regrets[rows], 0)
+
+    # Run iterations more iterations, batch at a time, across workers processes (1 walks in this process)
+    def train(self, iterations, workers=1, batch=1000, checkpoint_every=10000, progress=print):
+        abstraction_json = self.abstraction.to_json()
+        pool = None
+        if workers > 1:
+            pool = ProcessPoolExecutor(workers, initializer=attach,
+                                       initargs=(self.memory.name, self.regrets.shape))
+
+        try:
+            begun = self.iteration
+            target = begun + iterations
+            start = time.perf_counter()
+            while self.iteration < target:
+                first = self.iteration + 1
+                count = min(batch, target - self.iteration)
+                shares = [range(first + count * worker // workers, first + count * (worker + 1) // workers)
+                          for worker in range(workers)]
+
+                if pool is None:
+                    self.apply([Walker(self.abstraction, self.regrets).run(shares[0], self.seed)])
+                else:
+                    futures = [pool.submit(walk_batch, abstraction_json, share, self.seed) for share in shares]
+                    self.apply([future.result() for future in futures])
+
+                checkpoint = self.iteration // checkpoint_every != (self.iteration + count) // checkpoint_every
+                self.iteration += count
+                if checkpoint:
+                    self.checkpoint()
+                if progress:
+                    progress(f'{self.iteration:,} iterations, {np.count_nonzero(self.strategy.any(axis=1)):,} '
+                             f'information sets, {(self.iteration - begun) / (time.perf_counter() - start):,.0f}'
+                             f' iterations/s')
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+        self.checkpoint()
+
+    def checkpoint(self):
+        abstraction_json = self.abstraction.to_json()
+        offset = data_offset(STATE_HEADER.size, abstraction_json)
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+
+        with open(self.path + '.tmp', 'wb') as file:
+            file.write(STATE_HEADER.pack(STATE_MAGIC, VERSION, self.iteration, self.seed, len(abstraction_json)))
+            file.write(abstraction_json.ljust(offset - STATE_HEADER.size, b'\0'))
+            file.write(self.regrets.tobytes())
+            file.write(self.strategy.tobytes())
+        os.replace(self.path + '.tmp', self.path)
+
+    # Write the average strategy, normalised per row, as a frozen policy for CFRPolicy
+    def export(self, path=POLICY_PATH):
+        totals = self.strategy.sum(axis=1, keepdims=True)
+        policy = np.divide(self.strategy, totals, out=np.zeros_like(self.strategy), where=totals > 0)
+        abstraction_json = self.abstraction.to_json()
+        offset = data_offset(POLICY_HEADER.size, abstraction_json)
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+
+        with open(path + '.tmp', 'wb') as file:
+            file.write(POLICY_HEADER.pack(POLICY_MAGIC, VERSION, len(abstraction_json)))
+            file.write(abstraction_json.ljust(offset - POLICY_HEADER.size, b'\0'))
+            file.write(policy.astype(np.float16).tobytes())
+        os.replace(path + '.tmp', path)
+
+    def close(self):
+        del self.regrets
+        self.memory.close()
+        self.memory.unlink()
+
+
+# Engine policy playing a frozen strategy exported by Trainer.export(), memory-mapped so that any number of tables
+# (and processes) share one copy of it - heads-up tables only
+# The hand so far is mapped onto the abstraction: raises become the nearest raise size, and an information set the
+# trainer never reached falls back to checking or calling
+class CFRPolicy:
+    def __init__(self, path=POLICY_PATH, rng=None):
+        with open(path, 'rb') as file:
+            magic, version, length = POLICY_HEADER.unpack(file.read(POLICY_HEADER.size))
+            if magic != POLICY_MAGIC or version != VERSION:
+                raise ValueError(f'{path} is not a version {VERSION} CFR policy')
+            abstraction_json = file.read(length)
+
+        self.abstraction = Abstraction.from_json(abstraction_json)
+        self.strategy = np.memmap(path, np.float16, 'r', data_offset(POLICY_HEADER.size, abstraction_json),
+                                  (self.abstraction.rows, self.abstraction.actions))
+        self.rng = rng or random.Random()
+
+    # Hashed betting history of the hand so far, as the trainer would have built it
+    def history(self, engine):
+        abstraction = self.abstraction
+        blind = engine.game.min_bet
+        bets = [blind, blind]
+        pot = 2 * blind
+        street = 0
+        history = FNV_OFFSET
+
+        for stage, seat, action, amount in engine.actions:
+            while street < STREETS.index(stage):
+                history = mix(history, STREET_TOKEN)
+                street += 1
+                bets = [0, 0]
+
+            owed = max(bets) - bets[seat]
+            if action == FOLD:
+                slot, pay = FOLD_SLOT, 0
+            elif action == RAISE:
+                amounts = abstraction.raise_amounts(pot, owed)
+                slot = 2 + min(range(len(amounts)), key=lambda index: abs(math.log(amount / amounts[index])))
+                pay = owed + amount
+            else:
+                slot, pay = CALL_SLOT, amount if action == CALL else 0
+
+            bets[seat] += pay
+            pot += pay
+            history = mix(history, slot + 1)
+
+        while street < STREETS.index(engine.game.stage):
+            history = mix(history, STREET_TOKEN)
+            street += 1
+
+        return history
+
+    def decide(self, engine, seat):
+        game = engine.game
+        if len(game.players) != 2:
+            raise ValueError('CFRPolicy only plays heads-up')
+
+        abstraction = self.abstraction
+        bucket = abstraction.bucket(game.players[seat].cards, game.community[:VISIBLE_CARDS[game.stage]])
+        row = self.strategy[abstraction.index(self.history(engine), seat, bucket)]
+        owed = engine.owed(seat)
+        cap = engine.max_raise(seat) if RAISE in engine.legal_actions(seat) else 0
+        options = abstraction.options(game.pot, owed, engine.raises, cap)
+        weights = [float(row[slot]) for slot, _ in options]
+
+        if sum(weights) > 0:
+            slot, amount = self.rng.choices(options, weights)[0]
+        else:
+            slot, amount = CALL_SLOT, 0
+
+        if slot == FOLD_SLOT:
+            return (FOLD, 0)
+        elif slot == CALL_SLOT:
+            return (CALL, 0) if owed else (CHECK, 0)
+
+        return (RAISE, amount)
+
+
+# Check that training resumes exactly: iterations run straight through and the same iterations run in two sessions,
+# the second resumed from the first one's checkpoint, must leave bit-identical regrets and strategy sums
+def run_tests(iterations=300, resume_at=200):
+    abstraction = Abstraction(bits=12)
+    with tempfile.TemporaryDirectory() as directory:
+        straight, resumed = os.path.join(directory, 'straight.bin'), os.path.join(directory, 'resumed.bin')
+        with Trainer(straight, abstraction) as trainer:
+            trainer.train(iterations, batch=50, progress=None)
+            expected = trainer.regrets.copy(), trainer.strategy.copy()
+
+        with Trainer(resumed, abstraction) as trainer:
+            trainer.train(resume_at, batch=50, progress=None)
+        with Trainer(resumed) as trainer:
+            trainer.train(iterations - resume_at, batch=50, progress=None)
+            assert trainer.iteration == iterations
+            assert np.array_equal(trainer.regrets, expected[0]) and np.array_equal(trainer.strategy, expected[1])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Train a heads-up CFR+ strategy and export it for CFRPolicy.')
+    parser.add_argument('command', choices=('train', 'export'))
+    parser.add_argument('--path', default=STATE_PATH, help='trainer state, resumed if it exists')
+    parser.add_argument('--output', default=POLICY_PATH, help='frozen policy written by export')
+    parser.add_argument('--iterations', type=int, default=100000)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--batch', type=int, default=1000, help='iterations between regret updates')
+    parser.add_argument('--checkpoint-every', type=int, default=10000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--raise-sizes', default='0.5,1', help='raise sizes as fractions of the pot')
+    parser.add_argument('--max-raises', type=int, default=2, help='raises allowed per street')
+    parser.add_argument('--stack', type=int, default=1000)
+    parser.add_argument('--bits', type=int, default=20, help='log2 of the number of information set rows')
+    args = parser.parse_args()
+
+    abstraction = None
+    if args.command == 'export' and not os.path.exists(args.path):
+        parser.error(f'{args.path} does not exist, train first')
+    elif not os.path.exists(args.path):
+        abstraction = Abstraction([float(size) for size in args.raise_sizes.split(',')], args.max_raises, args.stack,
+                                  Game.min_bet, args.bits)
+
+    with Trainer(args.path, abstraction, args.seed) as trainer:
+        if args.command == 'train':
+            trainer.train(args.iterations, args.workers, args.batch, args.checkpoint_every)
+        trainer.export(args.output)
@@ -0,0 +1,314 @@
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from collections import deque
+
+from components import Card
+from equity import EquityResult, sample_runouts
+from stats import Aggregates, StatsJob
+
+# Seconds a worker has to return a shard before it is taken for dead and the shard goes to another worker
+SHARD_TIMEOUT = 60.0
+
+# Seconds a worker keeps trying to reach the coordinator before giving up
+CONNECT_TIMEOUT = 10.0
+
+
+# Shard kernels, run by the workers - each takes the job's parameters, the shard's seed stream and its number of units
+# (run-outs or hands), and returns its partial result as plain JSON data
+def equity_shard(params, stream, count):
+    return vars(sample_runouts(params['hands'], params['board'], count, None, stream))
+
+
+def stats_shard(params, stream, count):
+    return StatsJob(None, stream, params['seats']).run(count).state()
+
+
+# Job kind: (kernel, partial result from its JSON data, merge of a partial result into the total)
+KINDS = {'equity': (equity_shard,
+                    lambda data: EquityResult(len(data['wins']), data['samples'], data['wins'], data['ties'],
+                                              data['shares'], data['squares'])),
+         'stats': (stats_shard, Aggregates.from_state)}
+
+
+# A job split into shards of shard_size units, shard n drawing from the seed stream f'{seed}:{n}' - the shards and so
+# the partial results are the same however many workers there are, and merge() adds them up in shard order, so the
+# totals are identical too, down to the last bit of the floating-point sums
+class Job:
+    def __init__(self, kind, params, units, shard_size, seed=0):
+        self.kind = kind
+        self.params = params
+        self.seed = seed
+        self.shards = [(number, min(shard_size, units - start))
+                       for number, start in enumerate(range(0, units, shard_size))]
+
+    def message(self, number):
+        return {'shard': number, 'kind': self.kind, 'params': self.params, 'stream': f'{self.seed}:{number}',
+                'count': self.shards[number][1]}
+
+    # Total of the partial results of every shard, by shard number
+    def merge(self, results):
+        parse = KINDS[self.kind][1]
+        total = parse(results[0])
+        for number in range(1, len(self.shards)):
+            total.merge(parse(results[number]))
+
+        return total
+
+
+# Hands out a job's shards to the workers which connect, one shard in flight per worker
+# A worker which disconnects, sends something unexpected or takes longer than shard_timeout is dropped and its shard
+# goes back to the front of the queue for the next free worker
+class Coordinator:
+    def __init__(self, job, shard_timeout=SHARD_TIMEOUT, progress=None):
+        self.job = job
+        self.shard_timeout = shard_timeout
+        self.progress = progress
+        self.queue = deque(range(len(job.shards)))
+        self.results = dict()
+        self.available = asyncio.Event()
+        self.finished = asyncio.Event()
+        self.workers = 0
+        self.retries = 0
+        self.worker_cpu = 0.0
+        self.started = time.perf_counter()
+
+    # Next shard to hand out, waiting while every unfinished shard is in flight (one may yet come back), or None once
+    # all of them are done
+    async def next_shard(self):
+        while not self.queue:
+            if self.finished.is_set():
+                return None
+            self.available.clear()
+            await self.available.wait()
+
+        return self.queue.popleft()
+
+    def retry(self, number):
+        if number not in self.results:
+            self.retries += 1
+            self.queue.appendleft(number)
+            self.available.set()
+
+    def complete(self, number, result, cpu):
+        self.results[number] = result
+        self.worker_cpu += cpu
+        if self.progress is not None:
+            self.progress(self, number)
+        if len(self.results) == len(self.job.shards):
+            self.finished.set()
+            self.available.set()
+
+    async def handle(self, reader, writer):
+        self.workers += 1
+        number = None
+        try:
+            while True:
+                number = await self.next_shard()
+                if number is None:
+                    writer.write(b'DONE\n')
+                    await writer.drain()
+                    break
+
+                writer.write(f'SHARD {json.dumps(self.job.message(number))}\n'.encode())
+                await writer.drain()
+                line = await asyncio.wait_for(reader.readline(), self.shard_timeout)
+                words = line.decode().split(' ', 1)
+                if words[0] != 'RESULT':
+                    break
+
+                reply = json.loads(words[1])
+                if reply['shard'] != number:
+                    break
+                self.complete(number, reply['result'], reply['cpu'])
+                number = None
+        except (ConnectionError, asyncio.TimeoutError, ValueError, KeyError, IndexError):
+            pass
+        finally:
+            if number is not None:
+                self.retry(number)
+            self.workers -= 1
+            writer.close()
+
+    # Serve shards on host and port until every one is done, returning the merged total
+    async def run(self, host='127.0.0.1', port=7778, ready=None):
+        server = await asyncio.start_server(self.handle, host, port, limit=1 << 24)
+        async with server:
+            if ready is not None:
+                ready()
+            await self.finished.wait()
+
+        return self.job.merge(self.results)
+
+
+# Worker loop: connect to the coordinator, retrying until it is up, then run shards until it says it is done
+def work(host='127.0.0.1', port=7778, connect_timeout=CONNECT_TIMEOUT):
+    deadline = time.monotonic() + connect_timeout
+    while True:
+        try:
+            connection = socket.create_connection((host, port))
+            break
+        except OSError:
+            if time.monotonic() >= deadline:
+                raise
+            time.sleep(0.1)
+
+    shards = 0
+    with connection, connection.makefile('rwb') as stream:
+        for line in stream:
+            words = line.decode().split(' ', 1)
+            if words[0] != 'SHARD':
+                break
+
+            message = json.loads(words[1])
+            started = time.process_time()
+            result = KINDS[message['kind']][0](message['params'], message['stream'], message['count'])
+            reply = {'shard': message['shard'], 'result': result, 'cpu': time.process_time() - started}
+            stream.write(f'RESULT {json.dumps(reply)}\n'.encode())
+            stream.flush()
+            shards += 1
+
+    return shards
+
+
+# Start workers local worker processes for a coordinator on host and port
+def spawn_workers(workers, host, port):
+    script = os.path.abspath(__file__)
+    return [subprocess.Popen([sys.executable, script, '--host', host, '--port', str(port), 'worker'])
+            for _ in range(workers)]
+
+
+# Check that a job's total doesn't depend on its workers: an equity and a stats job run by one worker, and run again by
+# three workers while another client takes a shard and disconnects without answering, must merge to identical totals -
+# with the dropped shard retried by the others
+def run_tests(host='127.0.0.1'):
+    with socket.socket() as probe:
+        probe.bind((host, 0))
+        port = probe.getsockname()[1]
+
+    jobs = [Job('equity', {'hands': [[0, 48], [44, 45]], 'board': []}, 40000, 2000, 3),
+            Job('stats', {'seats': 3}, 2000, 200, 3)]
+    for job in jobs:
+        totals = list()
+        for workers, drop in ((1, False), (3, True)):
+            threads = [threading.Thread(target=work, args=(host, port)) for _ in range(workers)]
+
+            # Take a shard and hang up before the workers connect, so the shard has to be handed out again
+            def start():
+                if drop:
+                    with socket.create_connection((host, port)) as connection, connection.makefile('rb') as stream:
+                        assert stream.readline().startswith(b'SHARD ')
+                for thread in threads:
+                    thread.start()
+
+            coordinator = Coordinator(job)
+            starter = threading.Thread(target=start)
+            total = asyncio.run(coordinator.run(host, port, starter.start))
+            for thread in [starter] + threads:
+                thread.join()
+
+            assert coordinator.retries == drop
+            totals.append(total.state() if job.kind == 'stats' else vars(total))
+
+        assert totals[0] == totals[1]
+
+
+def parse_cards(text):
+    return [int(Card.from_str(card)) for card in text.split(',') if card]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run equity or statistics jobs on a cluster of TCP workers.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=7778)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    command = commands.add_parser('equity', help='coordinate a Monte Carlo equity job')
+    command.add_argument('hands', nargs='+', help='two hole cards per hand, comma-separated, e.g. 1h,13h')
+    command.add_argument('--board', default='')
+    command.add_argument('--samples', type=int, default=10000000)
+    command.add_argument('--shard-size', type=int, default=200000, help='run-outs per shard')
+
+    command = commands.add_parser('stats', help='coordinate a statistics job like stats.py')
+    command.add_argument('-n', '--hands', type=int, default=1000000)
+    command.add_argument('--seats', type=int, default=2)
+    command.add_argument('--shard-size', type=int, default=20000, help='hands per shard')
+
+    for command in commands.choices.values():
+        command.add_argument('--seed', type=int, default=0)
+        command.add_argument('--workers', type=int, default=0, help='local worker processes to start')
+        command.add_argument('--shard-timeout', type=float, default=SHARD_TIMEOUT)
+
+    command = commands.add_parser('worker', help='run shards for a coordinator')
+    command.add_argument('--connect-timeout', type=float, default=CONNECT_TIMEOUT)
+    args = parser.parse_args(argv)
+
+    if args.command == 'worker':
+        try:
+            work(args.host, args.port, args.connect_timeout)
+        except (OSError, KeyboardInterrupt):
+            return 1
+        return 0
+
+    if args.command == 'equity':
+        params = {'hands': [parse_cards(hand) for hand in args.hands], 'board': parse_cards(args.board)}
+        job = Job('equity', params, args.samples, args.shard_size, args.seed)
+    else:
+        job = Job('stats', {'seats': args.seats}, args.hands, args.shard_size, args.seed)
+
+    def progress(coordinator, number):
+        done = len(coordinator.results)
+        print(f'\r{done:>6} / {len(job.shards)} shards  {coordinator.workers:>4} workers  '
+              f'{coordinator.retries} retried  {time.perf_counter() - coordinator.started:8.1f}s',
+              end='', file=sys.stderr, flush=True)
+
+    coordinator = None
+    processes = list()
+
+    # Stop rather than wait forever if every local worker has exited and no other worker is connected
+    async def coordinate():
+        nonlocal coordinator
+        coordinator = Coordinator(job, args.shard_timeout, progress)
+        task = asyncio.ensure_future(coordinator.run(
+            args.host, args.port, lambda: processes.extend(spawn_workers(args.workers, args.host, args.port))))
+        while not task.done():
+            await asyncio.wait([task], timeout=1.0)
+            if processes and all(process.poll() is not None for process in processes) and not coordinator.workers \
+                    and not task.done():
+                task.cancel()
+                raise SystemExit('the local workers exited before the job was done')
+
+        return task.result()
+
+    began = time.perf_counter()
+    cpu = time.process_time()
+    try:
+        total = asyncio.run(coordinate())
+    finally:
+        for process in processes:
+            process.wait()
+    seconds = time.perf_counter() - began
+    cpu = time.process_time() - cpu
+    print(file=sys.stderr)
+
+    units = sum(count for _, count in job.shards)
+    print(f'{units:,} {"run-outs" if job.kind == "equity" else "hands"} in {len(job.shards)} shards, {seconds:.1f}s, '
+          f'{units / seconds:,.0f}/s, {coordinator.retries} shards retried, coordinator '
+          f'{cpu / (cpu + coordinator.worker_cpu):.1%} of the CPU time')
+    if job.kind == 'equity':
+        for hand, equity in zip(args.hands, total.equity):
+            print(f'{hand:>10} {equity:8.4%}')
+    else:
+        print(json.dumps(total.report()['bankroll']))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
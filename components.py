@@ -1,42 +1,110 @@
 import random
 
 
+# Single-character suit names, indexed by suit number - 1
+SUITS = 'cdhs'
+
+
 # Simple card object, represented as a value which matches the image filenames
-class Card:
-    def __init__(self, suit, value):
-        self.suit = suit
-        self.value = value
+# Each card is stored as a single integer from 0 to 51, (value - 1) * 4 + (suit - 1), so the four suits of a value
+# share one 4-bit nibble when cards are combined into a 52-bit hand mask
+class Card(int):
+    __slots__ = ()
+
+    # Cards are immutable, so every Card(suit, value) call returns one of the 52 shared instances
+    def __new__(cls, suit, value):
+        return CARDS[(value - 1) * 4 + suit - 1]
+
+    def __getnewargs__(self):
+        return self.suit, self.value
 
     def __repr__(self):
-        if self.suit == 1:
-            s_rep = 'c'
-        elif self.suit == 2:
-            s_rep = 'd'
-        elif self.suit == 3:
-            s_rep = 'h'
-        elif self.suit == 4:
-            s_rep = 's'
+        return REPRS[self]
+
+    __str__ = __repr__
+
+    @property
+    def suit(self):
+        return self % 4 + 1
+
+    @property
+    def value(self):
+        return self // 4 + 1
+
+    # Value on an ace-high scale, where 0 is a Two and 12 is an Ace
+    @property
+    def rank(self):
+        return (self // 4 + 12) % 13
+
+    @property
+    def mask(self):
+        return MASKS[self]
+
+    # Look up a card from its string representation, e.g. '10h'
+    @staticmethod
+    def from_str(text):
+        return CARDS[(int(text[:-1]) - 1) * 4 + SUITS.index(text[-1])]
 
-        return f'{self.value}{s_rep}'
+
+CARDS = tuple(int.__new__(Card, index) for index in range(52))
+MASKS = tuple(1 << index for index in range(52))
+REPRS = tuple(f'{index // 4 + 1}{SUITS[index % 4]}' for index in range(52))
+
+
+# Combine cards into a 52-bit mask - cards may be Card objects, their integer indices or strings such as '10h'
+# An integer that is not a Card is assumed to already be a mask and is returned unchanged
+def hand_mask(cards):
+    if isinstance(cards, int) and not isinstance(cards, Card):
+        return cards
+
+    mask = 0
+    for card in cards:
+        mask |= MASKS[Card.from_str(card) if isinstance(card, str) else card]
+
+    return mask
+
+
+# Expand a 52-bit mask back into a list of cards
+def mask_cards(mask):
+    return [CARDS[index] for index in range(52) if mask >> index & 1]
 
 
 # Generates a list of cards with methods to draw and shuffle
+# The deck always holds all 52 cards - cards before the top index have been dealt, so a deck can be reset and reused
+# every round without creating new objects
+# rng may be a random.Random instance, which is used as it is, or a seed for a new one; by default the deck gets a new
+# unseeded random.Random
 class Deck(list):
-    def __init__(self):
-        super().__init__()
+    def __init__(self, rng=None):
+        super().__init__(CARDS)
+        if rng is None:
+            self.rng = random.Random()
+        elif isinstance(rng, (int, float, str, bytes, bytearray)):
+            self.rng = random.Random(rng)
+        else:
+            self.rng = rng
+        self.top = 0
 
-        suits = list(range(1, 5))
-        values = list(range(1, 14))
+    # Return every dealt card to the deck
+    def reset(self):
+        self.top = 0
 
-        [[self.append(Card(s, v)) for s in suits] for v in values]
-
-    # Randomize deck
-    def shuffle(self):
-        random.shuffle(self)
+    # Randomize the next count undealt cards (all of them by default) with a partial Fisher-Yates shuffle, which is
+    # all a hand needs since the rest of the deck is never dealt
+    def shuffle(self, count=52):
+        rand = self.rng.random
+        for index in range(self.top, min(self.top + count, 52)):
+            other = index + int(rand() * (52 - index))
+            self[index], self[other] = self[other], self[index]
 
     # Add a card to the specified list
     def draw(self, location):
-        location.append(self.pop(0))
+        location.append(self[self.top])
+        self.top += 1
+
+    # Cards which have not been dealt yet
+    def remaining(self):
+        return self[self.top:]
 
 
 # Player object to keep track of cards, wages, etc.
@@ -0,0 +1,299 @@
+import random
+import time
+
+# Betting actions
+CHECK = 'check'
+CALL = 'call'
+RAISE = 'raise'
+FOLD = 'fold'
+
+# The street each deal moves to, and the stage once betting on the river is over
+NEXT_STAGE = {'opening': 'pre-flop', 'pre-flop': 'flop', 'flop': 'turn', 'turn': 'river'}
+
+
+# Policy for the computer player in the GUI: check when nothing is owed, otherwise match the bet
+class PassivePolicy:
+    def decide(self, engine, seat):
+        return (CALL, 0) if engine.owed(seat) else (CHECK, 0)
+
+
+# Policy which picks a random legal action - raises are a random share of the largest allowed raise
+class RandomPolicy:
+    def __init__(self, rng=None, raise_chance=0.2, fold_chance=0.1):
+        self.rng = rng or random.Random()
+        self.raise_chance = raise_chance
+        self.fold_chance = fold_chance
+
+    def decide(self, engine, seat):
+        actions = engine.legal_actions(seat)
+        roll = self.rng.random()
+
+        if RAISE in actions and roll < self.raise_chance:
+            return (RAISE, max(1, int(engine.max_raise(seat) * self.rng.random())))
+        elif engine.owed(seat) and roll < self.raise_chance + self.fold_chance:
+            return (FOLD, 0)
+
+        return (CALL, 0) if engine.owed(seat) else (CHECK, 0)
+
+
+# Outcome of one hand
+#   - winners is the list of seats sharing the main pot
+#   - hands holds each seat's check_hand() result at a showdown, or None for seats which folded or weren't shown
+#   - pot is the amount which was paid out, and payouts the share of it each seat received
+class HandResult:
+    def __init__(self, winners, hands, pot, showdown, payouts=None):
+        self.winners = winners
+        self.hands = hands
+        self.pot = pot
+        self.showdown = showdown
+        self.payouts = payouts
+
+    def __repr__(self):
+        return f'HandResult(winners={self.winners}, pot={self.pot}, showdown={self.showdown})'
+
+
+# Headless rules engine which drives a Game through the opening, pre-flop, flop, turn, river and showdown stages
+# Decisions come from one policy per seat - a seat whose policy is None is decided from outside, e.g. by the GUI, by
+# calling act() while that seat is to_act
+# With Game.instruments set it also records stage times, decision times, actions, all-ins, folds and showdowns
+# and with Game.history set every finished hand is appended to a hand history, see history.HistoryWriter
+class Engine:
+    max_raises = 4
+
+    def __init__(self, game, policies=None):
+        self.game = game
+        self.policies = list(policies) if policies else [PassivePolicy() for _ in game.players]
+        if len(self.policies) != len(game.players):
+            raise ValueError(f'expected {len(game.players)} policies, got {len(self.policies)}')
+        self.reset()
+
+    # Clear all betting state, e.g. after Game.new_game()
+    def reset(self):
+        seats = len(self.game.players)
+        self.to_act = None
+        self.pending = list()
+        self.street_bets = [0] * seats
+        self.contributed = [0] * seats
+        self.folded = [False] * seats
+        self.raises = 0
+        self.actions = list()
+        self.result = None
+
+    @property
+    def players(self):
+        return self.game.players
+
+    # Amount a seat must add to match the largest bet of the current street
+    def owed(self, seat):
+        return max(self.street_bets) - self.street_bets[seat]
+
+    # Largest raise a seat can make on top of calling - capped by its own funds and by the most any other live player
+    # could still put in to match it
+    def max_raise(self, seat):
+        bets = self.street_bets
+        folded = self.folded
+        reachable = 0
+        for other, player in enumerate(self.game.players):
+            if other != seat and not folded[other] and player.funds + bets[other] > reachable:
+                reachable = player.funds + bets[other]
+
+        top = max(bets)
+        return max(min(self.game.players[seat].funds - top + bets[seat], reachable - top), 0)
+
+    # A seat which owes nothing can always check, so folding is only offered against a bet
+    def legal_actions(self, seat):
+        if self.raises < self.max_raises and self.max_raise(seat) > 0:
+            return [CALL, RAISE, FOLD] if self.owed(seat) else [CHECK, RAISE]
+
+        return [CALL, FOLD] if self.owed(seat) else [CHECK]
+
+    # Move chips from a seat's funds into the pot
+    def bet(self, seat, amount):
+        self.players[seat].funds -= amount
+        self.street_bets[seat] += amount
+        self.contributed[seat] += amount
+        self.game.pot += amount
+
+    # Deal the next street and open its betting round
+    # From 'next' (after Game.new_round()) this only returns the table to 'opening'; from 'opening' it posts the blinds
+    def deal(self):
+        game = self.game
+
+        if self.to_act is not None:
+            raise ValueError(f'betting on the {game.stage} is still open')
+        elif game.stage == 'next':
+            game.stage = 'opening'
+            return
+        elif game.stage not in NEXT_STAGE:
+            raise ValueError(f'cannot deal during the {game.stage} stage')
+
+        if game.stage == 'opening':
+            self.reset()
+            if game.instruments is not None:
+                game.instruments.begin_hand()
+            for seat, player in enumerate(self.players):
+                self.bet(seat, min(game.min_bet, player.funds))
+        else:
+            self.street_bets = [0] * len(self.street_bets)
+
+        game.stage = NEXT_STAGE[game.stage]
+        if game.instruments is not None:
+            game.instruments.enter_stage(game.stage)
+        self.raises = 0
+        self.pending = self.able_seats()
+
+        if len(self.pending) < 2 and not any(self.owed(seat) for seat in self.pending):
+            self.close_betting()
+        else:
+            self.to_act = self.pending[0]
+
+    # Seats which are still in the hand and have funds left to bet, in acting order after a given seat
+    def able_seats(self, after=-1):
+        players = self.players
+        order = list(range(after + 1, len(players))) + list(range(after + 1))
+
+        return [seat for seat in order if not self.folded[seat] and players[seat].funds > 0]
+
+    # Apply the decision of the seat to act
+    def act(self, action, amount=0):
+        seat = self.to_act
+        if seat is None:
+            raise ValueError('no seat is waiting to act')
+        elif action not in self.legal_actions(seat):
+            raise ValueError(f'{action} is not allowed, expected one of {self.legal_actions(seat)}')
+
+        if action == FOLD:
+            self.folded[seat] = True
+        elif action == CALL:
+            amount = min(self.owed(seat), self.players[seat].funds)
+            self.bet(seat, amount)
+        elif action == RAISE:
+            amount = min(amount, self.max_raise(seat))
+            if amount <= 0:
+                raise ValueError('a raise must be a positive amount')
+            self.bet(seat, self.owed(seat) + amount)
+            self.raises += 1
+            self.pending = self.able_seats(seat)
+
+        self.actions.append((self.game.stage, seat, action, amount))
+        instruments = self.game.instruments
+        if instruments is not None:
+            instruments.count('actions', ('action', action))
+            if action != FOLD and amount and self.players[seat].funds == 0:
+                instruments.count('all_ins')
+        if seat in self.pending:
+            self.pending.remove(seat)
+
+        live = [seat for seat in range(len(self.folded)) if not self.folded[seat]]
+        if len(live) == 1:
+            self.to_act = None
+            self.finish(live, None)
+        elif not self.pending:
+            self.close_betting()
+        else:
+            self.to_act = self.pending[0]
+
+    def close_betting(self):
+        self.to_act = None
+        self.pending = list()
+        if self.game.stage == 'river':
+            self.game.stage = 'end'
+            if self.game.instruments is not None:
+                self.game.instruments.enter_stage('end')
+
+    # Ask the policy of the seat to act for its decision
+    def decide(self):
+        instruments = self.game.instruments
+        if instruments is None:
+            return self.policies[self.to_act].decide(self, self.to_act)
+
+        start = time.perf_counter()
+        decision = self.policies[self.to_act].decide(self, self.to_act)
+        instruments.observe('decision', time.perf_counter() - start)
+
+        return decision
+
+    # Let every seat with a policy act until a seat decided from outside is to act, or betting closes
+    def advance(self):
+        while self.to_act is not None and self.policies[self.to_act] is not None:
+            self.act(*self.decide())
+
+    # Compare the live hands once betting on the river is over, then pay out the pot and any side pots
+    def showdown(self):
+        game = self.game
+        if game.stage != 'end' or self.to_act is not None:
+            raise ValueError(f'cannot show down during the {game.stage} stage')
+
+        hands = game.check_players([seat for seat, folded in enumerate(self.folded) if not folded])
+        best = max(hand[2] for hand in hands if hand)
+
+        return self.finish([seat for seat, hand in enumerate(hands) if hand and hand[2] == best], hands)
+
+    # Pay the pot through Game.update_banks() - split between the hands shown down, or to the one seat left after
+    # everyone else folded - and start the next round if everyone can still play
+    # Either way the pots go through Game.split_pot(), so the last seat left only wins what it matched and a bet nobody
+    # live matched goes back to the seats which made it
+    def finish(self, winners, hands):
+        game = self.game
+        players = self.players
+
+        if len(winners) == 1:
+            players[winners[0]].won = True
+        else:
+            game.draw = True
+
+        if hands is None:
+            shown = [None] * len(players)
+            shown[winners[0]] = (None, None, 0)
+            payouts = game.split_pot(self.contributed, shown)
+        else:
+            payouts = game.split_pot(self.contributed, hands)
+
+        self.result = HandResult(winners, hands or [None] * len(players), game.pot, hands is not None, payouts)
+        if game.instruments is not None:
+            game.instruments.count('showdowns' if hands is not None else 'folds')
+            game.instruments.end_hand()
+        if game.history is not None:
+            game.history.write(self)
+        game.update_banks(payouts)
+
+        if all(player.funds > 0 for player in players):
+            game.new_round()
+
+        return self.result
+
+    # True once a hand has finished with a player out of funds
+    @property
+    def game_over(self):
+        return self.result is not None and any(player.funds <= 0 for player in self.players)
+
+    # Play one complete hand with the seat policies and return its result
+    def play_hand(self):
+        game = self.game
+        if game.stage == 'next':
+            self.deal()
+        self.result = None
+
+        while self.result is None:
+            if self.to_act is not None:
+                self.act(*self.decide())
+            elif game.stage == 'end':
+                self.showdown()
+            else:
+                self.deal()
+
+        return self.result
+
+    # Play a number of hands, starting a new game whenever a player busts if rebuy is set (otherwise stopping)
+    # Returns the number of hands played
+    def play(self, hands, rebuy=True):
+        for played in range(hands):
+            if self.game_over:
+                if not rebuy:
+                    return played
+                self.game.new_game()
+                self.reset()
+
+            self.play_hand()
+
+        return hands
@@ -0,0 +1,236 @@
+import itertools
+import math
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from cache import LRUCache
+from components import CARDS, Deck, hand_mask, mask_cards
+from evaluator import CARD_KEYS, hand_key, key_strength
+
+# Samples drawn between deadline checks when running against a time budget
+BATCH_SIZE = 256
+
+# Every way of relabelling the four suits, as a tuple mapping old suit index to new suit index
+SUIT_PERMUTATIONS = list(itertools.permutations(range(4)))
+
+# Exact results by canonical situation, shared by all exact_equity() calls that don't pass their own cache
+EXACT_CACHE = LRUCache(maxsize=4096)
+
+
+# Win/tie/loss counts for each player over a number of sampled or enumerated run-outs
+# shares and squares accumulate each player's share of the pot per run-out, used for equity and its variance
+class EquityResult:
+    def __init__(self, players, samples=0, wins=None, ties=None, shares=None, squares=None, seed=None):
+        self.samples = samples
+        self.wins = wins or [0] * players
+        self.ties = ties or [0] * players
+        self.shares = shares or [0.0] * players
+        self.squares = squares or [0.0] * players
+        self.seed = seed
+
+    # Combine another result for the same players into this one
+    def merge(self, other):
+        self.samples += other.samples
+        for player in range(len(self.wins)):
+            self.wins[player] += other.wins[player]
+            self.ties[player] += other.ties[player]
+            self.shares[player] += other.shares[player]
+            self.squares[player] += other.squares[player]
+
+        return self
+
+    @property
+    def win(self):
+        return [wins / self.samples for wins in self.wins]
+
+    @property
+    def tie(self):
+        return [ties / self.samples for ties in self.ties]
+
+    @property
+    def loss(self):
+        return [1 - (wins + ties) / self.samples for wins, ties in zip(self.wins, self.ties)]
+
+    # Expected share of the pot, counting a tie as an equal split between the tied players
+    @property
+    def equity(self):
+        return [shares / self.samples for shares in self.shares]
+
+    # Normal-approximation confidence interval for each player's equity, 95% by default
+    def interval(self, z=1.96):
+        intervals = list()
+        for shares, squares in zip(self.shares, self.squares):
+            mean = shares / self.samples
+            error = z * math.sqrt(max(squares / self.samples - mean * mean, 0) / self.samples)
+            intervals.append((max(mean - error, 0), min(mean + error, 1)))
+
+        return intervals
+
+    def __repr__(self):
+        return f'EquityResult(samples={self.samples}, equity={[round(e, 4) for e in self.equity]})'
+
+
+# Score one run-out: find the best strength among the players and credit wins, ties and pot shares
+def score(result, strengths):
+    best = max(strengths)
+    winners = [player for player, strength in enumerate(strengths) if strength == best]
+    share = 1 / len(winners)
+
+    for player in winners:
+        if len(winners) == 1:
+            result.wins[player] += 1
+        else:
+            result.ties[player] += 1
+        result.shares[player] += share
+        result.squares[player] += share * share
+
+    result.samples += 1
+
+
+# Worker for monte_carlo_equity(): deal random completions of the board from one seeded RNG stream
+# Stops after samples run-outs, or at the deadline (a time.time() value) if one is given
+def sample_runouts(hands, board, samples, deadline, stream):
+    rng = random.Random(stream)
+    dead = hand_mask(board)
+    for hand in hands:
+        dead |= hand_mask(hand)
+
+    remaining = [card for card in Deck() if not dead >> card & 1]
+    hole_keys = [hand_key(hand) for hand in hands]
+    board_key = hand_key(board)
+    missing = 5 - len(board)
+    result = EquityResult(len(hands))
+
+    while result.samples < samples:
+        for _ in range(min(BATCH_SIZE, samples - result.samples)):
+            key = board_key
+            for card in rng.sample(remaining, missing):
+                key += CARD_KEYS[card]
+            score(result, [key_strength(key + hole_key) for hole_key in hole_keys])
+
+        if deadline is not None and time.time() >= deadline:
+            break
+
+    return result
+
+
+# Hands and board as lists of cards, checking there are two or more hands of two hole cards, a board of 0, 3, 4 or 5
+# cards, and no card dealt twice - within a hand, between the hands or with the board
+def check_cards(hands, board):
+    dead = hand_mask(board)
+    masks = list()
+    for hand in hands:
+        mask = hand_mask(hand)
+        if mask & dead:
+            raise ValueError(f'{" ".join(map(str, mask_cards(mask & dead)))} dealt twice')
+        dead |= mask
+        masks.append(mask)
+
+    hands = [mask_cards(mask) for mask in masks]
+    board = mask_cards(hand_mask(board))
+    if len(hands) < 2 or any(len(hand) != 2 for hand in hands):
+        raise ValueError('equity needs two or more hands of two hole cards each')
+    if len(board) not in (0, 3, 4, 5):
+        raise ValueError(f'board must hold 0, 3, 4 or 5 cards, not {len(board)}')
+
+    return hands, board
+
+
+# Estimate each player's win/tie/loss equity by dealing random completions of a partial board
+#   - hands is a list of two or more hole card pairs, such as Player.cards lists
+#   - board is the known community cards: none, the flop or the turn
+#   - samples caps the number of run-outs, time_budget caps the wall time in seconds; either may be None, not both
+#   - each of the workers processes draws from its own RNG stream derived from seed, so a seeded run is reproducible
+#     for a given worker count (unless the time budget cuts it short); workers=1 runs in this process
+#   - an existing executor may be passed in to avoid paying the process start-up cost on every call
+def monte_carlo_equity(hands, board=(), samples=100000, time_budget=None, workers=None, seed=None, executor=None):
+    hands, board = check_cards(hands, board)
+    if samples is None and time_budget is None:
+        raise ValueError('either samples or time_budget must be given')
+
+    if seed is None:
+        seed = random.randrange(2 ** 64)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if samples is None:
+        samples = math.inf
+
+    deadline = None if time_budget is None else time.time() + time_budget
+    quotas = [samples / workers if samples == math.inf else samples // workers + (worker < samples % workers)
+              for worker in range(workers)]
+    streams = [f'{seed}:{worker}' for worker in range(workers)]
+    result = EquityResult(len(hands), seed=seed)
+
+    if workers == 1 and executor is None:
+        return result.merge(sample_runouts(hands, board, quotas[0], deadline, streams[0]))
+
+    pool = executor or ProcessPoolExecutor(workers)
+    try:
+        futures = [pool.submit(sample_runouts, hands, board, quota, deadline, stream)
+                   for quota, stream in zip(quotas, streams)]
+        for future in futures:
+            result.merge(future.result())
+    finally:
+        if executor is None:
+            pool.shutdown()
+
+    return result
+
+
+# Map a situation to a canonical form under suit permutation, so that strategically identical spots such as
+# AhKh vs AdKd and AsKs vs AcKc share a key - players keep their order, the cards within each hand are sorted
+def canonical(hands, board):
+    best = None
+    for permutation in SUIT_PERMUTATIONS:
+        def relabel(cards):
+            return tuple(sorted(card - card % 4 + permutation[card % 4] for card in cards))
+
+        key = tuple(relabel(hand) for hand in hands) + (relabel(board),)
+        if best is None or key < best:
+            best = key
+
+    return best
+
+
+# Enumerate every completion of the board and score each one
+def enumerate_runouts(hands, board):
+    dead = hand_mask(board)
+    for hand in hands:
+        dead |= hand_mask(hand)
+
+    remaining = [card for card in Deck() if not dead >> card & 1]
+    hole_keys = [hand_key(hand) for hand in hands]
+    board_key = hand_key(board)
+    result = EquityResult(len(hands))
+
+    for runout in itertools.combinations(remaining, 5 - len(board)):
+        key = board_key
+        for card in runout:
+            key += CARD_KEYS[card]
+        score(result, [key_strength(key + hole_key) for hole_key in hole_keys])
+
+    return result
+
+
+# Exact win/tie/loss equity of two or more hands, found by enumerating every completion of the board
+# That is 990 run-outs heads-up on the flop and 44 on the turn - preflop it is 1.7 million, which takes a while
+# Results are stored in cache by canonical situation (pass cache=None to skip it), so suit-isomorphic spots are
+# only enumerated once
+def exact_equity(hands, board=(), cache=EXACT_CACHE):
+    hands, board = check_cards(hands, board)
+
+    if cache is None:
+        return enumerate_runouts(hands, board)
+
+    key = canonical(hands, board)
+    counts = cache.get(key)
+    if counts is None:
+        canonical_hands = [[CARDS[card] for card in hand] for hand in key[:-1]]
+        result = enumerate_runouts(canonical_hands, [CARDS[card] for card in key[-1]])
+        counts = (result.samples, result.wins, result.ties, result.shares, result.squares)
+        cache.put(key, counts)
+
+    samples, wins, ties, shares, squares = counts
+    return EquityResult(len(hands), samples, list(wins), list(ties), list(shares), list(squares))
@@ -0,0 +1,304 @@
+import os
+import random
+
+from components import CARDS
+
+# Hand categories, matching the values returned by Game.check_hand()
+HIGHCARD, PAIR, TWO_PAIRS, THREE_OF_A_KIND, STRAIGHT, FLUSH, FULL_HOUSE, FOUR_OF_A_KIND, STRAIGHT_FLUSH, \
+    ROYAL_FLUSH = range(1, 11)
+
+HAND_NAMES = {HIGHCARD: 'Highcard',
+              PAIR: 'Pair',
+              TWO_PAIRS: 'Two Pairs',
+              THREE_OF_A_KIND: 'Three of a Kind',
+              STRAIGHT: 'Straight',
+              FLUSH: 'Flush',
+              FULL_HOUSE: 'Full House',
+              FOUR_OF_A_KIND: 'Four of a Kind',
+              STRAIGHT_FLUSH: 'Straight Flush',
+              ROYAL_FLUSH: 'Royal Flush'}
+
+# Cached copy of the lookup tables, rebuilt whenever TABLE_VERSION changes
+TABLE_VERSION = 1
+TABLE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tables', 'evaluator.pickle')
+
+# Every card contributes an additive key made of two parts:
+#   - bits 0-31 hold 5 ** rank, so the low part of a summed key counts each rank in base 5 (at most 4 of a rank)
+#   - bits 32-83 hold one bit per card in a 13-bit rank mask per suit, so a summed key also collects each suit's ranks
+# A hand key is the sum of its card keys, which makes adding a card to a hand a single integer addition
+RANK_BITS = 0xFFFFFFFF
+CARD_KEYS = tuple(5 ** card.rank + (1 << (32 + 13 * (card.suit - 1) + card.rank)) for card in CARDS)
+
+# Ace-high rank of each card, 0 for a Two up to 12 for an Ace
+CARD_RANKS = tuple(card.rank for card in CARDS)
+
+# Highest rank of each straight, indexed by its 13-bit rank mask - the wheel (A-2-3-4-5) counts as Five high
+STRAIGHTS = [(0b11111 << top - 4, top) for top in range(12, 3, -1)] + [(0b1000000001111, 3)]
+
+
+# Pack a category and up to five ranks, most significant first, into a single comparable strength
+def pack(category, ranks):
+    strength = category
+    for index in range(5):
+        strength = strength << 4 | (ranks[index] if index < len(ranks) else 0)
+
+    return strength
+
+
+# Category of a strength value
+def category(strength):
+    return strength >> 20
+
+
+# Name of the hand a strength value represents
+def hand_name(strength):
+    return HAND_NAMES[strength >> 20]
+
+
+# Value of the highest ranked card in a strength value, with Aces high (2 thru 14)
+def high_card(strength):
+    return (strength >> 16 & 0xF) + 2
+
+
+# Highest rank of a straight contained in a 13-bit rank mask, or -1
+def straight_top(ranks):
+    for straight, top in STRAIGHTS:
+        if ranks & straight == straight:
+            return top
+
+    return -1
+
+
+# Best five-card strength of a single suit holding at least five of the ranks in a 13-bit mask
+def flush_strength(ranks):
+    top = straight_top(ranks)
+    if top == 12:
+        return pack(ROYAL_FLUSH, [12, 11, 10, 9, 8])
+    elif top >= 0:
+        return pack(STRAIGHT_FLUSH, [top])
+
+    return pack(FLUSH, [rank for rank in range(12, -1, -1) if ranks >> rank & 1][:5])
+
+
+# Best five-card strength of a hand without a flush, given the number of cards held of each rank
+def rank_strength(counts):
+    present = [rank for rank in range(12, -1, -1) if counts[rank]]
+    by_count = sorted(present, key=lambda rank: counts[rank], reverse=True)
+    top = straight_top(sum(1 << rank for rank in present))
+
+    def kickers(excluded, number):
+        return [rank for rank in present if rank not in excluded][:number]
+
+    if counts[by_count[0]] == 4:
+        return pack(FOUR_OF_A_KIND, [by_count[0]] + kickers([by_count[0]], 1))
+
+    trips = [rank for rank in present if counts[rank] >= 3]
+    pairs = [rank for rank in present if counts[rank] >= 2]
+    if trips and len(pairs) >= 2:
+        pair = [rank for rank in pairs if rank != trips[0]][0]
+        return pack(FULL_HOUSE, [trips[0], pair])
+    elif top >= 0:
+        return pack(STRAIGHT, [top])
+    elif trips:
+        return pack(THREE_OF_A_KIND, [trips[0]] + kickers(trips[:1], 2))
+    elif len(pairs) >= 2:
+        return pack(TWO_PAIRS, pairs[:2] + kickers(pairs[:2], 1))
+    elif pairs:
+        return pack(PAIR, pairs[:1] + kickers(pairs, 3))
+
+    return pack(HIGHCARD, present[:5])
+
+
+# Build both lookup tables:
+#   - flushes, a list indexed by a suit's 13-bit rank mask, holding the best flush strength (0 below five cards)
+#   - ranks, a dict from the base-5 rank part of a hand key to the best non-flush strength
+def build_tables():
+    flushes = [0] * 8192
+    for ranks in range(8192):
+        if bin(ranks).count('1') >= 5:
+            flushes[ranks] = flush_strength(ranks)
+
+    ranks = dict()
+    counts = [0] * 13
+
+    # Walk every multiset of 5 to 7 ranks, holding at most four cards of any rank
+    def fill(rank, size, key):
+        if size == 7 or rank == 13:
+            if size >= 5:
+                ranks[key] = rank_strength(counts)
+            return
+
+        for count in range(min(4, 7 - size) + 1):
+            counts[rank] = count
+            fill(rank + 1, size + count, key + count * 5 ** rank)
+
+        counts[rank] = 0
+
+    fill(0, 0, 0)
+
+    return flushes, ranks
+
+
+# Load the lookup tables from the cache file, building and saving them if it is missing or out of date
+def load_tables(path=TABLE_PATH):
+    import pickle
+
+    try:
+        with open(path, 'rb') as file:
+            version, flushes, ranks = pickle.load(file)
+        if version == TABLE_VERSION:
+            return flushes, ranks
+    except (OSError, EOFError, ValueError, pickle.UnpicklingError):
+        pass
+
+    flushes, ranks = build_tables()
+
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as file:
+            pickle.dump((TABLE_VERSION, flushes, ranks), file, pickle.HIGHEST_PROTOCOL)
+    except OSError:
+        pass
+
+    return flushes, ranks
+
+
+# Stands in for a lookup table until the first lookup, which loads the tables and puts them in its place - importing
+# the module stays cheap, and once loaded key_strength() reads the real tables with no extra check
+class LazyTable:
+    def __init__(self, index):
+        self.index = index
+
+    def __getitem__(self, key):
+        return tables()[self.index][key]
+
+
+# The FLUSHES and RANKS lookup tables, loaded on first use
+def tables():
+    global FLUSHES, RANKS
+    if isinstance(RANKS, LazyTable):
+        FLUSHES, RANKS = load_tables()
+
+    return FLUSHES, RANKS
+
+
+FLUSHES, RANKS = LazyTable(0), LazyTable(1)
+
+
+# Strength of a summed hand key holding 5 to 7 cards
+# Seven cards can never hold a flush together with a Full House or Four of a Kind, so a flush always wins
+def key_strength(key):
+    suits = key >> 32
+    return FLUSHES[suits & 0x1FFF] or FLUSHES[suits >> 13 & 0x1FFF] or FLUSHES[suits >> 26 & 0x1FFF] or \
+        FLUSHES[suits >> 39] or RANKS[key & RANK_BITS]
+
+
+# Summed key of a list of cards
+def hand_key(cards):
+    key = 0
+    for card in cards:
+        key += CARD_KEYS[card]
+
+    return key
+
+
+# Strength of a list of 5 to 7 cards - a higher number is always a stronger hand
+def evaluate(cards):
+    key = 0
+    for card in cards:
+        key += CARD_KEYS[card]
+
+    return key_strength(key)
+
+
+# Strength of a 52-bit hand mask holding 5 to 7 cards
+def evaluate_mask(mask):
+    key = 0
+    while mask:
+        low = mask & -mask
+        key += CARD_KEYS[low.bit_length() - 1]
+        mask ^= low
+
+    return key_strength(key)
+
+
+# A hand built up one card at a time as the stages advance (hole cards, flop, turn, river), which can report its best
+# hand after every card and take cards back off again
+#   - key is the summed hand key, counts the number of cards held of each rank, suits the number held of each suit and
+#     ranks the 13-bit mask of ranks held, which straight_top() reads
+#   - add() and undo() are a handful of integer operations per card, so a Monte Carlo run-out adds the missing cards to
+#     the state built for the known ones, reads strength() and undoes back to it, instead of evaluating from scratch
+#   - strength() works at any size: key_strength() from 5 cards on, and the pairs, trips or quads held below that,
+#     packed like any other strength so it names and compares the same way
+class HandState:
+    def __init__(self, cards=()):
+        self.cards = list()
+        self.key = 0
+        self.mask = 0
+        self.counts = [0] * 13
+        self.suits = [0] * 4
+        self.ranks = 0
+        self.add(*cards)
+
+    def __len__(self):
+        return len(self.cards)
+
+    def add(self, *cards):
+        for card in cards:
+            if self.mask >> card & 1:
+                raise ValueError(f'{CARDS[card]} is already in the hand')
+            elif len(self.cards) == 7:
+                raise ValueError('a hand holds at most 7 cards')
+
+            rank = CARD_RANKS[card]
+            self.cards.append(card)
+            self.key += CARD_KEYS[card]
+            self.mask |= 1 << card
+            self.counts[rank] += 1
+            self.suits[card % 4] += 1
+            self.ranks |= 1 << rank
+
+    # Take back the last count cards added
+    def undo(self, count=1):
+        for _ in range(count):
+            card = self.cards.pop()
+            rank = CARD_RANKS[card]
+            self.key -= CARD_KEYS[card]
+            self.mask ^= 1 << card
+            self.counts[rank] -= 1
+            self.suits[card % 4] -= 1
+            if not self.counts[rank]:
+                self.ranks ^= 1 << rank
+
+    # Undo back to the first size cards, such as the hole cards and flop a run-out was dealt from
+    def rewind(self, size):
+        self.undo(len(self.cards) - size)
+
+    def strength(self):
+        if len(self.cards) >= 5:
+            return key_strength(self.key)
+
+        return rank_strength(self.counts) if self.cards else 0
+
+    def __repr__(self):
+        return f'HandState({self.cards})'
+
+
+# Check HandState against evaluate() on seeded random hands dealt one card at a time - from the fifth card on its
+# strength must equal evaluate() of the cards so far, and undoing back to any size must leave exactly the state a new
+# HandState of those cards has
+def run_tests(hands=2000, seed=0):
+    rng = random.Random(seed)
+    for _ in range(hands):
+        cards = rng.sample(CARDS, 7)
+        state = HandState()
+        for size, card in enumerate(cards, 1):
+            state.add(card)
+            if size >= 5:
+                assert state.strength() == evaluate(cards[:size]), cards[:size]
+
+        for size in range(6, -1, -1):
+            state.undo()
+            fresh = HandState(cards[:size])
+            assert (state.cards, state.key, state.mask, state.counts, state.suits, state.ranks, state.strength()) == \
+                (fresh.cards, fresh.key, fresh.mask, fresh.counts, fresh.suits, fresh.ranks, fresh.strength()), cards
@@ -0,0 +1,209 @@
+import argparse
+import itertools
+import math
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from batch import CHUNK_SIZE, cards_strength
+from components import REPRS
+from evaluator import CARD_RANKS, FLUSH, FOUR_OF_A_KIND, FULL_HOUSE, HAND_NAMES, HIGHCARD, PAIR, ROYAL_FLUSH, STRAIGHT, \
+    STRAIGHT_FLUSH, THREE_OF_A_KIND, TWO_PAIRS, evaluate, pack
+from game import Game
+
+HAND_SIZE = 7
+TOTAL_HANDS = math.comb(52, HAND_SIZE)
+
+# Number of 7-card hands in each category, which a full pass must reproduce
+EXPECTED = {1: 23294460, 2: 58627800, 3: 31433400, 4: 6461620, 5: 6180020, 6: 4047644, 7: 3473184, 8: 224848, 9: 37260,
+            10: 4324}
+
+# BINOMIALS[k][c] is C(c, k) - a hand's sorted cards c1 < ... < c7 have the colex rank C(c1, 1) + ... + C(c7, 7), which
+# numbers the hands 0 thru TOTAL_HANDS - 1, so a range of ranks is a slice of the hand space of exactly its length
+BINOMIALS = np.array([[math.comb(card, size) for card in range(52)] for size in range(HAND_SIZE + 1)], dtype=np.int64)
+
+# Mismatches a shard keeps for the report, besides counting all of them
+MISMATCH_LIMIT = 10
+
+# Shards per worker process, so workers which finish early pick up more work
+SHARDS_PER_WORKER = 8
+
+
+# Colex rank of a hand of 7 cards
+def rank_hand(cards):
+    return sum(math.comb(int(card), size) for size, card in enumerate(sorted(cards), 1))
+
+
+# Hand of a colex rank, as sorted card indices
+def unrank_hand(rank):
+    return [int(card) for card in unrank(np.array([rank], dtype=np.int64))[0]]
+
+
+# (N, 7) sorted card arrays of an array of colex ranks - each card is the highest one whose binomial fits in what is
+# left of the rank, found for all the ranks at once with searchsorted()
+def unrank(ranks):
+    ranks = ranks.copy()
+    hands = np.empty((len(ranks), HAND_SIZE), dtype=np.intp)
+    for size in range(HAND_SIZE, 0, -1):
+        cards = np.searchsorted(BINOMIALS[size], ranks, side='right') - 1
+        hands[:, size - 1] = cards
+        ranks -= BINOMIALS[size][cards]
+
+    return hands
+
+
+# Strength of a 5-card hand worked out from its ranks and suits alone, with none of the evaluator's tables or helpers -
+# groups of equal ranks ordered by size then rank, a flush if all five share a suit and a straight if the five ranks
+# run in a row (the wheel A-2-3-4-5 counting as Five high)
+def five_card_strength(cards):
+    ranks = sorted((CARD_RANKS[card] for card in cards), reverse=True)
+    groups = sorted(((ranks.count(rank), rank) for rank in set(ranks)), reverse=True)
+    flush = len({card % 4 for card in cards}) == 1
+    top = ranks[0] if len(groups) == 5 and ranks[0] - ranks[4] == 4 else 3 if ranks == [12, 3, 2, 1, 0] else None
+
+    if top is not None and flush:
+        return pack(ROYAL_FLUSH if top == 12 else STRAIGHT_FLUSH, [12, 11, 10, 9, 8] if top == 12 else [top])
+    elif groups[0][0] == 4:
+        return pack(FOUR_OF_A_KIND, [rank for _, rank in groups])
+    elif groups[0][0] == 3 and groups[1][0] == 2:
+        return pack(FULL_HOUSE, [rank for _, rank in groups])
+    elif flush:
+        return pack(FLUSH, ranks)
+    elif top is not None:
+        return pack(STRAIGHT, [top])
+    elif groups[0][0] == 3:
+        return pack(THREE_OF_A_KIND, [rank for _, rank in groups])
+    elif groups[0][0] == 2 and groups[1][0] == 2:
+        return pack(TWO_PAIRS, [rank for _, rank in groups])
+    elif groups[0][0] == 2:
+        return pack(PAIR, [rank for _, rank in groups])
+
+    return pack(HIGHCARD, ranks)
+
+
+# Evaluators a pass can be verified against, taking an (N, 7) card array and returning an (N,) strength array, one hand
+# at a time - check_hand and evaluate run through the Python code the game itself uses, which resolves hands through
+# the same FLUSHES and RANKS tables as the batch evaluator, so only reference is independent of a wrong table entry:
+# it takes the best of the 21 five-card hands, each worked out by five_card_strength()
+def reference_strengths(hands):
+    return np.array([max(five_card_strength(five) for five in itertools.combinations(hand, 5))
+                     for hand in hands.tolist()], dtype=np.int64)
+
+
+def check_hand_strengths(hands):
+    game = Game(0)
+    masks = np.bitwise_or.reduce(np.left_shift(np.uint64(1), hands.astype(np.uint64)), axis=1)
+    return np.array([game.check_hand(mask)[2] for mask in masks.tolist()], dtype=np.int64)
+
+
+def evaluate_strengths(hands):
+    return np.array([evaluate(hand) for hand in hands.tolist()], dtype=np.int64)
+
+
+VERIFIERS = {'reference': reference_strengths, 'check_hand': check_hand_strengths, 'evaluate': evaluate_strengths}
+
+
+# Worker: walk the ranks start thru end - 1 chunk by chunk, evaluating each hand with the batch evaluator and, given a
+# verifier, with that too - returns the category counts, the number of mismatches and the first few of them as
+# (rank, cards, batch strength, verifier strength)
+def walk(start, end, verify=None, chunk_size=CHUNK_SIZE):
+    counts = np.zeros(len(HAND_NAMES) + 1, dtype=np.int64)
+    mismatches = 0
+    examples = list()
+
+    for low in range(start, end, chunk_size):
+        ranks = np.arange(low, min(end, low + chunk_size), dtype=np.int64)
+        hands = unrank(ranks)
+        strengths = cards_strength(hands)
+        counts += np.bincount(strengths >> 20, minlength=len(counts))
+
+        if verify is not None:
+            expected = VERIFIERS[verify](hands)
+            different = np.flatnonzero(strengths != expected)
+            mismatches += len(different)
+            for index in different[:MISMATCH_LIMIT - len(examples)]:
+                examples.append((int(ranks[index]), [REPRS[card] for card in hands[index]], int(strengths[index]),
+                                 int(expected[index])))
+
+    return counts, mismatches, examples
+
+
+# Split the ranks start thru end - 1 into about shards equal ranges
+def shard_ranges(start, end, shards):
+    bounds = [start + (end - start) * shard // shards for shard in range(shards + 1)]
+    return [(low, high) for low, high in zip(bounds, bounds[1:]) if high > low]
+
+
+# Walk every 7-card hand (or the ranks start thru end - 1) in worker processes, calling progress with the hands done so
+# far and the seconds taken - returns the category counts as a dict, the number of mismatches with the verifier and the
+# first few of them in rank order
+def enumerate_hands(start=0, end=TOTAL_HANDS, workers=None, verify=None, progress=None):
+    workers = workers or os.cpu_count() or 1
+    shards = shard_ranges(start, end, workers * SHARDS_PER_WORKER)
+    counts = np.zeros(len(HAND_NAMES) + 1, dtype=np.int64)
+    mismatches = 0
+    examples = list()
+    done = 0
+    began = time.perf_counter()
+
+    with ProcessPoolExecutor(workers) as pool:
+        futures = {pool.submit(walk, low, high, verify): high - low for low, high in shards}
+        for future in as_completed(futures):
+            shard_counts, shard_mismatches, shard_examples = future.result()
+            counts += shard_counts
+            mismatches += shard_mismatches
+            examples.extend(shard_examples)
+            done += futures[future]
+            if progress is not None:
+                progress(done, time.perf_counter() - began)
+
+    histogram = {category: int(counts[category]) for category in HAND_NAMES}
+    return histogram, mismatches, sorted(examples)[:MISMATCH_LIMIT]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=f'Evaluate all {TOTAL_HANDS:,} seven-card hands.')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes (default: one per CPU)')
+    parser.add_argument('--verify', choices=list(VERIFIERS), help='also evaluate every hand with this and compare')
+    parser.add_argument('--start', type=int, default=0, help='first hand rank to walk')
+    parser.add_argument('--count', type=int, default=None, help='number of hands to walk (default: all)')
+    args = parser.parse_args(argv)
+
+    end = TOTAL_HANDS if args.count is None else min(TOTAL_HANDS, args.start + args.count)
+    total = end - args.start
+
+    def progress(done, seconds):
+        rate = done / seconds if seconds else 0.0
+        eta = (total - done) / rate if rate else 0.0
+        print(f'\r{done:>13,} / {total:,} hands  {done / total:6.1%}  {rate:>12,.0f} hands/s  eta {eta:5.0f}s',
+              end='', file=sys.stderr, flush=True)
+
+    began = time.perf_counter()
+    histogram, mismatches, examples = enumerate_hands(args.start, end, args.workers, args.verify, progress)
+    print(file=sys.stderr)
+
+    for category, name in HAND_NAMES.items():
+        print(f'{name:>16} {histogram[category]:>13,}')
+    print(f'{"Total":>16} {total:>13,} in {time.perf_counter() - began:.1f}s')
+
+    status = 0
+    if total == TOTAL_HANDS:
+        wrong = [HAND_NAMES[category] for category in EXPECTED if histogram[category] != EXPECTED[category]]
+        print(f'histogram differs from the expected counts for {", ".join(wrong)}' if wrong else
+              'histogram matches the expected counts')
+        status = 1 if wrong else status
+
+    if args.verify:
+        print(f'{mismatches:,} hands where batch and {args.verify} disagree')
+        for rank, cards, strength, expected in examples:
+            print(f'  rank {rank:,}: {" ".join(cards)}  batch {strength} {args.verify} {expected}')
+        status = 1 if mismatches else status
+
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
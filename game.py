@@ -1,48 +1,79 @@
+import random
+import time
+
 from components import *
+from evaluator import CARD_KEYS, category, evaluate_mask, hand_name, key_strength
+
+# Community cards visible in each stage
+VISIBLE_CARDS = {'opening': 0, 'pre-flop': 0, 'flop': 3, 'turn': 4, 'river': 5, 'end': 5, 'next': 5}
 
 
 # Initializes all game components, shuffles deck and draws cards
+# rng may be a seed or a random.Random instance to make every deal reproducible
+# seats is the number of players at the table, 2 thru 9 - seat 0 is the player and seat 1 the computer, which the GUI
+# uses as player and computer
+# Setting instruments to an instrumentation.Instrumentation records counters and timers, and setting history to a
+# history.HistoryWriter records every hand the Engine plays - both survive new_game()
+# Setting hand_cache to a cache.LRUCache memoizes check_hand() and check_players() by the hand's 52-bit mask, which is
+# the same whatever order the cards come in - it can be set on the class to share one cache between every game
 class Game:
     min_bet = 20
-
-    def __init__(self):
-        self.deck = Deck()
-        self.player = Player()
-        self.computer = Player()
+    max_seats = 9
+    instruments = None
+    history = None
+    hand_cache = None
+
+    def __init__(self, rng=None, seats=2):
+        if not 2 <= seats <= self.max_seats:
+            raise ValueError(f'a table seats 2 thru {self.max_seats} players, not {seats}')
+
+        self.deck = Deck(rng)
+        self.players = [Player() for _ in range(seats)]
+        self.player, self.computer = self.players[:2]
         self.community = list()
         self.pot = 0
         self.stage = 'opening'
         self.draw = False
 
-        self.deck.shuffle()
-
-        for _ in range(2): self.deck.draw(self.player.cards)
-        for _ in range(2): self.deck.draw(self.computer.cards)
-        for _ in range(5): self.deck.draw(self.community)
+        self.deal_cards()
 
-    # Re-initialize self
+    # Re-initialize self, keeping the same random number generator
     def new_game(self):
-        self.__init__()
+        self.__init__(self.deck.rng, len(self.players))
 
     # Start the next round
     def new_round(self):
-        self.deck = Deck()
         self.stage = 'next'
-        self.player.won = False
-        self.computer.won = False
-
-        self.player.cards.clear()
-        self.computer.cards.clear()
+        self.draw = False
+        for player in self.players:
+            player.won = False
+            player.cards.clear()
         self.community.clear()
-        self.deck.shuffle()
 
-        for _c in range(2): self.deck.draw(self.player.cards)
-        for _c in range(2): self.deck.draw(self.computer.cards)
-        for _c in range(5): self.deck.draw(self.community)
+        self.deal_cards()
+
+    # Reuse the deck, shuffling only the cards a hand needs, and draw them for every player and the community pool
+    def deal_cards(self):
+        if self.instruments is not None:
+            self.instruments.count('hands_dealt')
+
+        self.deck.reset()
+        self.deck.shuffle(2 * len(self.players) + 5)
+
+        for player in self.players:
+            for _ in range(2): self.deck.draw(player.cards)
+        for _ in range(5): self.deck.draw(self.community)
 
     # Update pot and player banks after each round, reset pot
-    def update_banks(self):
-        if self.player.won:
+    # payouts may give the amount each seat receives, e.g. when side pots go to different players
+    def update_banks(self, payouts=None):
+        if self.instruments is not None:
+            self.instruments.count('pot_chips', amount=self.pot)
+
+        if payouts is not None:
+            for player, payout in zip(self.players, payouts):
+                player.funds += payout
+        elif self.player.won:
             self.player.funds += self.pot
         elif self.computer.won:
             self.computer.funds += self.pot
@@ -53,113 +84,119 @@ class Game:
         self.pot = 0
 
     # Method for determining a player's hand
+    # The hand may be a list of cards or a 52-bit mask, see components.hand_mask()
+    # Returns the hand category, its name and a strength value - a higher strength is always a stronger hand,
+    # kickers included, so two hands can be compared with a single '>'
     def check_hand(self, hand):
-        suits = ['c', 'd', 'h', 's']
-
-        # Utility function for generating winning hands
-        def hand_gen(suit, start, stop):
-            return [f'{num}{suit}' for num in range(start, stop)]
-
-        # Utility function for comparing player hands to winning hands
-        def check_subset(hand, winning_hands):
-            for wh in winning_hands:
-                if set(wh).issubset(set(hand)):
-                    return True
-
-            return False
-
-        def royal_flush():
-            winning_hands = [hand_gen(suit, 10, 14) + [f'1{suit}'] for suit in suits]
-            return check_subset(hand, winning_hands)
-
-        def straight_flush():
-            winning_hands = [hand_gen(suit, num, num + 5) for num in range(1, 10) for suit in suits]
-            return check_subset(hand, winning_hands)
-
-        def four_of_a_kind():
-            winning_hands = [[str().join(hand_gen(suit, num, num + 1)) for suit in suits] for num in range(1, 14)]
-            return check_subset(hand, winning_hands)
-
-        def full_house():
-            values = [str(card)[:-1] for card in hand]
-            counts = [values.count(v) for v in values]
-
-            return True if 2 in counts and 3 in counts else False
-
-        def flush():
-            suits = [str(card)[-1] for card in hand]
-            counts = [suits.count(s) for s in suits]
-
-            return True if 5 in counts else False
-
-        def straight():
-            values = [int(str(card)[:-1]) for card in hand]
-            winning_hands = [hand_gen(str(), num, num + 5) for num in range(1, 10)]
-            winning_hands.append(['10', '11', '12', '13', '1'])
-
-            for wh in winning_hands:
-                if set(list(map(int, wh))).issubset(set(values)):
-                    return True
-
-            return False
-
-        def three_of_a_kind():
-            values = [str(card)[:-1] for card in hand]
-            counts = [values.count(v) for v in values]
-
-            return True if 3 in counts else False
-
-        def two_pairs():
-            values = [str(card)[:-1] for card in hand]
-            counts = [values.count(v) for v in values]
-
-            return True if counts.count(2) >= 4 else False
-
-        def pair():
-            values = [str(card)[:-1] for card in hand]
-            counts = [values.count(v) for v in values]
-
-            return True if counts.count(2) >= 2 else False
-
-        def highcard():
-            values = sorted([int(str(card)[:-1]) for card in hand])
-            return 14 if 1 in values else values[-1]
-
-        if royal_flush():
-            return (10, 'Royal Flush')
-        elif straight_flush():
-            return (9, 'Straight Flush')
-        elif four_of_a_kind():
-            return (8, 'Four of a Kind')
-        elif full_house():
-            return (7, 'Full House')
-        elif flush():
-            return (6, 'Flush')
-        elif straight():
-            return (5, 'Straight')
-        elif three_of_a_kind():
-            return (4, 'Three of a Kind')
-        elif two_pairs():
-            return (3, 'Two Pairs')
-        elif pair():
-            return (2, 'Pair')
-        else:
-            return (1, 'Highcard', highcard())
+        instruments = self.instruments
+        if instruments is None:
+            strength = self.hand_strength(hand_mask(hand))
+            return (category(strength), hand_name(strength), strength)
+
+        start = time.perf_counter()
+        strength = self.hand_strength(hand_mask(hand))
+        instruments.observe('check_hand', time.perf_counter() - start)
+        instruments.count('evaluations', ('category', hand_name(strength)))
+
+        return (category(strength), hand_name(strength), strength)
+
+    # Strength of a 52-bit hand mask, from hand_cache when one is set
+    def hand_strength(self, mask):
+        cache = self.hand_cache
+        if cache is None:
+            return evaluate_mask(mask)
+
+        strength = cache.get(mask)
+        if strength is None:
+            strength = evaluate_mask(mask)
+            cache.put(mask, strength)
+
+        return strength
+
+    # check_hand() of every seated player's cards with the community cards, or None for seats not in the given list
+    # The community cards are combined once, so each further seat costs two additions and one table lookup - or, with a
+    # hand_cache, two ORs and a lookup through hand_strength()
+    def check_players(self, seats=None):
+        cache = self.hand_cache
+        board = 0
+        for card in self.community:
+            board += CARD_KEYS[card] if cache is None else MASKS[card]
+
+        results = [None] * len(self.players)
+        for seat in range(len(self.players)) if seats is None else seats:
+            first, second = self.players[seat].cards
+            if cache is None:
+                strength = key_strength(board + CARD_KEYS[first] + CARD_KEYS[second])
+            else:
+                strength = self.hand_strength(board | MASKS[first] | MASKS[second])
+            results[seat] = (category(strength), hand_name(strength), strength)
+
+        if self.instruments is not None:
+            for result in results:
+                if result is not None:
+                    self.instruments.count('evaluations', ('category', result[1]))
+
+        return results
+
+    # Split the pot between the hands shown down, in one pass over the seats for each pot
+    # contributed holds what every seat put into the pot and hands each live seat's check_hand() result (None for seats
+    # which folded) - a seat can only win the part of the pot it matched, so unequal all-ins create side pots
+    # Returns the payout of each seat; chips which don't split evenly go to the winner in the lowest seat, and a bet nobody
+    # live matched goes back to the seats which made it
+    @staticmethod
+    def split_pot(contributed, hands):
+        payouts = [0] * len(contributed)
+        previous = 0
+
+        for level in sorted(set(contributed)):
+            pot = sum(min(amount, level) - min(amount, previous) for amount in contributed)
+            best, winners = -1, list()
+            for seat, hand in enumerate(hands):
+                if hand is None or contributed[seat] < level:
+                    continue
+                elif hand[2] > best:
+                    best, winners = hand[2], [seat]
+                elif hand[2] == best:
+                    winners.append(seat)
+
+            if not winners:
+                winners = [seat for seat, amount in enumerate(contributed) if amount >= level]
+            share, odd = divmod(pot, len(winners))
+            for seat in winners:
+                payouts[seat] += share
+            payouts[winners[0]] += odd
+            previous = level
+
+        return payouts
+
+    # Name of a seat in printed results
+    def seat_name(self, seat):
+        if len(self.players) == 2:
+            return ('Player', 'Computer')[seat]
+
+        return 'Player' if seat == 0 else f'Computer {seat}'
 
     # Test all check_hand() submethods
     def run_tests(self):
-        royal_flush = self.check_hand(['10s', '13s', '1c', '1d', '11s', '12s', '1s'])[1]
-        straight_flush = self.check_hand(['8c', '6h', '3h', '1d', '2h', '4h', '5h'])[1]
-        four_of_a_kind = self.check_hand(['1c', '1d', '1h', '1s', '2s', '3s', '4s'])[1]
-        full_house = self.check_hand(['6c', '4d', '2h', '2s', '3c', '3d', '3h'])[1]
-        flush = self.check_hand(['4c', '5d', '1c', '10c', '12c', '3h', '7c'])[1]
-        straight_ace_low = self.check_hand(['2d', '3c', '1c', '7d', '4d', '5s', '10h'])[1]
-        straight_ace_high = self.check_hand(['1c', '2d', '13d', '3c', '11d', '10s', '12h'])[1]
-        three_of_a_kind = self.check_hand(['6c', '2d', '4c', '2s', '10d', '11h', '2h'])[1]
-        two_pairs = self.check_hand(['9c', '2d', '3c', '2s', '3h', '8c', '6c'])[1]
-        pair = self.check_hand(['7c', '4d', '2c', '9s', '5h', '4s', '10c'])[1]
-        highcard_ace = self.check_hand(['1c', '3d', '5c', '6s', '7h', '11h', '13c'])[1]
-        highcard_ten = self.check_hand(['2c', '3d', '5c', '6s', '7h', '9h', '10c'])[1]
+        hands = list()
+
+        # check_hand() of a test hand, keeping its cards for the batch evaluator checks below
+        def check(cards):
+            hands.append([Card.from_str(card) for card in cards])
+            return self.check_hand(cards)
+
+        royal_flush = check(['10s', '13s', '1c', '1d', '11s', '12s', '1s'])[1]
+        straight_flush = check(['8c', '6h', '3h', '1d', '2h', '4h', '5h'])[1]
+        four_of_a_kind = check(['1c', '1d', '1h', '1s', '2s', '3s', '4s'])[1]
+        full_house = check(['6c', '4d', '2h', '2s', '3c', '3d', '3h'])[1]
+        flush = check(['4c', '5d', '1c', '10c', '12c', '3h', '7c'])[1]
+        straight_ace_low = check(['2d', '3c', '1c', '7d', '4d', '5s', '10h'])[1]
+        straight_ace_high = check(['1c', '2d', '13d', '3c', '11d', '10s', '12h'])[1]
+        three_of_a_kind = check(['6c', '2d', '4c', '2s', '10d', '11h', '2h'])[1]
+        two_pairs = check(['9c', '2d', '3c', '2s', '3h', '8c', '6c'])[1]
+        pair = check(['7c', '4d', '2c', '9s', '5h', '4s', '10c'])[1]
+        highcard_ace = check(['1c', '3d', '5c', '6s', '7h', '11h', '13c'])[1]
+        highcard_ten = check(['2c', '3d', '5c', '6s', '7h', '9h', '10c'])[1]
 
         assert royal_flush == 'Royal Flush'
         assert straight_flush == 'Straight Flush'
@@ -174,45 +211,46 @@ class Game:
         assert highcard_ace == 'Highcard'
         assert highcard_ten == 'Highcard'
 
+        # The NumPy batch evaluator agrees with check_hand() on the test hands and on seeded random hands, given as card
+        # arrays and as masks (skipped when NumPy isn't installed)
+        try:
+            from batch import evaluate_batch, hands_array, hands_to_masks
+        except ImportError:
+            pass
+        else:
+            rng = random.Random(0)
+            hands += [rng.sample(CARDS, 7) for _ in range(1000)]
+            expected = [self.check_hand(hand) for hand in hands]
+            cards = hands_array(hands)
+            for strengths, categories in (evaluate_batch(cards), evaluate_batch(hands_to_masks(cards))):
+                assert strengths.tolist() == [hand[2] for hand in expected]
+                assert categories.tolist() == [hand[0] for hand in expected]
+
+        # An unseeded game deals a full hand, and deals again after new_game()
+        game = Game()
+        game.new_game()
+        assert all(len(player.cards) == 2 for player in game.players) and len(game.community) == 5
+        assert len(set(game.deck[:game.deck.top])) == game.deck.top == 9
+
     # Simulate a player vs. AI game in the terminal - doesn't account for betting, only draws cards and determines a winner
-    def simulate(self):
-        self.__init__()
-        player_card_values = [int(str(self.player.cards[0])[:-1]), int(str(self.player.cards[1])[:-1])]
-        computer_card_values = [int(str(self.computer.cards[0])[:-1]), int(str(self.computer.cards[1])[:-1])]
-
-        player_kicker = 14 if 1 in player_card_values else max(player_card_values)
-        computer_kicker = 14 if 1 in computer_card_values else max(computer_card_values)
-
-        player_hand = self.check_hand(self.player.cards + self.community)
-        computer_hand = self.check_hand(self.computer.cards + self.community)
-
-        print(f'Player cards: {self.player.cards}\n'
-              f'Computer cards: {self.computer.cards}\n'
-              f'Community cards: {self.community}\n\n'
-
-              f'Player has {player_hand[1]}\n'
-              f'Computer has {computer_hand[1]}\n')
-
-        if player_hand[0] > computer_hand[0]:
-            print('Player wins!')
-        elif player_hand[0] == computer_hand[0] == 1:
-            if player_hand[2] > computer_hand[2]:
-                print('Player wins!')
-            elif player_hand[2] < computer_hand[2]:
-                print('Computer wins!')
-            else:
-                if player_kicker > computer_kicker:
-                    print('Player wins by kicker!')
-                elif player_kicker < computer_kicker:
-                    print('Computer wins by kicker!')
-                else:
-                    print('Draw!')
-        elif player_hand[0] == computer_hand[0]:
-            if player_kicker > computer_kicker:
-                print('Player wins by kicker!')
-            elif player_kicker < computer_kicker:
-                print('Computer wins by kicker!')
-            else:
-                print('Draw!')
+    # Returns the outcome, which is only printed along with the cards if verbose is set
+    def simulate(self, verbose=True):
+        self.new_game()
+        hands = self.check_players()
+        best = max(hand[2] for hand in hands)
+        winners = [seat for seat, hand in enumerate(hands) if hand[2] == best]
+
+        if len(winners) > 1:
+            outcome = 'Draw!' if len(winners) == len(hands) == 2 else \
+                f'Draw between {", ".join(self.seat_name(seat) for seat in winners)}!'
         else:
-            print('Computer wins!')
+            kicker = any(hand[0] == hands[winners[0]][0] for seat, hand in enumerate(hands) if seat != winners[0])
+            outcome = f'{self.seat_name(winners[0])} wins{" by kicker" if kicker else ""}!'
+
+        if verbose:
+            print(''.join(f'{self.seat_name(seat)} cards: {player.cards}\n' for seat, player in enumerate(self.players)) +
+                  f'Community cards: {self.community}\n\n' +
+                  ''.join(f'{self.seat_name(seat)} has {hand[1]}\n' for seat, hand in enumerate(hands)) +
+                  f'\n{outcome}')
+
+        return outcome
@@ -0,0 +1,302 @@
+import mmap
+import os
+import random
+import struct
+import tempfile
+
+from components import CARDS
+from engine import CALL, CHECK, FOLD, RAISE, Engine, RandomPolicy
+from evaluator import PAIR
+from game import Game
+
+# File layout: a 16-byte header, then one fixed-width record per hand - the record size depends only on the number of
+# seats, which the header stores, so record i always starts at HEADER.size + i * record_size
+MAGIC = b'PKHH'
+VERSION = 1
+HEADER = struct.Struct('<4sHHI4x')
+
+STAGES = ('pre-flop', 'flop', 'turn', 'river')
+ACTIONS = (CHECK, CALL, RAISE, FOLD)
+STAGE_CODES = {stage: code for code, stage in enumerate(STAGES)}
+ACTION_CODES = {action: code for code, action in enumerate(ACTIONS)}
+
+# Each action is packed into 32 bits: the amount in the low 24, then the seat, the action and the street
+AMOUNT_BITS = 24
+
+
+# Most actions a hand can take: every seat acting after each of the allowed raises, on all four streets
+def max_actions(seats):
+    return seats * (Engine.max_raises + 1) * len(STAGES)
+
+
+# Record layout for a table size:
+#   hand number, pot, winners bitmask, showdown flag, number of actions, the 5 community cards, 2 hole cards per seat,
+#   each seat's hand category with all five community cards (whether or not it was shown), each seat's funds before the
+#   hand, each seat's payout, and the packed actions
+def record_struct(seats):
+    return struct.Struct(f'<QIHBB5B{2 * seats}B{seats}B{seats}I{seats}I{max_actions(seats)}I')
+
+
+# Byte offsets of the fields the reader filters on, relative to the start of a record
+POT_OFFSET = 8
+WINNERS_OFFSET = 12
+
+
+def categories_offset(seats):
+    return struct.calcsize(f'<QIHBB5B{2 * seats}B')
+
+
+# One hand read back from a history file
+#   - actions holds (stage, seat, action, amount) tuples in the order they were taken, like Engine.actions
+#   - funds holds each seat's funds before the blinds were posted, and payouts what each seat was paid
+class HandRecord:
+    def __init__(self, number, pot, winners, showdown, community, hands, categories, funds, payouts, actions):
+        self.number = number
+        self.pot = pot
+        self.winners = winners
+        self.showdown = showdown
+        self.community = community
+        self.hands = hands
+        self.categories = categories
+        self.funds = funds
+        self.payouts = payouts
+        self.actions = actions
+
+    @property
+    def seats(self):
+        return len(self.hands)
+
+    def __repr__(self):
+        return f'HandRecord(number={self.number}, pot={self.pot}, winners={self.winners}, showdown={self.showdown})'
+
+
+# Appends a record for every hand an Engine finishes to a history file
+# Records are packed into a preallocated buffer and written batch_size at a time; close() (or leaving a with block)
+# writes the rest. Attach one with game.history = HistoryWriter(path, len(game.players))
+class HistoryWriter:
+    def __init__(self, path, seats, batch_size=4096):
+        self.record = record_struct(seats)
+        self.seats = seats
+        self.batch_size = batch_size
+        self.buffer = bytearray(self.record.size * batch_size)
+        self.pending = 0
+
+        if os.path.exists(path) and os.path.getsize(path):
+            with open(path, 'rb') as file:
+                check_header(HEADER.unpack(file.read(HEADER.size)), path, seats)
+            self.hands = (os.path.getsize(path) - HEADER.size) // self.record.size
+            self.file = open(path, 'ab', buffering=0)
+        else:
+            self.hands = 0
+            self.file = open(path, 'wb', buffering=0)
+            self.file.write(HEADER.pack(MAGIC, VERSION, seats, self.record.size))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # Pack the hand which just ended - called by Engine.finish() before the pot is paid out
+    def write(self, engine):
+        game = engine.game
+        result = engine.result
+        seats = self.seats
+        if len(game.players) != seats:
+            raise ValueError(f'the history file is for {seats} seats, the game has {len(game.players)}')
+
+        hands = result.hands if result.showdown and None not in result.hands else game.check_players()
+        winners = 0
+        for seat in result.winners:
+            winners |= 1 << seat
+
+        actions = [STAGE_CODES[stage] << 30 | ACTION_CODES[action] << 28 | seat << AMOUNT_BITS | amount
+                   for stage, seat, action, amount in engine.actions]
+        if len(actions) > max_actions(seats) or any(amount >> AMOUNT_BITS for _, _, _, amount in engine.actions):
+            raise ValueError(f'hand {self.hands} does not fit a history record')
+
+        self.record.pack_into(self.buffer, self.pending * self.record.size,
+                              self.hands, result.pot, winners, result.showdown, len(actions),
+                              *game.community,
+                              *(card for player in game.players for card in player.cards),
+                              *(0 if hand is None else hand[0] for hand in hands),
+                              *(player.funds + contributed for player, contributed in zip(game.players,
+                                                                                         engine.contributed)),
+                              *result.payouts,
+                              *actions, *[0] * (max_actions(seats) - len(actions)))
+
+        self.hands += 1
+        self.pending += 1
+        if self.pending == self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            self.file.write(memoryview(self.buffer)[:self.pending * self.record.size])
+            self.pending = 0
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+
+def check_header(header, path, seats=None):
+    magic, version, header_seats, size = header
+    if magic != MAGIC or version != VERSION or size != record_struct(header_seats).size:
+        raise ValueError(f'{path} is not a version {VERSION} hand history')
+    elif seats is not None and header_seats != seats:
+        raise ValueError(f'{path} holds {header_seats}-seat hands, not {seats}')
+
+    return header_seats
+
+
+# Memory-mapped view of a history file - records are only decoded when they are read, and the filters of select() read
+# just the fields they test, so files far larger than memory can be scanned
+class HistoryReader:
+    def __init__(self, path):
+        with open(path, 'rb') as file:
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        self.seats = check_header(HEADER.unpack_from(self.map), path)
+        self.record = record_struct(self.seats)
+        self.count = (len(self.map) - HEADER.size) // self.record.size
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self.count
+        if not 0 <= index < self.count:
+            raise IndexError('hand index out of range')
+
+        return self.decode(self.record.unpack_from(self.map, HEADER.size + index * self.record.size))
+
+    def __iter__(self):
+        for values in self.record.iter_unpack(memoryview(self.map)[HEADER.size:HEADER.size + self.count *
+                                                                   self.record.size]):
+            yield self.decode(values)
+
+    def decode(self, values):
+        seats = self.seats
+        number, pot, winners, showdown, count = values[:5]
+        community = [CARDS[card] for card in values[5:10]]
+        cards = values[10:10 + 2 * seats]
+        categories = list(values[10 + 2 * seats:10 + 3 * seats])
+        funds = list(values[10 + 3 * seats:10 + 4 * seats])
+        payouts = list(values[10 + 4 * seats:10 + 5 * seats])
+        actions = [(STAGES[word >> 30], word >> AMOUNT_BITS & 15, ACTIONS[word >> 28 & 3], word & (1 << AMOUNT_BITS) - 1)
+                   for word in values[10 + 5 * seats:10 + 5 * seats + count]]
+
+        return HandRecord(number, pot, [seat for seat in range(seats) if winners >> seat & 1], bool(showdown),
+                          community, [[CARDS[cards[2 * seat]], CARDS[cards[2 * seat + 1]]] for seat in range(seats)],
+                          categories, funds, payouts, actions)
+
+    # Indices of the hands matching every given filter:
+    #   - winner: a seat which won the main pot
+    #   - category: a hand category (evaluator.PAIR etc.) held by seat, or by any seat if seat is None
+    #   - min_pot and max_pot: bounds on the pot, inclusive
+    def select(self, winner=None, category=None, seat=None, min_pot=None, max_pot=None):
+        data = self.map
+        size = self.record.size
+        categories = categories_offset(self.seats)
+        pot_field = struct.Struct('<I')
+        winners_field = struct.Struct('<H')
+
+        for index in range(self.count):
+            start = HEADER.size + index * size
+            if min_pot is not None or max_pot is not None:
+                pot = pot_field.unpack_from(data, start + POT_OFFSET)[0]
+                if min_pot is not None and pot < min_pot or max_pot is not None and pot > max_pot:
+                    continue
+            if winner is not None and not winners_field.unpack_from(data, start + WINNERS_OFFSET)[0] >> winner & 1:
+                continue
+            if category is not None:
+                if seat is None:
+                    if category not in data[start + categories:start + categories + self.seats]:
+                        continue
+                elif data[start + categories + seat] != category:
+                    continue
+
+            yield index
+
+    # The hands select() matches, decoded
+    def filter(self, **filters):
+        for index in self.select(**filters):
+            yield self[index]
+
+    def close(self):
+        self.map.close()
+
+
+# Policy which repeats recorded actions, checking each one comes from the seat and stage the record says
+class ReplayPolicy:
+    def __init__(self, actions):
+        self.actions = iter(actions)
+
+    def decide(self, engine, seat):
+        stage, recorded_seat, action, amount = next(self.actions)
+        if (stage, recorded_seat) != (engine.game.stage, seat):
+            raise ValueError(f'the replay diverged: seat {seat} is to act on the {engine.game.stage}, the record has '
+                             f'seat {recorded_seat} on the {stage}')
+
+        return action, amount
+
+
+# Play a recorded hand again, in a fresh Game or the given one - the seats get the recorded funds and cards and the
+# Engine repeats the recorded actions, so the returned engine's result and actions are those of the original hand
+def replay(record, game=None):
+    game = game or Game(seats=record.seats)
+    game.stage = 'opening'
+    for player, funds, cards in zip(game.players, record.funds, record.hands):
+        player.funds = funds
+        player.cards[:] = cards
+        player.won = False
+    game.community[:] = record.community
+    game.pot = 0
+    game.draw = False
+
+    policy = ReplayPolicy(record.actions)
+    engine = Engine(game, [policy] * record.seats)
+    result = engine.play_hand()
+
+    if result.payouts != record.payouts or result.winners != record.winners:
+        raise ValueError(f'hand {record.number} replayed to a different outcome')
+
+    return engine
+
+
+# Check a round trip at 2, 6 and 9 seats: hands played by seeded RandomPolicy bots are written in small batches, must
+# read back with the pot, winners, payouts and actions the engine reported, replay() to the same actions, and select()
+# on a pot, a category and a winner must pick the same hands as filtering the decoded records
+def run_tests(hands=500, tables=(2, 6, 9), batch_size=64):
+    with tempfile.TemporaryDirectory() as directory:
+        for seats in tables:
+            path = os.path.join(directory, f'{seats}.bin')
+            game = Game(random.Random(seats), seats)
+            engine = Engine(game, [RandomPolicy(random.Random(f'{seats}:{seat}')) for seat in range(seats)])
+            expected = list()
+            with HistoryWriter(path, seats, batch_size) as game.history:
+                for _ in range(hands):
+                    if engine.game_over:
+                        game.new_game()
+                        engine.reset()
+                    result = engine.play_hand()
+                    expected.append((result.pot, result.winners, result.payouts, list(engine.actions)))
+
+            reader = HistoryReader(path)
+            records = list(reader)
+            assert len(reader) == len(records) == hands
+            for number, (record, (pot, winners, payouts, actions)) in enumerate(zip(records, expected)):
+                assert (record.number, record.pot, record.winners, record.payouts, record.actions) == \
+                    (number, pot, winners, payouts, actions), record
+                assert replay(record).actions == record.actions
+
+            min_pot = sorted(record.pot for record in records)[hands // 2]
+            assert list(reader.select(min_pot=min_pot, category=PAIR, winner=0)) == \
+                [index for index, record in enumerate(records)
+                 if record.pot >= min_pot and PAIR in record.categories and 0 in record.winners]
+            assert list(reader.select(category=PAIR, seat=seats - 1, max_pot=min_pot)) == \
+                [index for index, record in enumerate(records)
+                 if record.categories[seats - 1] == PAIR and record.pot <= min_pot]
+            reader.close()
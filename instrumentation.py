@@ -0,0 +1,132 @@
+import cProfile
+import json
+import pstats
+import time
+
+# Prefix for every exported metric name
+NAMESPACE = 'poker'
+
+
+# Value at a percentile of a sorted list, by nearest rank
+def percentile(values, percent):
+    return values[min(len(values) - 1, max(0, round(percent / 100 * len(values)) - 1))]
+
+
+# Opt-in counters and timers for a Game and the Engine driving it
+# Attach one with game.instruments = Instrumentation(); while Game.instruments is None the hooks cost a single check
+#   - counters count events, optionally split by one label, e.g. count('evaluations', ('category', 'Pair'))
+#   - timers accumulate the number, total and longest of their observations in seconds
+#   - the time spent in each stage of a hand is recorded by enter_stage() on every stage transition
+#   - with profile_every=N, one hand in every N runs under cProfile and the samples are combined in profile_stats
+class Instrumentation:
+    def __init__(self, profile_every=0):
+        self.counters = dict()
+        self.timers = dict()
+        self.stage = None
+        self.stage_start = 0.0
+        self.profile_every = profile_every
+        self.profiler = None
+        self.profile_stats = None
+        self.hands = 0
+
+    def count(self, name, label=None, amount=1):
+        key = (name, label)
+        self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name, seconds, label=None):
+        key = (name, label)
+        timer = self.timers.get(key)
+        if timer is None:
+            self.timers[key] = [1, seconds, seconds]
+        else:
+            timer[0] += 1
+            timer[1] += seconds
+            if seconds > timer[2]:
+                timer[2] = seconds
+
+    # Close the timer of the current stage and start timing the next one
+    def enter_stage(self, stage):
+        now = time.perf_counter()
+        if self.stage is not None:
+            self.observe('stage', now - self.stage_start, ('stage', self.stage))
+
+        self.stage = stage
+        self.stage_start = now
+
+    # Mark the start of a hand, starting the profiler if this hand is sampled
+    def begin_hand(self):
+        self.hands += 1
+        if self.profile_every and self.hands % self.profile_every == 0:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+    # Mark the end of a hand, adding the profile of a sampled hand to profile_stats
+    def end_hand(self):
+        self.enter_stage(None)
+
+        if self.profiler is not None:
+            self.profiler.disable()
+            if self.profile_stats is None:
+                self.profile_stats = pstats.Stats(self.profiler)
+            else:
+                self.profile_stats.add(self.profiler)
+            self.profiler = None
+
+    def reset(self):
+        self.__init__(self.profile_every)
+
+    # Metric name with its label, e.g. 'evaluations{category="Pair"}'
+    @staticmethod
+    def metric(name, label, suffix=''):
+        return f'{name}{suffix}' if label is None else f'{name}{suffix}{{{label[0]}="{label[1]}"}}'
+
+    # Plain dictionary of every counter and timer, suitable for JSON
+    def snapshot(self):
+        return {'counters': {self.metric(name, label): value for (name, label), value in sorted(self.counters.items(),
+                                                                                             key=str)},
+                'timers': {self.metric(name, label): {'count': count, 'sum': total, 'max': longest}
+                           for (name, label), (count, total, longest) in sorted(self.timers.items(), key=str)}}
+
+    # Prometheus text exposition of every counter and timer
+    def prometheus(self):
+        lines = list()
+        typed = set()
+
+        for (name, label), value in sorted(self.counters.items(), key=str):
+            metric = f'{NAMESPACE}_{name}_total'
+            if metric not in typed:
+                lines.append(f'# TYPE {metric} counter')
+                typed.add(metric)
+            lines.append(f'{self.metric(metric, label)} {value}')
+
+        # A summary family only allows _sum and _count samples, so the longest times are a gauge family of their own
+        timers = sorted(self.timers.items(), key=str)
+        for (name, label), (count, total, longest) in timers:
+            metric = f'{NAMESPACE}_{name}_seconds'
+            if metric not in typed:
+                lines.append(f'# TYPE {metric} summary')
+                typed.add(metric)
+            lines.append(f'{self.metric(metric, label, "_sum")} {total!r}')
+            lines.append(f'{self.metric(metric, label, "_count")} {count}')
+
+        for (name, label), (count, total, longest) in timers:
+            metric = f'{NAMESPACE}_{name}_seconds_max'
+            if metric not in typed:
+                lines.append(f'# TYPE {metric} gauge')
+                typed.add(metric)
+            lines.append(f'{self.metric(metric, label)} {longest!r}')
+
+        return '\n'.join(lines) + '\n'
+
+    # Write the metrics to a file - JSON for a .json path, the Prometheus text format otherwise
+    def dump(self, path):
+        with open(path, 'w') as file:
+            if path.endswith('.json'):
+                json.dump(self.snapshot(), file, indent=2)
+            else:
+                file.write(self.prometheus())
+
+    # Write the combined cProfile samples to a file readable by pstats
+    def dump_profile(self, path):
+        if self.profile_stats is not None:
+            self.profile_stats.dump_stats(path)
@@ -0,0 +1,154 @@
+import argparse
+import asyncio
+import gc
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from instrumentation import percentile
+
+# Allocations between young-generation collections, raised like server.GC_THRESHOLD so the client's own collections
+# don't show up as latency
+GC_THRESHOLD = 10000
+
+
+# One connection seated at a number of tables, answering every TURN with a random legal action after an optional
+# think time
+# The latency of an action is the time from sending it to the next message from the same table, i.e. the time the
+# server took to apply it, let the other seats act and come back with the next decision or the result
+class LoadClient:
+    def __init__(self, tables, rng, think, warmup):
+        self.tables = tables
+        self.rng = rng
+        self.think = think
+        self.warmup = warmup
+        self.sent = dict()
+        self.latencies = list()
+        self.actions = 0
+        self.errors = 0
+        self.buffer = list()
+
+    def choose(self, words):
+        legal = words[5].decode().split(',')
+        roll = self.rng.random()
+
+        if 'raise' in legal and roll < 0.1:
+            return f'raise {min(int(words[4]), 40)}'
+        elif 'call' in legal and roll < 0.2:
+            return 'fold'
+
+        return 'call' if 'call' in legal else 'check'
+
+    # Queue an action, writing everything queued during this pass of the event loop at once
+    def act(self, writer, table, action):
+        if not self.buffer:
+            asyncio.get_running_loop().call_soon(self.flush, writer)
+        self.sent[table] = time.perf_counter()
+        self.buffer.append(f'ACT {table} {action}\n')
+
+    def flush(self, writer):
+        if not writer.is_closing():
+            writer.write(''.join(self.buffer).encode())
+        self.buffer.clear()
+
+    async def run(self, host, port, duration):
+        reader, writer = await asyncio.open_connection(host, port, limit=1 << 16)
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+
+        writer.write(b'JOIN\n' * self.tables)
+        await writer.drain()
+
+        while loop.time() < start + duration:
+            try:
+                line = await asyncio.wait_for(reader.readline(), start + duration - loop.time())
+            except asyncio.TimeoutError:
+                break
+            if not line:
+                break
+
+            now = time.perf_counter()
+            words = line.split()
+            if words[0] == b'ERROR':
+                self.errors += 1
+            if len(words) < 2 or not words[1].isdigit():
+                continue
+
+            table = int(words[1])
+            sent = self.sent.pop(table, None)
+            if sent is not None and loop.time() > start + self.warmup:
+                self.latencies.append(now - sent)
+
+            if words[0] == b'TURN':
+                self.actions += 1
+                if self.think:
+                    loop.call_later(self.rng.random() * self.think, self.act, writer, table, self.choose(words))
+                else:
+                    self.act(writer, table, self.choose(words))
+
+        writer.close()
+
+
+# Worker: run a share of the connections in one process, returning their latencies, action and error counts
+def run_process(host, port, connections, tables, duration, think, warmup, seed):
+    clients = [LoadClient(tables // connections + (index < tables % connections), random.Random(f'{seed}:{index}'),
+                          think, warmup) for index in range(connections)]
+
+    # Freeze what exists before the clients start and collect less often, like the server
+    async def run():
+        gc.collect()
+        gc.freeze()
+        gc.set_threshold(GC_THRESHOLD, *gc.get_threshold()[1:])
+        await asyncio.gather(*(client.run(host, port, duration) for client in clients))
+
+    asyncio.run(run())
+    return ([latency for client in clients for latency in client.latencies],
+            sum(client.actions for client in clients),
+            sum(client.errors for client in clients))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Play thousands of tables against server.py and report action latency.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=7777)
+    parser.add_argument('--tables', type=int, default=5000, help='seats to take, spread over the connections')
+    parser.add_argument('--connections', type=int, default=50)
+    parser.add_argument('--processes', type=int, default=1, help='client processes sharing the connections')
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds to play')
+    parser.add_argument('--warmup', type=float, default=1.0, help='seconds before latencies are recorded')
+    parser.add_argument('--think', type=float, default=0.0, help='longest random delay before each action, seconds')
+    parser.add_argument('--target', type=float, default=5.0, help='p99 latency target in milliseconds')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    processes = max(1, min(args.processes, args.connections))
+    with ProcessPoolExecutor(processes) as pool:
+        futures = [pool.submit(run_process, args.host, args.port,
+                               args.connections // processes + (index < args.connections % processes),
+                               args.tables // processes + (index < args.tables % processes),
+                               args.duration, args.think, args.warmup, args.seed * processes + index)
+                   for index in range(processes)]
+        outcomes = [future.result() for future in futures]
+
+    latencies = sorted(latency * 1e3 for latencies, _, _ in outcomes for latency in latencies)
+    actions = sum(actions for _, actions, _ in outcomes)
+    errors = sum(errors for _, _, errors in outcomes)
+    if not latencies:
+        print('no actions were answered')
+        return 1
+
+    p99 = percentile(latencies, 99)
+    print(f'{args.tables} tables, {actions:,} actions ({actions / args.duration:,.0f}/s), {errors} errors\n'
+          f'latency p50 {percentile(latencies, 50):.2f}ms  p90 {percentile(latencies, 90):.2f}ms  '
+          f'p99 {p99:.2f}ms  max {latencies[-1]:.2f}ms')
+
+    if p99 > args.target:
+        print(f'p99 is above the {args.target:g}ms target')
+        return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,5 +1,150 @@
-from game import Game
-from app import App
+import time
+
+STARTED = time.perf_counter()
+
+import argparse
+import sys
+
+
+# Command-line entry point - run as python main.py <command> or python -m main <command>, with the GUI by default
+# Every command imports what it needs when it runs, so tkinter is only loaded by gui and the evaluator tables by the
+# first hand evaluated, which keeps short-lived processes quick to start on machines without a display
+
+
+# Parse a comma-separated list of cards such as '1h,13h' (Ace and King of Hearts)
+def parse_cards(text):
+    from components import Card
+
+    return [Card.from_str(card) for card in text.split(',') if card]
+
+
+def gui(args):
+    from app import App
+    from game import Game
+
+    App(Game(args.seed), images=args.images)
+
+
+def simulate(args):
+    from game import Game
+
+    game = Game(args.seed, args.seats)
+    outcomes = dict()
+    for hand in range(args.hands):
+        if hand and not args.quiet:
+            print()
+        outcome = game.simulate(verbose=not args.quiet)
+        outcomes[outcome] = outcomes.get(outcome, 0) + 1
+
+    if args.hands > 1:
+        print()
+        for outcome, count in sorted(outcomes.items(), key=lambda item: -item[1]):
+            print(f'{count:>8} {count / args.hands:7.2%}  {outcome}')
+
+
+def equity(args):
+    from equity import exact_equity, monte_carlo_equity
+
+    hands = [parse_cards(hand) for hand in args.hands]
+    board = parse_cards(args.board)
+    if args.exact:
+        result = exact_equity(hands, board)
+    else:
+        result = monte_carlo_equity(hands, board, None if args.time and not args.samples else args.samples or 100000,
+                                    args.time, args.workers, args.seed)
+
+    for hand, share, win, tie, (low, high) in zip(args.hands, result.equity, result.win, result.tie, result.interval()):
+        print(f'{hand:>12}  equity {share:7.2%}  win {win:7.2%}  tie {tie:7.2%}' +
+              ('' if args.exact else f'  95% [{low:.2%}, {high:.2%}]'))
+    print(f'{result.samples:,} run-outs')
+
+
+# Run the self-checks of the modules, printing each one as it passes - a failed check raises an AssertionError
+def test(args):
+    import cluster
+    import evaluator
+    import history
+    import outs
+    import state
+    import stats
+    from game import Game
+
+    checks = [('check_hand', Game(0).run_tests), ('HandState', evaluator.run_tests), ('GameState', state.run_tests),
+              ('outs', outs.run_tests), ('history', history.run_tests), ('stats resume', stats.run_tests),
+              ('cluster retry', cluster.run_tests)]
+    try:
+        import cfr
+        import ranges
+    except ImportError:
+        print('NumPy is not installed, skipping the checks which need it')
+    else:
+        checks += [('range equity', ranges.run_tests), ('CFR resume', cfr.run_tests)]
+
+    for name, check in checks:
+        began = time.perf_counter()
+        check()
+        print(f'{name:>14} ok  {time.perf_counter() - began:6.2f}s')
+
+
+def bench(args):
+    import bench
+
+    return bench.main(args.arguments)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='main.py', description="Texas Hold 'em - play in the GUI or run the "
+                                                                 "simulations from the command line.")
+    parser.add_argument('--timing', action='store_true', help='print the start-up and run time to stderr')
+    commands = parser.add_subparsers(dest='command')
+
+    command = commands.add_parser('gui', help='play against the computer (the default)')
+    command.add_argument('--images', default=None, help='images directory or images.zip')
+    command.add_argument('--seed', type=int, default=None)
+    command.set_defaults(run=gui)
+
+    command = commands.add_parser('simulate', help='deal hands and show who wins')
+    command.add_argument('-n', '--hands', type=int, default=1)
+    command.add_argument('--seats', type=int, default=2)
+    command.add_argument('--seed', type=int, default=None)
+    command.add_argument('-q', '--quiet', action='store_true', help='only print the tally of outcomes')
+    command.set_defaults(run=simulate)
+
+    command = commands.add_parser('equity', help='winning chances of hands against each other, e.g. 1h,13h 12s,12d')
+    command.add_argument('hands', nargs='+', help='two hole cards per hand, comma-separated')
+    command.add_argument('--board', default='', help='known community cards, comma-separated')
+    command.add_argument('--exact', action='store_true', help='enumerate every run-out instead of sampling')
+    command.add_argument('--samples', type=int, default=None, help='Monte Carlo samples (default 100000)')
+    command.add_argument('--time', type=float, default=None, help='Monte Carlo time budget in seconds')
+    command.add_argument('--workers', type=int, default=1)
+    command.add_argument('--seed', type=int, default=None)
+    command.set_defaults(run=equity)
+
+    command = commands.add_parser('test', help='run the self-checks of the evaluators and the rules')
+    command.set_defaults(run=test)
+
+    command = commands.add_parser('bench', add_help=False, help='run the benchmarks, see main.py bench --help')
+    command.set_defaults(run=bench)
+
+    # Anything after bench, --help included, is left for bench.py to parse
+    args, args.arguments = parser.parse_known_args(argv)
+    if args.arguments and args.command != 'bench':
+        parser.error(f'unrecognized arguments: {" ".join(args.arguments)}')
+    if args.command is None:
+        args = parser.parse_args(['--timing', 'gui'] if args.timing else ['gui'])
+
+    ready = time.perf_counter()
+    if args.timing:
+        print(f'start-up: {(ready - STARTED) * 1e3:.1f} ms in main.py, {time.process_time() * 1e3:.1f} ms CPU since '
+              f'the interpreter started', file=sys.stderr)
+
+    status = args.run(args)
+
+    if args.timing:
+        print(f'{args.command}: {(time.perf_counter() - ready) * 1e3:.1f} ms', file=sys.stderr)
+
+    return status or 0
+
 
 if __name__ == '__main__':
-    run = App(Game())
+    sys.exit(main())
@@ -0,0 +1,98 @@
+import math
+
+from components import CARDS, Card, hand_mask
+from evaluator import HAND_NAMES, HandState, category
+from game import VISIBLE_CARDS
+
+# Unseen cards once the flop and once the turn is out, counted from one player's view (2 hole cards plus the board)
+UNSEEN = {3: 47, 4: 46}
+
+# Draw odds by board size and number of outs - the chance the next card is an out, and the chance one of the cards
+# still to come is (by the river, so the same as the next card once the turn is out)
+DRAW_ODDS = {board: [(outs / unseen, 1 - math.comb(unseen - outs, 5 - board) / math.comb(unseen, 5 - board))
+                     for outs in range(unseen + 1)]
+             for board, unseen in UNSEEN.items()}
+
+
+# Outs of a hand: every unseen card which lifts it by more categories than the card lifts the board on its own, so the
+# improvement comes from the hole cards - a card which only pairs the board lifts everybody's hand with it and doesn't
+# count, as the 2s and 7s don't for a pair of kings on 2h 7h Kc
+#   - cards lists the outs, and categories the outs by the category they make, best first
+#   - next_card and by_river are the chances of hitting one, from DRAW_ODDS
+class Outs:
+    def __init__(self, strength, cards, categories, board):
+        self.strength = strength
+        self.cards = cards
+        self.categories = categories
+        self.next_card, self.by_river = DRAW_ODDS[board][len(cards)]
+
+    def __len__(self):
+        return len(self.cards)
+
+    # Summary such as 'Outs: 9 (Flush 9) - 19% next card, 35% by the river'
+    def describe(self):
+        if not self.cards:
+            return 'Outs: none'
+
+        made = ', '.join(f'{HAND_NAMES[made]} {len(cards)}' for made, cards in self.categories.items())
+        return f'Outs: {len(self.cards)} ({made}) - {self.next_card:.0%} next card, {self.by_river:.0%} by the river'
+
+    def __repr__(self):
+        return f'Outs({self.cards})'
+
+
+# Outs of two hole cards on a flop or turn board
+# Each unseen card is added to a HandState of the hand and of the board and taken back off again, so the 46 or 47
+# candidates cost at most two additions and two lookups each
+def find_outs(hole, board):
+    if len(hole) != 2 or len(board) not in UNSEEN:
+        raise ValueError('outs need two hole cards and a flop or turn board')
+
+    hand = HandState(list(hole) + list(board))
+    board_hand = HandState(board)
+    strength = hand.strength()
+    current = category(strength)
+    lead = current - category(board_hand.strength())
+    dead = hand.mask
+
+    outs = list()
+    categories = dict()
+    for card in CARDS:
+        if dead >> card & 1:
+            continue
+
+        hand.add(card)
+        made = category(hand.strength())
+        hand.undo()
+        if made <= current:
+            continue
+
+        board_hand.add(card)
+        shared = category(board_hand.strength())
+        board_hand.undo()
+        if made - shared > lead:
+            outs.append(card)
+            categories.setdefault(made, list()).append(card)
+
+    return Outs(strength, outs, dict(sorted(categories.items(), reverse=True)), len(board))
+
+
+# Outs of a seat at a table, from the cards it can see - None before the flop and on the river, when there are none
+def seat_outs(game, seat):
+    board = game.community[:VISIBLE_CARDS[game.stage]]
+    if len(board) not in UNSEEN or hand_mask(game.players[seat].cards) & hand_mask(board):
+        return None
+
+    return find_outs(game.players[seat].cards, board)
+
+
+# Check the outs of Ah Kh on 2h 7h Kc: the 9 hearts, the 2 kings and the 3 aces - the 2s and 7s which only pair the board
+# make two pair, but lift the board as much as the hand
+def run_tests():
+    outs = find_outs([Card.from_str('1h'), Card.from_str('13h')], [Card.from_str(card) for card in ('2h', '7h', '13c')])
+    expected = [Card.from_str(f'{value}h') for value in (3, 4, 5, 6, 8, 9, 10, 11, 12)] + \
+        [Card.from_str(card) for card in ('13d', '13s', '1c', '1d', '1s')]
+    assert sorted(outs.cards) == sorted(expected), outs
+    assert [len(cards) for cards in outs.categories.values()] == [9, 2, 3]
+    assert outs.describe() == 'Outs: 14 (Flush 9, Three of a Kind 2, Two Pairs 3) - 30% next card, 51% by the river', \
+        outs.describe()
@@ -0,0 +1,212 @@
+import argparse
+import mmap
+import os
+import random
+import struct
+from array import array
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from components import CARDS, hand_mask
+from evaluator import CARD_KEYS, key_strength
+
+RANK_NAMES = '23456789TJQKA'
+
+# Number of starting-hand classes: 13 pairs, 78 suited and 78 offsuit hands, laid out on a 13 x 13 grid where the
+# higher rank is the row for suited hands and the column for offsuit hands
+CLASSES = 169
+MAX_PLAYERS = 9
+
+# Table file layout: a header, one completion flag per generation task, the heads-up matrix of class vs class equity,
+# then the equity of each class against 1 to 8 random hands - all equities stored as native float32
+MAGIC = b'PFEQ'
+VERSION = 2
+HEADER = struct.Struct('<4sHHH')
+FLAGS_OFFSET = HEADER.size
+MATRIX_OFFSET = FLAGS_OFFSET + CLASSES + (-(FLAGS_OFFSET + CLASSES) % 4)
+MULTIWAY_OFFSET = MATRIX_OFFSET + CLASSES * CLASSES * 4
+FILE_SIZE = MULTIWAY_OFFSET + CLASSES * (MAX_PLAYERS - 1) * 4
+
+TABLE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tables', 'preflop.bin')
+
+# Generation is split into one task per flag: the 14,196 matchups above the diagonal and then the 169 multiway rows are
+# dealt out to the tasks in turn, so every task gets 84 matchups and one multiway row - the same work for each, where
+# whole rows ranged from 168 matchups for the first class to none for the last
+TASKS = CLASSES
+
+
+# Starting-hand class (0 thru 168) of a pair of hole cards
+def hand_class(cards):
+    first, second = cards
+    high, low = max(first.rank, second.rank), min(first.rank, second.rank)
+    return high * 13 + low if first.suit == second.suit else low * 13 + high
+
+
+# Name of a starting-hand class, e.g. 'AKs', 'AKo' or 'TT'
+def class_name(index):
+    row, column = divmod(index, 13)
+    if row == column:
+        return RANK_NAMES[row] * 2
+
+    return f'{RANK_NAMES[max(row, column)]}{RANK_NAMES[min(row, column)]}{"s" if row > column else "o"}'
+
+
+# Every pair of hole cards, grouped by starting-hand class
+def class_combos():
+    combos = [list() for _ in range(CLASSES)]
+    for first in CARDS:
+        for second in CARDS[first + 1:]:
+            combos[hand_class((first, second))].append((first, second))
+
+    return combos
+
+
+# Deal the rest of a hand for players who already hold the given cards and score the first player's pot share
+def sample_share(rng, hands, deck, dead, players):
+    remaining = [card for card in deck if not dead >> card & 1]
+    drawn = rng.sample(remaining, 5 + 2 * (players - len(hands)))
+    hands = list(hands) + [drawn[5 + 2 * seat:7 + 2 * seat] for seat in range(players - len(hands))]
+
+    board = 0
+    for card in drawn[:5]:
+        board += CARD_KEYS[card]
+
+    strengths = [key_strength(board + CARD_KEYS[first] + CARD_KEYS[second]) for first, second in hands]
+    best = max(strengths)
+    return 1 / strengths.count(best) if strengths[0] == best else 0.0
+
+
+# Cells of the table a task computes: (class, opponent class) matchups, and (class, None) for a class's multiway row
+def task_cells(task):
+    cells = [(index, opponent) for index in range(CLASSES) for opponent in range(index + 1, CLASSES)]
+    cells += [(index, None) for index in range(CLASSES)]
+    return cells[task::TASKS]
+
+
+# Compute a task's cells: heads-up equities of one class against a higher-numbered class, and a class's equity against
+# 1 to 8 random hands
+# The equities are Monte Carlo estimates, not exact enumerations - each is the mean pot share over samples random deals
+# (a random pair of non-overlapping combos of the two classes, then a random board), so its standard error is at most
+# 0.5 / sqrt(samples), about 1.1 percentage points at the default 2000
+# Every cell has its own RNG stream, so a table comes out the same no matter how the cells are split between tasks or
+# the tasks between workers
+def compute_task(task, samples, seed):
+    all_combos = class_combos()
+    matchups = list()
+    multiway = list()
+
+    for index, opponent in task_cells(task):
+        combos = all_combos[index]
+        if opponent is not None:
+            rng = random.Random(f'{seed}:{index}:{opponent}')
+            pairs = [(hero, villain) for hero in combos for villain in all_combos[opponent]
+                     if not hand_mask(hero) & hand_mask(villain)]
+            total = 0.0
+            for _ in range(samples):
+                hero, villain = rng.choice(pairs)
+                total += sample_share(rng, [hero, villain], CARDS, hand_mask(hero) | hand_mask(villain), 2)
+            matchups.append((index, opponent, total / samples))
+            continue
+
+        rng = random.Random(f'{seed}:{index}')
+        equities = list()
+        for players in range(2, MAX_PLAYERS + 1):
+            total = 0.0
+            for _ in range(samples):
+                hero = rng.choice(combos)
+                total += sample_share(rng, [hero], CARDS, hand_mask(hero), players)
+            equities.append(total / samples)
+        multiway.append((index, equities))
+
+    return task, matchups, multiway
+
+
+# Create an empty table file: every flag cleared, every equity NaN except the 0.5 of each class against itself
+def create_table(path):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    equities = array('f', [float('nan')]) * (CLASSES * CLASSES + CLASSES * (MAX_PLAYERS - 1))
+    for index in range(CLASSES):
+        equities[index * CLASSES + index] = 0.5
+
+    with open(path, 'wb') as file:
+        file.write(HEADER.pack(MAGIC, VERSION, CLASSES, MAX_PLAYERS))
+        file.write(bytes(MATRIX_OFFSET - FLAGS_OFFSET))
+        file.write(equities.tobytes())
+
+
+# Generate the preflop table in parallel, resuming from an existing file by skipping its finished tasks
+# Each finished task is written into the memory-mapped file and flushed straight away, so an interrupted run loses at
+# most the tasks still being computed
+def generate(path=TABLE_PATH, samples=2000, workers=None, seed=0, progress=print):
+    if not os.path.exists(path):
+        create_table(path)
+
+    with open(path, 'r+b') as file, mmap.mmap(file.fileno(), FILE_SIZE) as table:
+        pending = [task for task in range(TASKS) if not table[FLAGS_OFFSET + task]]
+
+        with ProcessPoolExecutor(workers) as pool:
+            futures = [pool.submit(compute_task, task, samples, seed) for task in pending]
+            for done, future in enumerate(as_completed(futures), 1):
+                task, matchups, multiway = future.result()
+
+                for index, opponent, equity in matchups:
+                    struct.pack_into('f', table, MATRIX_OFFSET + (index * CLASSES + opponent) * 4, equity)
+                    struct.pack_into('f', table, MATRIX_OFFSET + (opponent * CLASSES + index) * 4, 1 - equity)
+                for index, equities in multiway:
+                    struct.pack_into(f'{MAX_PLAYERS - 1}f', table, MULTIWAY_OFFSET + index * (MAX_PLAYERS - 1) * 4,
+                                     *equities)
+                table[FLAGS_OFFSET + task] = 1
+                table.flush()
+
+                if progress:
+                    progress(f'task {task} done ({done}/{len(pending)})')
+
+
+# Memory-mapped preflop equity table - opening it maps the file without parsing it, and each lookup reads one float
+class PreflopTable:
+    def __init__(self, path=TABLE_PATH):
+        with open(path, 'rb') as file:
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, classes, players = HEADER.unpack_from(self.map)
+        if (magic, version, classes, players) != (MAGIC, VERSION, CLASSES, MAX_PLAYERS) or len(self.map) != FILE_SIZE:
+            raise ValueError(f'{path} is not a version {VERSION} preflop table')
+
+        self.matrix = memoryview(self.map)[MATRIX_OFFSET:MULTIWAY_OFFSET].cast('f')
+        self.multiway = memoryview(self.map)[MULTIWAY_OFFSET:FILE_SIZE].cast('f')
+
+    # True once every task of the table has been generated
+    @property
+    def complete(self):
+        return all(self.map[FLAGS_OFFSET:FLAGS_OFFSET + TASKS])
+
+    # Heads-up equity of the first hand's class against the second's, e.g. for two Player.cards lists
+    def equity(self, cards, opponent_cards):
+        return self.matrix[hand_class(cards) * CLASSES + hand_class(opponent_cards)]
+
+    # Equity of a hand's class against players - 1 random hands, for 2 to 9 players
+    def equity_vs_random(self, cards, players=2):
+        return self.multiway[hand_class(cards) * (MAX_PLAYERS - 1) + players - 2]
+
+
+# Shared table opened by the first preflop_equity() call
+TABLE = None
+
+
+# Heads-up equity of one pair of hole cards against another, looked up in the default table file
+def preflop_equity(cards, opponent_cards):
+    global TABLE
+    if TABLE is None:
+        TABLE = PreflopTable()
+
+    return TABLE.equity(cards, opponent_cards)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate the preflop equity table.')
+    parser.add_argument('--path', default=TABLE_PATH)
+    parser.add_argument('--samples', type=int, default=2000, help='samples per matchup')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    generate(args.path, args.samples, args.workers, args.seed)
@@ -0,0 +1,311 @@
+import argparse
+import itertools
+import math
+import os
+import random
+import time
+
+import numpy as np
+
+from batch import CARD_RANK_KEYS, CARD_SUIT_MASKS, RANK_KEYS, keys_strength
+from components import CARDS, MASKS, SUITS, Card, hand_mask
+from equity import exact_equity
+from preflop import CLASSES, RANK_NAMES, TABLE_PATH, PreflopTable, hand_class
+
+# Every pair of hole cards, lower card first - a range is a vector of weights over these 1326 combos
+COMBOS = [(first, second) for first in CARDS for second in CARDS[first + 1:]]
+COMBO_INDEX = {combo: index for index, combo in enumerate(COMBOS)}
+COMBO_CARDS = np.array(COMBOS, dtype=np.intp)
+COMBO_MASKS = np.array([MASKS[first] | MASKS[second] for first, second in COMBOS], dtype=np.uint64)
+COMBO_CLASSES = np.array([hand_class(combo) for combo in COMBOS], dtype=np.intp)
+
+# Cards by ace-high rank (0 thru 12) and suit index (0 thru 3)
+RANK_CARDS = [[CARDS[(rank + 1) % 13 * 4 + suit] for suit in range(4)] for rank in range(13)]
+
+# Boards evaluated by default: every run-out when there are at most this many, otherwise this many sampled ones
+BOARD_SAMPLES = 2000
+
+# Combo strengths computed at a time (boards x combos), which bounds the temporary arrays
+STRENGTHS_PER_CHUNK = 1 << 22
+
+# Strengths fit in this many bits, so a card and a strength make one sortable key card << STRENGTH_BITS | strength
+STRENGTH_BITS = 24
+
+# Starting-hand classes from strongest to weakest by equity against a random hand, built on first use for
+# percentage ranges such as '15%'
+CLASS_ORDER = None
+
+# Boards the order is measured on, with one combo of each class against any two cards, when there is no preflop table
+CLASS_ORDER_SAMPLES = 500
+
+
+# Combos of a starting-hand class given as ranks and a kind: 's' suited, 'o' offsuit, '' both (pairs ignore the kind)
+def class_combos(high, low, kind):
+    if high == low:
+        return [COMBO_INDEX[tuple(sorted(pair))] for pair in itertools.combinations(RANK_CARDS[high], 2)]
+
+    combos = list()
+    for first, second in itertools.product(range(4), repeat=2):
+        if kind == 's' and first != second or kind == 'o' and first == second:
+            continue
+        combos.append(COMBO_INDEX[tuple(sorted((RANK_CARDS[high][first], RANK_CARDS[low][second])))])
+
+    return combos
+
+
+# Ranks and kind of a class such as 'AKs', 'T9o', 'QJ' or '77'
+def parse_class(text):
+    text = text.upper()
+    if len(text) not in (2, 3) or any(rank not in RANK_NAMES for rank in text[:2]) or text[2:] not in ('', 'S', 'O'):
+        raise ValueError(f'{text!r} is not a starting-hand class')
+
+    high, low = sorted((RANK_NAMES.index(text[0]), RANK_NAMES.index(text[1])), reverse=True)
+    return high, low, text[2:].lower()
+
+
+# Strongest starting-hand classes first, by equity against any two cards - from the preflop table if one has been
+# generated, otherwise measured on a fixed set of sampled boards
+def class_order():
+    global CLASS_ORDER
+    if CLASS_ORDER is None:
+        table = PreflopTable() if os.path.exists(TABLE_PATH) else None
+        if table is not None and table.complete:
+            equities = [table.equity_vs_random(COMBOS[np.flatnonzero(COMBO_CLASSES == index)[0]])
+                        for index in range(CLASSES)]
+        else:
+            hero = np.zeros(len(COMBOS))
+            first = [np.flatnonzero(COMBO_CLASSES == index)[0] for index in range(CLASSES)]
+            hero[first] = 1
+            equities = combo_equity(hero, np.ones(len(COMBOS)), samples=CLASS_ORDER_SAMPLES, seed=0)[first]
+        CLASS_ORDER = sorted(range(CLASSES), key=lambda index: -equities[index])
+
+    return CLASS_ORDER
+
+
+# Combo indices of one comma-separated part of a range
+def token_combos(token):
+    if token.lower() in ('any', 'random'):
+        return range(len(COMBOS))
+    elif token.endswith('%'):
+        wanted = float(token[:-1]) / 100 * len(COMBOS)
+        combos = list()
+        for index in class_order():
+            if len(combos) >= wanted:
+                break
+            combos.extend(np.flatnonzero(COMBO_CLASSES == index))
+        return combos
+    elif len(token) == 4 and token[1] in SUITS and token[3] in SUITS:
+        first, second = (RANK_CARDS[RANK_NAMES.index(token[index].upper())][SUITS.index(token[index + 1])]
+                         for index in (0, 2))
+        if first == second:
+            raise ValueError(f'{token!r} holds the same card twice')
+        return [COMBO_INDEX[tuple(sorted((first, second)))]]
+    elif token.endswith('+'):
+        high, low, kind = parse_class(token[:-1])
+        if high == low:
+            return [combo for rank in range(high, 13) for combo in class_combos(rank, rank, kind)]
+        return [combo for rank in range(low, high) for combo in class_combos(high, rank, kind)]
+    elif '-' in token:
+        start, end = (parse_class(part) for part in token.split('-'))
+        if start[2] != end[2]:
+            raise ValueError(f'{token!r} mixes suited and offsuit hands')
+        (high, low, kind), (end_high, end_low, _) = sorted((start, end), reverse=True)
+        if high == low and end_high == end_low:
+            steps = [(rank, rank) for rank in range(end_high, high + 1)]
+        elif high == end_high:
+            steps = [(high, rank) for rank in range(end_low, low + 1)]
+        elif high - low == end_high - end_low:
+            steps = [(rank, rank - (high - low)) for rank in range(end_high, high + 1)]
+        else:
+            raise ValueError(f'{token!r} is not a run of pairs, kickers or connectors')
+        return [combo for step_high, step_low in steps for combo in class_combos(step_high, step_low, kind)]
+
+    return class_combos(*parse_class(token))
+
+
+# Weights over COMBOS for a range written like 'QQ+, AKs, A5s-A2s, KQo:0.5, AhKh, 15%':
+#   - a class (AKs suited, AKo offsuit, AK both, QQ), XX+ for the pair and up and XYs+ for every kicker from Y up
+#   - X-Y runs of pairs (22-55), kickers (A2s-A5s) or connectors (T9s-65s), and exact combos such as AhKh
+#   - N% for the strongest N percent of combos, and any for all of them
+#   - :weight after a part sets its weight, 1 by default - later parts overwrite earlier ones
+def parse_range(text):
+    weights = np.zeros(len(COMBOS))
+    for token in text.replace(' ', '').split(','):
+        if token:
+            token, _, weight = token.partition(':')
+            weights[list(token_combos(token))] = float(weight) if weight else 1.0
+
+    return weights
+
+
+# A weighted range of hole cards, from range text or from a weight vector over COMBOS
+class Range:
+    def __init__(self, text='any', weights=None):
+        self.text = text
+        self.weights = parse_range(text) if weights is None else np.asarray(weights, dtype=float)
+
+    def __len__(self):
+        return int(np.count_nonzero(self.weights))
+
+    # Share of all combos the range holds, counting each by its weight
+    @property
+    def share(self):
+        return float(self.weights.sum() / len(COMBOS))
+
+    # Combos held, as hole card pairs - e.g. for ai.EquityPolicy(range=...)
+    def combos(self):
+        return [COMBOS[index] for index in np.flatnonzero(self.weights)]
+
+    # Copy without the combos which hold any of the dead cards
+    def without(self, dead):
+        weights = self.weights.copy()
+        weights[COMBO_MASKS & np.uint64(hand_mask(dead)) != 0] = 0
+        return Range(self.text, weights)
+
+    def __repr__(self):
+        return f'Range({self.text!r}, combos={len(self)})'
+
+
+def as_weights(hand_range):
+    if isinstance(hand_range, Range):
+        return hand_range.weights
+    elif isinstance(hand_range, str):
+        return parse_range(hand_range)
+
+    return np.asarray(hand_range, dtype=float)
+
+
+# Completions of a partial board as an (N, 5) card array: every one if there are at most samples, otherwise samples
+# random ones
+def complete_boards(board, samples=BOARD_SAMPLES, rng=None):
+    board = [int(card) for card in board]
+    dead = hand_mask(board)
+    remaining = [card for card in range(52) if not dead >> card & 1]
+    missing = 5 - len(board)
+
+    if math.comb(len(remaining), missing) <= samples:
+        runouts = itertools.combinations(remaining, missing)
+    else:
+        rng = rng or random.Random()
+        runouts = (rng.sample(remaining, missing) for _ in range(samples))
+
+    return np.array([board + list(runout) for runout in runouts], dtype=np.intp).reshape(-1, 5)
+
+
+# Strengths of every combo with every board, as a (boards, combos) array - the combos' and boards' additive key parts
+# are summed by broadcasting and looked up in one batch; pairs sharing a card get a meaningless strength
+def board_strengths(boards, combos):
+    cards = COMBO_CARDS[combos]
+    rank_keys = CARD_RANK_KEYS[boards].sum(axis=1)[:, None] + CARD_RANK_KEYS[cards].sum(axis=1)[None, :]
+    suit_masks = [(masks[boards].sum(axis=1)[:, None] + masks[cards].sum(axis=1)[None, :]) & 0x1FFF
+                  for masks in CARD_SUIT_MASKS]
+    rank_keys = np.minimum(rank_keys, RANK_KEYS[-1])
+
+    return keys_strength(rank_keys.ravel(), [masks.ravel() for masks in suit_masks]).reshape(len(boards), len(combos))
+
+
+# Each hero combo's equity against the villain range on the board's completions, nan for combos the hero range doesn't
+# hold or which can't be dealt - every pair of combos is weighted by both ranges' weights and counted only on boards
+# which share no card with either, so conflicting combos drop out through their 52-bit masks
+def combo_equity(hero, villain, board=(), samples=BOARD_SAMPLES, seed=None):
+    shares, weights, combos = showdown_sums(hero, villain, board, samples, seed)
+    equity = np.full(len(COMBOS), np.nan)
+    held = weights > 0
+    equity[combos[held]] = shares[held] / weights[held]
+
+    return equity
+
+
+# Equity of the hero range against the villain range - the villain's is one minus this
+def range_equity(hero, villain, board=(), samples=BOARD_SAMPLES, seed=None):
+    shares, weights, combos = showdown_sums(hero, villain, board, samples, seed)
+    if not weights.sum():
+        raise ValueError('the ranges hold no combos which can be dealt together on this board')
+
+    return float(shares.sum() / weights.sum())
+
+
+# Weighted pot shares and total weights of each hero combo against the villain range, over the board's completions
+# On each board the villain combos are sorted by strength once, and a hero combo's wins and ties are read off their
+# cumulative weights with searchsorted() - O(C log C) per board instead of comparing every pair of combos
+# Villain combos sharing a card with a hero combo are taken back off through the same sums per card: the ones holding
+# either of its two cards, less the hero combo itself, which holds both and so was taken off twice
+def showdown_sums(hero, villain, board=(), samples=BOARD_SAMPLES, seed=None):
+    hero, villain = as_weights(hero), as_weights(villain)
+    dead = np.uint64(hand_mask(board))
+    hero_combos = np.flatnonzero((hero > 0) & (COMBO_MASKS & dead == 0))
+    villain_combos = np.flatnonzero((villain > 0) & (COMBO_MASKS & dead == 0))
+
+    boards = complete_boards(board, samples, random.Random(seed))
+    board_masks = np.bitwise_or.reduce(np.left_shift(np.uint64(1), boards.astype(np.uint64)), axis=1)
+    hero_cards = COMBO_CARDS[hero_combos].astype(np.int64) << STRENGTH_BITS
+    villain_cards = COMBO_CARDS[villain_combos].astype(np.int64).ravel() << STRENGTH_BITS
+    itself = villain[hero_combos]
+
+    shares = np.zeros(len(hero_combos))
+    weights = np.zeros(len(hero_combos))
+    step = max(1, STRENGTHS_PER_CHUNK // max(1, len(hero_combos) + len(villain_combos)))
+    for start in range(0, len(boards), step):
+        chunk = boards[start:start + step]
+        masks = board_masks[start:start + step, None]
+        hero_weights = hero[hero_combos][None, :] * (COMBO_MASKS[hero_combos][None, :] & masks == 0)
+        villain_weights = villain[villain_combos][None, :] * (COMBO_MASKS[villain_combos][None, :] & masks == 0)
+        hero_strengths = board_strengths(chunk, hero_combos)
+        villain_strengths = board_strengths(chunk, villain_combos)
+
+        for index in range(len(chunk)):
+            strengths = hero_strengths[index]
+            order = np.argsort(villain_strengths[index])
+            ranked = villain_strengths[index][order]
+            cumulative = np.concatenate(([0.0], np.cumsum(villain_weights[index][order])))
+            below = cumulative[np.searchsorted(ranked, strengths, 'left')]
+            up_to = cumulative[np.searchsorted(ranked, strengths, 'right')]
+            total = np.full(len(hero_combos), cumulative[-1])
+
+            keys = villain_cards | np.repeat(villain_strengths[index], 2)
+            order = np.argsort(keys)
+            keys = keys[order]
+            cumulative = np.concatenate(([0.0], np.cumsum(np.repeat(villain_weights[index], 2)[order])))
+            for card in hero_cards.T:
+                first = cumulative[np.searchsorted(keys, card, 'left')]
+                below -= cumulative[np.searchsorted(keys, card | strengths, 'left')] - first
+                up_to -= cumulative[np.searchsorted(keys, card | strengths, 'right')] - first
+                total -= cumulative[np.searchsorted(keys, card + (1 << STRENGTH_BITS), 'left')] - first
+
+            shares += hero_weights[index] * (below + 0.5 * (up_to + itself - below))
+            weights += hero_weights[index] * (total + itself)
+
+    return shares, weights, hero_combos
+
+
+# Check the range sums against exact_equity() on a flop, whose 990 run-outs are all enumerated - every pair of combos
+# which share no card is dealt the same number of boards, so the equity of one range against another must be the mean
+# exact equity of those pairs, while the pairs which share a card (AhKh against AhKh and AhQh here) drop out
+def run_tests():
+    board = [Card.from_str(card) for card in ('2h', '7h', '13c')]
+    hero, villain = Range('AhKh,QsQd,JhTh'), Range('AhKh,AhQh,KsKd,QsQd,AcAd')
+    pairs = [(first, second) for first in hero.combos() for second in villain.combos()
+             if not hand_mask(first) & hand_mask(second)]
+    expected = sum(exact_equity([first, second], board).equity[0] for first, second in pairs) / len(pairs)
+
+    assert abs(range_equity(hero, villain, board) - expected) < 1e-9
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Equity of one range of hole cards against another.')
+    parser.add_argument('hero', help="range such as 'QQ+,AKs' or '15%%'")
+    parser.add_argument('villain')
+    parser.add_argument('--board', default='', help='known community cards, comma-separated, e.g. 1h,7d,2c')
+    parser.add_argument('--samples', type=int, default=BOARD_SAMPLES, help='boards sampled when there are more')
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    board = [Card.from_str(card) for card in args.board.split(',') if card]
+    hero, villain = Range(args.hero).without(board), Range(args.villain).without(board)
+    start = time.perf_counter()
+    equity = range_equity(hero, villain, board, args.samples, args.seed)
+
+    print(f'{args.hero:>20} {len(hero):5} combos  equity {equity:7.2%}\n'
+          f'{args.villain:>20} {len(villain):5} combos  equity {1 - equity:7.2%}\n'
+          f'{len(complete_boards(board, args.samples, random.Random(0))):,} boards in '
+          f'{time.perf_counter() - start:.2f}s')
@@ -0,0 +1,323 @@
+import argparse
+import asyncio
+import gc
+import json
+import random
+import time
+
+from ai import EquityPolicy, policy_stats
+from engine import CHECK, FOLD, RAISE, Engine, RandomPolicy
+from game import VISIBLE_CARDS, Game
+
+# Bytes of unsent output after which a connection stops reading commands until its client catches up
+WRITE_BUFFER_LIMIT = 1 << 20
+
+# Seconds an equity bot thinks before giving the other tables a turn
+THINK_SLICE = 0.001
+
+# Allocations between young-generation collections - at the default of 700 a server with 1000 tables in play collected
+# about 6 times a second with pauses of 6 ms (23 ms at most), at 10000 about once in 20 seconds
+GC_THRESHOLD = 10000
+
+
+# One headless table - seats claimed by a remote client are decided over the connection, every other seat by a bot
+# The table only plays while at least one client is seated
+class Table:
+    def __init__(self, manager, number, seats, seed):
+        self.manager = manager
+        self.number = number
+        self.game = Game(random.Random(f'{seed}:{number}'), seats)
+        self.bots = [manager.bot(random.Random(f'{seed}:{number}:{seat}')) for seat in range(seats)]
+        self.engine = Engine(self.game, [None] * seats)
+        self.clients = [None] * seats
+        self.waiting = None
+        self.occupied = asyncio.Event()
+        self.hands = 0
+
+    # Seat a client in the first free seat, returning the seat or None if the table is full
+    def join(self, client):
+        for seat, occupant in enumerate(self.clients):
+            if occupant is None:
+                self.clients[seat] = client
+                self.occupied.set()
+                return seat
+
+        return None
+
+    def leave(self, seat):
+        self.clients[seat] = None
+        if self.waiting is not None and self.waiting[0] == seat:
+            self.resolve(seat, self.default_action(seat))
+        if not any(self.clients):
+            self.occupied.clear()
+
+    # Action taken for a seat which timed out, left or sent an illegal action
+    def default_action(self, seat):
+        return (FOLD, 0) if self.engine.owed(seat) else (CHECK, 0)
+
+    # Hand a remote seat's decision to the table coroutine waiting for it
+    def resolve(self, seat, action):
+        if self.waiting is None or self.waiting[0] != seat or self.waiting[1].done():
+            return False
+
+        self.waiting[1].set_result(action)
+        return True
+
+    # Send the seat to act its options and wait for its decision, falling back to default_action() after the timeout
+    # or an illegal action
+    async def ask(self, seat, client):
+        engine = self.engine
+        game = self.game
+        player = game.players[seat]
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.waiting = (seat, future)
+        timer = loop.call_later(self.manager.timeout, self.expire, seat, future)
+
+        legal = engine.legal_actions(seat)
+        client.send(f'TURN {self.number} {game.stage} {engine.owed(seat)} {engine.max_raise(seat)} '
+                    f'{",".join(legal)} {",".join(map(str, player.cards))} '
+                    f'{",".join(map(str, game.community[:VISIBLE_CARDS[game.stage]])) or "-"}')
+        try:
+            action = await future
+        finally:
+            timer.cancel()
+            self.waiting = None
+
+        if action[0] not in legal or (action[0] == RAISE and action[1] <= 0):
+            client.send(f'ERROR {self.number} {action[0]} is not allowed')
+            return self.default_action(seat)
+
+        return action
+
+    def expire(self, seat, future):
+        if not future.done():
+            self.manager.timeouts += 1
+            future.set_result(self.default_action(seat))
+
+    # Decision of a bot - one which can think in slices (see ai.EquityPolicy.begin()) yields to the other tables
+    # between them, so a table never holds the event loop for longer than THINK_SLICE
+    async def think(self, seat):
+        bot = self.bots[seat]
+        if not hasattr(bot, 'begin'):
+            return bot.decide(self.engine, seat)
+
+        thought = bot.begin(self.engine, seat)
+        while not thought.step(THINK_SLICE):
+            await asyncio.sleep(0)
+
+        return thought.answer()
+
+    async def play_hand(self):
+        engine = self.engine
+        game = self.game
+
+        if engine.game_over:
+            game.new_game()
+            engine.reset()
+        if game.stage == 'next':
+            engine.deal()
+        engine.result = None
+
+        while engine.result is None:
+            seat = engine.to_act
+            if seat is not None:
+                client = self.clients[seat]
+                if client is None:
+                    action = await self.think(seat)
+                else:
+                    action = await self.ask(seat, client)
+
+                engine.act(*action)
+                self.manager.actions += 1
+            elif game.stage == 'end':
+                engine.showdown()
+            else:
+                engine.deal()
+
+        result = engine.result
+        for seat, client in enumerate(self.clients):
+            if client is not None:
+                client.send(f'RESULT {self.number} {",".join(map(str, result.winners))} {result.pot} '
+                            f'{game.players[seat].funds}')
+
+        self.hands += 1
+        self.manager.hands += 1
+
+    # Play hands while anyone is seated, giving the other tables a turn between hands - waiting on a remote seat
+    # yields too, so even a hand played out by bots alone holds the event loop for at most one hand
+    async def run(self):
+        while True:
+            await self.occupied.wait()
+            await self.play_hand()
+            await asyncio.sleep(0)
+
+
+# A TCP connection, which may hold seats at any number of tables
+# Lines sent during one pass of the event loop are written together, so a client seated at many tables costs one
+# socket write per pass instead of one per message
+class Client:
+    def __init__(self, writer):
+        self.writer = writer
+        self.seats = dict()
+        self.buffer = list()
+
+    def send(self, line):
+        if not self.buffer:
+            asyncio.get_running_loop().call_soon(self.flush)
+        self.buffer.append(line)
+
+    def flush(self):
+        if not self.writer.is_closing():
+            self.writer.write('\n'.join(self.buffer).encode() + b'\n')
+        self.buffer.clear()
+
+
+# Runs a fixed number of tables as coroutines on one event loop and serves the line protocol:
+#   client -> server: JOIN [table] | ACT <table> <check|call|raise|fold> [amount] | LEAVE <table> | STATS
+#   server -> client: SEATED <table> <seat> | TURN <table> <stage> <owed> <max raise> <legal actions> <cards> <board>
+#                     | RESULT <table> <winners> <pot> <funds> | STATS <json> | ERROR [table] <message>
+# bots is 'random' for RandomPolicy bots or 'equity' for EquityPolicy bots with think_time seconds per decision
+class TableManager:
+    def __init__(self, tables=1000, seats=2, seed=0, timeout=10.0, bots='random', think_time=0.005):
+        if bots == 'equity':
+            self.bot = lambda rng: EquityPolicy(rng, think_time)
+        else:
+            self.bot = RandomPolicy
+        self.tables = [Table(self, number, seats, seed) for number in range(tables)]
+        self.timeout = timeout
+        self.next_table = 0
+        self.tasks = list()
+        self.hands = 0
+        self.actions = 0
+        self.timeouts = 0
+        self.started = time.perf_counter()
+
+    def start(self):
+        self.tasks = [asyncio.ensure_future(table.run()) for table in self.tables]
+
+    def stop(self):
+        for task in self.tasks:
+            task.cancel()
+
+    # Table to seat a client who didn't ask for one - clients are spread over the tables in turn, skipping the ones the
+    # client already sits at
+    def free_table(self, client):
+        for _ in range(len(self.tables)):
+            table = self.tables[self.next_table]
+            self.next_table = (self.next_table + 1) % len(self.tables)
+            if None in table.clients and table.number not in client.seats:
+                return table
+
+        return None
+
+    def stats(self):
+        stats = {'tables': len(self.tables),
+                 'occupied': sum(table.occupied.is_set() for table in self.tables),
+                 'hands': self.hands,
+                 'actions': self.actions,
+                 'timeouts': self.timeouts,
+                 'uptime': time.perf_counter() - self.started}
+        bots = [bot for table in self.tables for bot in table.bots if isinstance(bot, EquityPolicy)]
+        if bots:
+            stats['bots'] = policy_stats(bots)
+
+        return stats
+
+    def command(self, client, words):
+        if words[0] in ('JOIN', 'ACT', 'LEAVE') and len(words) > 1:
+            number = int(words[1])
+            if not 0 <= number < len(self.tables):
+                return f'ERROR {number} no such table'
+
+        if words[0] == 'JOIN':
+            table = self.free_table(client) if len(words) == 1 else self.tables[int(words[1])]
+            if table is not None and table.number in client.seats:
+                return f'ERROR {table.number} already seated'
+            seat = None if table is None else table.join(client)
+            if seat is None:
+                return 'ERROR no free seat'
+            client.seats[table.number] = seat
+            return f'SEATED {table.number} {seat}'
+        elif words[0] == 'ACT':
+            number = int(words[1])
+            if number not in client.seats:
+                return f'ERROR {number} not seated'
+            action = (words[2].lower(), int(words[3]) if len(words) > 3 else 0)
+            if not self.tables[number].resolve(client.seats[number], action):
+                return f'ERROR {number} not your turn'
+        elif words[0] == 'LEAVE':
+            number = int(words[1])
+            if number in client.seats:
+                self.tables[number].leave(client.seats.pop(number))
+        elif words[0] == 'STATS':
+            return f'STATS {json.dumps(self.stats())}'
+        else:
+            return f'ERROR unknown command {words[0]}'
+
+    async def handle(self, reader, writer):
+        client = Client(writer)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+
+                words = line.decode().split()
+                if not words:
+                    continue
+                try:
+                    reply = self.command(client, words)
+                except (ValueError, IndexError):
+                    reply = f'ERROR malformed command {line.decode().strip()}'
+                if reply:
+                    client.send(reply)
+                if writer.transport.get_write_buffer_size() > WRITE_BUFFER_LIMIT:
+                    await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            for number, seat in client.seats.items():
+                self.tables[number].leave(seat)
+            writer.close()
+
+    async def serve(self, host='127.0.0.1', port=7777):
+        self.start()
+        # Every collection pauses all the tables at once, so move the tables and everything else built at start-up out
+        # of the collector's way and collect less often - the collector stays on for the cycles futures, tracebacks and
+        # connections leave behind
+        gc.collect()
+        gc.freeze()
+        gc.set_threshold(GC_THRESHOLD, *gc.get_threshold()[1:])
+        server = await asyncio.start_server(self.handle, host, port, limit=1 << 16)
+        async with server:
+            await server.serve_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Host headless poker tables over a TCP line protocol.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=7777)
+    parser.add_argument('--tables', type=int, default=5000)
+    parser.add_argument('--seats', type=int, default=2)
+    parser.add_argument('--timeout', type=float, default=10.0, help='seconds a client has to act')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--bots', choices=('random', 'equity'), default='random', help='policy of the seats nobody took')
+    parser.add_argument('--think-time', type=float, default=0.005, help='seconds an equity bot thinks per decision')
+    args = parser.parse_args(argv)
+
+    # The manager is created inside the event loop, which its tables' events belong to
+    async def serve():
+        await TableManager(args.tables, args.seats, args.seed, args.timeout, args.bots,
+                           args.think_time).serve(args.host, args.port)
+
+    print(f'serving {args.tables} tables on {args.host}:{args.port}')
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
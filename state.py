@@ -0,0 +1,364 @@
+import random
+from array import array
+
+from components import CARDS, Player
+from engine import CALL, CHECK, FOLD, RAISE, Engine
+from evaluator import CARD_KEYS, key_strength
+from game import VISIBLE_CARDS, Game
+
+# Pseudo-action which deals the next street, or shows down once betting on the river is over
+DEAL = 'deal'
+
+STAGES = ('opening', 'pre-flop', 'flop', 'turn', 'river', 'end', 'next')
+STAGE_INDEX = {stage: index for index, stage in enumerate(STAGES)}
+OPENING, PRE_FLOP, FLOP, TURN, RIVER, END, NEXT = range(len(STAGES))
+
+# Seat numbers of undo log steps which save every seat's stack and bets, or the cards
+ALL_SEATS, CARDS_ONLY = -1, -2
+
+# Community cards visible in each stage, by stage index
+VISIBLE = tuple(VISIBLE_CARDS[stage] for stage in STAGES)
+
+
+# One hand of a Game and its Engine as a handful of integers and arrays, for searches which branch a hand thousands of
+# times - the same betting rules as the Engine without a Deck, Players or lists of Card objects to copy
+#   - stage indexes STAGES, to_act is -1 when nobody is to act, and folded and pending are seat bitmasks
+#   - funds, street_bets and contributed are integer arrays with one entry per seat
+#   - cards is the deck order as 52 card indices: seat n's hole cards at 2n and 2n + 1, then the five community cards,
+#     the first top of which have been dealt
+# apply() takes an action for the seat to act, or DEAL to move on once betting closes, and first pushes what it is about
+# to change onto a flat undo log of integers: the six scalars, then the stack and bets of the acting seat (of every seat
+# when a deal or a payout touches them all) - stack holds where each step starts in the log, and undo() writes the step
+# back in place, so a rollout is apply(), apply(), ... then rewind() back to where it started without copying an array
+# Only redeal() saves the cards, which nothing else changes
+# snapshot() and restore() save and restore the whole state by hand, and from_game() and to_game() convert from and to
+# a Game and its Engine
+class GameState:
+    __slots__ = ('seats', 'stage', 'pot', 'to_act', 'raises', 'folded', 'pending', 'funds', 'street_bets',
+                 'contributed', 'cards', 'top', 'min_bet', 'max_raises', 'stack', 'log')
+
+    def __init__(self, seats=2, funds=1000, min_bet=Game.min_bet, max_raises=Engine.max_raises):
+        self.seats = seats
+        self.stage = OPENING
+        self.pot = 0
+        self.to_act = -1
+        self.raises = 0
+        self.folded = 0
+        self.pending = 0
+        self.funds = array('q', [funds] * seats)
+        self.street_bets = array('q', [0] * seats)
+        self.contributed = array('q', [0] * seats)
+        self.cards = array('b', range(52))
+        self.top = 2 * seats + 5
+        self.min_bet = min_bet
+        self.max_raises = max_raises
+        self.stack = list()
+        self.log = list()
+
+    # State of a game, and of its engine's betting round if one is given (otherwise no betting has happened yet)
+    @classmethod
+    def from_game(cls, game, engine=None):
+        seats = len(game.players)
+        state = cls(seats, 0, game.min_bet, Engine.max_raises if engine is None else engine.max_raises)
+        state.stage = STAGE_INDEX[game.stage]
+        state.pot = game.pot
+        state.funds = array('q', [player.funds for player in game.players])
+        state.cards = array('b', game.deck)
+        state.top = game.deck.top
+
+        if engine is not None:
+            state.to_act = -1 if engine.to_act is None else engine.to_act
+            state.raises = engine.raises
+            state.folded = sum(1 << seat for seat, folded in enumerate(engine.folded) if folded)
+            state.pending = sum(1 << seat for seat in engine.pending)
+            state.street_bets = array('q', engine.street_bets)
+            state.contributed = array('q', engine.contributed)
+
+        return state
+
+    # Write the state into a game (a new one by default) and, if given, an engine for that game, returning the game
+    # Only the state of the current hand is written - the engine's action list and result are left as they are
+    def to_game(self, game=None, engine=None):
+        seats = self.seats
+        if game is None:
+            game = Game(random.Random(), seats)
+        elif len(game.players) != seats:
+            game.players = [Player() for _ in range(seats)]
+            game.player, game.computer = game.players[:2]
+
+        game.deck[:] = [CARDS[card] for card in self.cards]
+        game.deck.top = self.top
+        game.stage = STAGES[self.stage]
+        game.pot = self.pot
+        for seat, player in enumerate(game.players):
+            player.funds = self.funds[seat]
+            player.cards[:] = game.deck[2 * seat:2 * seat + 2] if self.top >= 2 * seats else []
+        game.community[:] = game.deck[2 * seats:self.top]
+
+        if engine is not None:
+            engine.to_act = None if self.to_act < 0 else self.to_act
+            engine.raises = self.raises
+            engine.folded = [bool(self.folded >> seat & 1) for seat in range(seats)]
+            engine.pending = [seat for seat in self.order(self.to_act) if self.pending >> seat & 1]
+            engine.street_bets = list(self.street_bets)
+            engine.contributed = list(self.contributed)
+
+        return game
+
+    # Everything apply() can change, as one tuple
+    def snapshot(self):
+        return (self.stage, self.pot, self.to_act, self.raises, self.folded, self.pending, self.funds.tobytes(),
+                self.street_bets.tobytes(), self.contributed.tobytes(), self.cards.tobytes())
+
+    def restore(self, snapshot):
+        self.stage, self.pot, self.to_act, self.raises, self.folded, self.pending, funds, street_bets, contributed, \
+            cards = snapshot
+        self.funds = array('q', funds)
+        self.street_bets = array('q', street_bets)
+        self.contributed = array('q', contributed)
+        self.cards = array('b', cards)
+
+    # Seats in acting order starting at a seat (seat 0 if it is -1)
+    def order(self, start):
+        start = max(start, 0)
+        return list(range(start, self.seats)) + list(range(start))
+
+    def hole_cards(self, seat):
+        return [CARDS[self.cards[2 * seat]], CARDS[self.cards[2 * seat + 1]]]
+
+    # Community cards visible in the current stage
+    def board(self):
+        start = 2 * self.seats
+        return [CARDS[card] for card in self.cards[start:start + VISIBLE[self.stage]]]
+
+    @property
+    def done(self):
+        return self.stage == NEXT
+
+    def owed(self, seat):
+        return max(self.street_bets) - self.street_bets[seat]
+
+    def max_raise(self, seat):
+        bets = self.street_bets
+        funds = self.funds
+        reachable = 0
+        for other in range(self.seats):
+            if other != seat and not self.folded >> other & 1 and funds[other] + bets[other] > reachable:
+                reachable = funds[other] + bets[other]
+
+        top = max(bets)
+        return max(min(funds[seat] - top + bets[seat], reachable - top), 0)
+
+    # Legal actions of the seat to act, or [DEAL] when betting is closed and the hand isn't over
+    def legal_actions(self):
+        seat = self.to_act
+        if seat < 0:
+            return [] if self.stage == NEXT else [DEAL]
+        elif self.raises < self.max_raises and self.max_raise(seat) > 0:
+            return [CALL, RAISE, FOLD] if self.owed(seat) else [CHECK, RAISE]
+
+        return [CALL, FOLD] if self.owed(seat) else [CHECK]
+
+    # Seats still in the hand with funds to bet, as a bitmask
+    def able(self):
+        able = 0
+        for seat in range(self.seats):
+            if not self.folded >> seat & 1 and self.funds[seat] > 0:
+                able |= 1 << seat
+
+        return able
+
+    # First seat of a bitmask in acting order after a seat, or -1 if the mask is empty
+    def next_seat(self, mask, after):
+        for seat in self.order(after + 1 if after + 1 < self.seats else 0):
+            if mask >> seat & 1:
+                return seat
+
+        return -1
+
+    def bet(self, seat, amount):
+        self.funds[seat] -= amount
+        self.street_bets[seat] += amount
+        self.contributed[seat] += amount
+        self.pot += amount
+
+    # Apply an action of the seat to act, or DEAL once betting is closed, after pushing the current state for undo()
+    # Raises are clipped to max_raise() like the Engine's, and an illegal action raises a ValueError
+    def apply(self, action, amount=0):
+        if action not in self.legal_actions():
+            raise ValueError(f'{action} is not allowed, expected one of {self.legal_actions()}')
+
+        # A deal or a payout changes every seat, and a fold pays out when it leaves one seat in the hand
+        if action == DEAL:
+            self.save(ALL_SEATS)
+            if self.stage == END:
+                self.showdown()
+            else:
+                self.deal()
+            return
+
+        seat = self.to_act
+        rest = ~self.folded & ~(1 << seat) & (1 << self.seats) - 1
+        self.save(ALL_SEATS if action == FOLD and rest & rest - 1 == 0 else seat)
+        if action == FOLD:
+            self.folded |= 1 << seat
+        elif action == CALL:
+            self.bet(seat, min(self.owed(seat), self.funds[seat]))
+        elif action == RAISE:
+            amount = min(amount, self.max_raise(seat))
+            if amount <= 0:
+                self.undo()
+                raise ValueError('a raise must be a positive amount')
+            self.bet(seat, self.owed(seat) + amount)
+            self.raises += 1
+            self.pending = self.able()
+        self.pending &= ~(1 << seat)
+
+        live = ~self.folded & (1 << self.seats) - 1
+        if live & live - 1 == 0:
+            self.to_act = -1
+            self.finish(live.bit_length() - 1)
+        elif not self.pending:
+            self.close_betting()
+        else:
+            self.to_act = self.next_seat(self.pending, seat)
+
+    # Push one step onto the undo log: the scalars, the seat, then the stack and bets of that seat, of every seat for
+    # ALL_SEATS, or the cards for CARDS_ONLY
+    def save(self, seat):
+        log = self.log
+        self.stack.append(len(log))
+        log += self.stage, self.pot, self.to_act, self.raises, self.folded, self.pending, seat
+        if seat >= 0:
+            log += self.funds[seat], self.street_bets[seat], self.contributed[seat]
+        elif seat == ALL_SEATS:
+            for other in range(self.seats):
+                log += self.funds[other], self.street_bets[other], self.contributed[other]
+        else:
+            log.append(self.cards.tobytes())
+
+    # Take back the last apply() or redeal()
+    def undo(self):
+        log = self.log
+        start = self.stack.pop()
+        self.stage, self.pot, self.to_act, self.raises, self.folded, self.pending, seat = log[start:start + 7]
+        if seat >= 0:
+            self.funds[seat], self.street_bets[seat], self.contributed[seat] = log[start + 7:start + 10]
+        elif seat == ALL_SEATS:
+            for other in range(self.seats):
+                index = start + 7 + 3 * other
+                self.funds[other], self.street_bets[other], self.contributed[other] = log[index:index + 3]
+        else:
+            self.cards[:] = array('b', log[start + 7])
+        del log[start:]
+
+    # Undo back to a depth of the undo stack, e.g. len(state.stack) taken before a rollout
+    def rewind(self, depth):
+        while len(self.stack) > depth:
+            self.undo()
+
+    def deal(self):
+        for seat in range(self.seats):
+            self.street_bets[seat] = 0
+        if self.stage == OPENING:
+            self.folded = 0
+            for seat in range(self.seats):
+                self.contributed[seat] = 0
+                self.bet(seat, min(self.min_bet, self.funds[seat]))
+
+        self.stage += 1
+        self.raises = 0
+        self.pending = self.able()
+        pending = [seat for seat in range(self.seats) if self.pending >> seat & 1]
+
+        if len(pending) < 2 and not any(self.owed(seat) for seat in pending):
+            self.close_betting()
+        else:
+            self.to_act = pending[0]
+
+    def close_betting(self):
+        self.to_act = -1
+        self.pending = 0
+        if self.stage == RIVER:
+            self.stage = END
+
+    # Split the pot between the live hands, like Engine.showdown()
+    def showdown(self):
+        start = 2 * self.seats
+        board = 0
+        for card in self.cards[start:start + 5]:
+            board += CARD_KEYS[card]
+
+        hands = [None] * self.seats
+        for seat in range(self.seats):
+            if not self.folded >> seat & 1:
+                strength = key_strength(board + CARD_KEYS[self.cards[2 * seat]] + CARD_KEYS[self.cards[2 * seat + 1]])
+                hands[seat] = (None, None, strength)
+
+        self.pay(Game.split_pot(list(self.contributed), hands))
+
+    # Pay the last seat left the pots it matched, like Engine.finish()
+    def finish(self, winner):
+        hands = [None] * self.seats
+        hands[winner] = (None, None, 0)
+        self.pay(Game.split_pot(list(self.contributed), hands))
+
+    def pay(self, payouts):
+        for seat, payout in enumerate(payouts):
+            self.funds[seat] += payout
+        self.pot = 0
+        self.stage = NEXT
+
+    # Re-deal every card a seat can't see - the other seats' hole cards and the community cards still to come - from
+    # the cards it hasn't seen, e.g. to sample what the others might hold in a rollout (undo() puts the deal back)
+    def redeal(self, seat, rng=random):
+        self.save(CARDS_ONLY)
+        seen = {2 * seat, 2 * seat + 1} | set(range(2 * self.seats, 2 * self.seats + VISIBLE[self.stage]))
+        hidden = [index for index in range(52) if index not in seen]
+        cards = [self.cards[index] for index in hidden]
+        rng.shuffle(cards)
+        for index, card in zip(hidden, cards):
+            self.cards[index] = card
+
+    def __repr__(self):
+        return f'GameState(stage={STAGES[self.stage]!r}, pot={self.pot}, funds={list(self.funds)}, to_act={self.to_act})'
+
+
+# Check GameState against the Engine on seeded random hands at 2 to 6 seats with short stacks, so all-ins and side pots
+# come up: every action is applied to both, after each step the state must equal GameState.from_game() of the engine
+# and offer the same legal actions, both must pay out the same stacks, and undo() must restore the state before each
+# step in turn - with a redeal() on top, which must take back only the cards
+def run_tests(hands=1000, seed=0):
+    rng = random.Random(seed)
+    for _ in range(hands):
+        seats = rng.randint(2, 6)
+        game = Game(random.Random(rng.random()), seats)
+        for player in game.players:
+            player.funds = rng.randint(1, 300)
+        engine = Engine(game, [None] * seats)
+        state = GameState.from_game(game, engine)
+        snapshots = [state.snapshot()]
+
+        while engine.result is None:
+            if engine.to_act is not None:
+                assert state.legal_actions() == engine.legal_actions(engine.to_act)
+                action = rng.choice(state.legal_actions())
+                amount = rng.randint(1, 100) if action == RAISE else 0
+                engine.act(action, amount)
+                state.apply(action, amount)
+            else:
+                assert state.legal_actions() == [DEAL]
+                engine.showdown() if game.stage == 'end' else engine.deal()
+                state.apply(DEAL)
+
+            if engine.result is None:
+                assert state.snapshot() == GameState.from_game(game, engine).snapshot(), state
+            snapshots.append(state.snapshot())
+
+        assert state.done and list(state.funds) == [player.funds for player in game.players]
+        state.redeal(0, rng)
+        state.undo()
+        while state.stack:
+            assert state.snapshot() == snapshots.pop(), state
+            state.undo()
+        assert state.snapshot() == snapshots.pop() and not state.log
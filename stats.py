@@ -0,0 +1,256 @@
+import argparse
+import math
+import os
+import pickle
+import random
+import sys
+import tempfile
+import time
+
+from engine import Engine, RandomPolicy
+from evaluator import HAND_NAMES
+from game import Game
+from preflop import CLASSES, class_name, hand_class
+
+# Checkpoints from another version of the job are refused rather than resumed
+CHECKPOINT_VERSION = 1
+CHECKPOINT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tables', 'stats.checkpoint')
+
+# Pots are counted in power-of-two bins, bin n holding pots of 2 ** (n - 1) thru 2 ** n - 1 chips
+POT_BINS = 32
+
+
+# Running count, mean and variance of a stream of numbers, updated one value at a time with Welford's method
+# merge() combines two of them as if one had seen both streams (Chan et al.), e.g. for jobs run in separate processes
+class RunningStats:
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.total = 0
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+
+    def merge(self, other):
+        count = self.count + other.count
+        if count:
+            delta = other.mean - self.mean
+            self.mean += delta * other.count / count
+            self.m2 += other.m2 + delta * delta * self.count * other.count / count
+        self.count = count
+        self.total += other.total
+
+    # Sample variance
+    @property
+    def variance(self):
+        return self.m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    @property
+    def std(self):
+        return math.sqrt(self.variance)
+
+
+# Fixed-size statistics of a stream of played hands, whatever its length:
+#   - dealt, wins and net by starting-hand class over every seat - the hands dealt, pots won (split pots as a share) and
+#     chips won or lost
+#   - the number of showdown hands of each category, and pots by size in POT_BINS power-of-two bins
+#   - bankroll, the running statistics of seat 0's chips won or lost per hand
+class Aggregates:
+    def __init__(self):
+        self.hands = 0
+        self.dealt = [0] * CLASSES
+        self.wins = [0.0] * CLASSES
+        self.net = [0] * CLASSES
+        self.categories = [0] * (len(HAND_NAMES) + 1)
+        self.pots = [0] * POT_BINS
+        self.bankroll = RunningStats()
+
+    # Add a hand the engine has just finished, given the starting-hand class of every seat
+    def add(self, engine, classes):
+        result = engine.result
+        self.hands += 1
+        for seat, index in enumerate(classes):
+            net = result.payouts[seat] - engine.contributed[seat]
+            self.dealt[index] += 1
+            self.net[index] += net
+            if seat in result.winners:
+                self.wins[index] += 1 / len(result.winners)
+
+        for hand in result.hands:
+            if hand is not None:
+                self.categories[hand[0]] += 1
+        self.pots[min(result.pot.bit_length(), POT_BINS - 1)] += 1
+        self.bankroll.add(result.payouts[0] - engine.contributed[0])
+
+    def merge(self, other):
+        self.hands += other.hands
+        for mine, theirs in ((self.dealt, other.dealt), (self.wins, other.wins), (self.net, other.net),
+                             (self.categories, other.categories), (self.pots, other.pots)):
+            for index, value in enumerate(theirs):
+                mine[index] += value
+        self.bankroll.merge(other.bankroll)
+
+    # Plain data for a checkpoint, which stays loadable whichever module the job was started from
+    def state(self):
+        return dict(vars(self), bankroll=vars(self.bankroll))
+
+    @classmethod
+    def from_state(cls, state):
+        aggregates = cls()
+        vars(aggregates).update(state)
+        aggregates.bankroll = RunningStats()
+        vars(aggregates.bankroll).update(state['bankroll'])
+        return aggregates
+
+    # Win rate and chips won per hand of each starting-hand class dealt at least once, best win rate first
+    def class_rates(self):
+        rates = [(class_name(index), self.dealt[index], self.wins[index] / self.dealt[index],
+                  self.net[index] / self.dealt[index]) for index in range(CLASSES) if self.dealt[index]]
+        return sorted(rates, key=lambda rate: -rate[2])
+
+    def report(self):
+        showdowns = sum(self.categories)
+        return {'hands': self.hands,
+                'categories': {HAND_NAMES[category]: self.categories[category] / showdowns if showdowns else 0.0
+                               for category in HAND_NAMES},
+                'pots': {f'{1 << index - 1 if index else 0}-{(1 << index) - 1}': count
+                         for index, count in enumerate(self.pots) if count},
+                'bankroll': {'total': self.bankroll.total,
+                             'mean': self.bankroll.mean,
+                             'std': self.bankroll.std,
+                             'per_100': self.bankroll.mean * 100}}
+
+
+# Long-running job which plays hands between seeded RandomPolicy bots and streams them into Aggregates, saving the
+# whole job - the engine with its game, deck and policy RNG states, and the aggregates - to path every checkpoint_every
+# hands by writing a new file and renaming it
+# Opening a job on an existing checkpoint resumes it, and since everything random comes from the saved RNG states a
+# resumed job plays exactly the hands the uninterrupted one would have, ending with bit-identical numbers
+class StatsJob:
+    def __init__(self, path=CHECKPOINT_PATH, seed=0, seats=2):
+        self.path = path
+
+        if path is not None and os.path.exists(path):
+            self.load()
+        else:
+            self.seed = seed
+            self.engine = Engine(Game(random.Random(seed), seats),
+                                 [RandomPolicy(random.Random(f'{seed}:{seat}')) for seat in range(seats)])
+            self.aggregates = Aggregates()
+
+    # Play until the job has played hands in total, checkpointing along the way and calling progress with the hands
+    # played and the seconds taken by this run
+    def run(self, hands, checkpoint_every=100000, progress=None):
+        engine = self.engine
+        game = engine.game
+        aggregates = self.aggregates
+        begun = time.perf_counter()
+
+        while aggregates.hands < hands:
+            if engine.game_over:
+                game.new_game()
+                engine.reset()
+
+            classes = [hand_class(player.cards) for player in game.players]
+            engine.play_hand()
+            aggregates.add(engine, classes)
+
+            if aggregates.hands % checkpoint_every == 0 or aggregates.hands == hands:
+                if self.path is not None:
+                    self.checkpoint()
+                if progress is not None:
+                    progress(aggregates.hands, time.perf_counter() - begun)
+
+        return aggregates
+
+    def checkpoint(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        state = {'version': CHECKPOINT_VERSION, 'seed': self.seed, 'engine': self.engine,
+                 'aggregates': self.aggregates.state()}
+        with open(f'{self.path}.tmp', 'wb') as file:
+            pickle.dump(state, file, pickle.HIGHEST_PROTOCOL)
+        os.replace(f'{self.path}.tmp', self.path)
+
+    def load(self):
+        with open(self.path, 'rb') as file:
+            state = pickle.load(file)
+        if state.get('version') != CHECKPOINT_VERSION:
+            raise ValueError(f'{self.path} is not a version {CHECKPOINT_VERSION} checkpoint')
+
+        self.seed = state['seed']
+        self.engine = state['engine']
+        self.aggregates = Aggregates.from_state(state['aggregates'])
+
+
+# Check that a job stopped partway resumes exactly: a job interrupted right after a checkpoint, then opened again on its
+# checkpoint and run to the end, must finish with the same aggregates and stacks as one run straight through
+def run_tests(hands=3000, every=500, stop_at=1500, seats=3):
+    class Stop(Exception):
+        pass
+
+    def stop(played, seconds):
+        if played == stop_at:
+            raise Stop
+
+    with tempfile.TemporaryDirectory() as directory:
+        straight = StatsJob(os.path.join(directory, 'straight.checkpoint'), 7, seats)
+        straight.run(hands, every)
+
+        path = os.path.join(directory, 'resumed.checkpoint')
+        try:
+            StatsJob(path, 7, seats).run(hands, every, stop)
+        except Stop:
+            pass
+        resumed = StatsJob(path)
+        assert resumed.aggregates.hands == stop_at
+        resumed.run(hands, every)
+
+    assert resumed.aggregates.state() == straight.aggregates.state()
+    assert [player.funds for player in resumed.engine.players] == [player.funds for player in straight.engine.players]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Stream simulated hands into statistics, resuming from a checkpoint.')
+    parser.add_argument('-n', '--hands', type=int, default=1000000, help='total hands the job plays')
+    parser.add_argument('--seats', type=int, default=2)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--checkpoint', default=CHECKPOINT_PATH, help='checkpoint file, resumed if it exists')
+    parser.add_argument('--every', type=int, default=100000, help='hands between checkpoints')
+    parser.add_argument('--top', type=int, default=10, help='starting hands listed at each end of the table')
+    args = parser.parse_args(argv)
+
+    job = StatsJob(args.checkpoint, args.seed, args.seats)
+    if job.aggregates.hands:
+        print(f'resuming at hand {job.aggregates.hands:,}', file=sys.stderr)
+
+    def progress(hands, seconds):
+        print(f'\r{hands:>13,} / {args.hands:,} hands  {seconds:8.1f}s', end='', file=sys.stderr, flush=True)
+
+    aggregates = job.run(args.hands, args.every, progress)
+    print(file=sys.stderr)
+    report = aggregates.report()
+
+    rates = aggregates.class_rates()
+    print(f'{"hand":>5} {"dealt":>10} {"won":>7} {"chips/hand":>11}')
+    for name, dealt, win_rate, net in rates[:args.top] + rates[max(args.top, len(rates) - args.top):]:
+        print(f'{name:>5} {dealt:>10,} {win_rate:7.2%} {net:11.2f}')
+    print()
+    for name, share in report['categories'].items():
+        print(f'{name:>16} {share:7.2%} of showdown hands')
+    print()
+    for pots, count in report['pots'].items():
+        print(f'{pots:>12} chips {count:>12,} pots')
+    bankroll = report['bankroll']
+    print(f'\nseat 0: {bankroll["total"]:+,} chips, {bankroll["per_100"]:+.2f} per 100 hands, '
+          f'std {bankroll["std"]:.2f} per hand')
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())